@@ -1,393 +1,315 @@
+import io
 import os
-import smtplib
-import psycopg2
+import hmac
+import json
+import time
+import hashlib
+import threading
 from email.message import EmailMessage
 from email.utils import formataddr
-from flask import Flask, render_template_string, request, redirect, url_for
+from flask import Flask, Response, abort, g, jsonify, request, redirect, url_for
 from datetime import datetime, date
 from dotenv import load_dotenv
+from smtp_session import open_session
+from template_registry import render_page, ConfirmationRenderer, TEMPLATE_VERSION
+from db_pool import ConnectionPool, ReadRouter
+from page_cache import PageCache, RedisBackend
+from decimal import Decimal
+from metrics import timed
+import metrics
+import outbox
+import reconcile
 
 # Load environment variables
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Optional streaming replica for read-only lookups such as the payment page
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
 SENDER_EMAIL = os.getenv("EMAIL")
 PASSWORD = os.getenv("PASSWORD")
 
 if not all([DATABASE_URL, SENDER_EMAIL, PASSWORD]):
     raise ValueError("Missing environment variables. Check .env file")
 
-SMTP_SERVER = "smtp.gmail.com"
-PORT = 587
+# Bearer token for POST /admin/reconcile; the endpoint is disabled when unset
+RECONCILE_TOKEN = os.getenv("RECONCILE_TOKEN")
+
+# Per-process connection pool; each gunicorn worker builds its own after the fork
+db_pool = ConnectionPool(
+    DATABASE_URL,
+    min_size=int(os.getenv("DB_POOL_MIN", 1)),
+    max_size=int(os.getenv("DB_POOL_MAX", 10)),
+    timeout=float(os.getenv("DB_POOL_TIMEOUT", 10)),
+)
+
+# Payment-page reads go to the replica while it keeps up; writes, and reads
+# that must see them, always use db_pool
+read_pool = ReadRouter(
+    db_pool,
+    ConnectionPool(
+        DATABASE_REPLICA_URL,
+        min_size=int(os.getenv("DB_POOL_MIN", 1)),
+        max_size=int(os.getenv("DB_POOL_MAX", 10)),
+        timeout=float(os.getenv("DB_REPLICA_TIMEOUT", 2)),
+    ),
+    max_lag=float(os.getenv("DB_REPLICA_MAX_LAG", 5)),
+    retry_after=float(os.getenv("DB_REPLICA_RETRY_AFTER", 10)),
+) if DATABASE_REPLICA_URL else db_pool
 
 app = Flask(__name__)
 
+# Per-process, like the pool: each gunicorn worker reports its own requests
+REQUEST_SECONDS = metrics.REGISTRY.histogram(
+    "http_request_duration_seconds", "Request latency per route", ("route", "method", "status"))
+
+# Confirmation emails reuse one authenticated SMTP connection per worker process.
+# Created lazily so each gunicorn worker opens its own after the fork.
+_smtp_session = None
+_smtp_lock = threading.Lock()
+
+def get_smtp_session():
+    global _smtp_session
+    if _smtp_session is None:
+        _smtp_session = open_session(SENDER_EMAIL, PASSWORD)
+    return _smtp_session
+
+def keep_smtp_session_alive():
+    """NOOP the idle confirmation connection (the outbox worker calls this while it waits)"""
+    with _smtp_lock:
+        if _smtp_session is not None:
+            _smtp_session.keepalive()
+
 def get_connection():
-    return psycopg2.connect(DATABASE_URL)
+    """Borrow a connection from the pool; hand it back with release_connection()"""
+    with timed("db_connect"):
+        return db_pool.getconn()
+
+def release_connection(conn):
+    db_pool.putconn(conn)
+
+def get_read_connection():
+    """Borrow a connection for a read-only lookup; hand it back with release_read_connection()"""
+    with timed("db_connect"):
+        return read_pool.getconn()
+
+def release_read_connection(conn):
+    read_pool.putconn(conn)
+
+# ---------------- METRICS ----------------
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.observe(time.perf_counter() - started, route, request.method, str(response.status_code))
+    return response
+
+@app.route("/metrics")
+def metrics_page():
+    """Prometheus scrape endpoint: request latency, stage timings and pool stats"""
+    lines = metrics.REGISTRY.render()
+    lines += metrics.render_gauges("db_pool", db_pool.stats())
+    if read_pool is not db_pool:
+        lines += metrics.render_gauges("db_replica", read_pool.stats())
+    lines += metrics.render_gauges("payment_page_cache", payment_cache.stats())
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
 
 # ---------------- PAYMENT PAGE ----------------
-@app.route("/pay/<loan_id>")
-def payment_page(loan_id):
-    conn = get_connection()
+PAYMENT_PAGE_SQL = """
+    SELECT id, name, amount, email 
+    FROM customers 
+    WHERE id = %s AND payment_status = 'UNPAID'
+"""
+
+def load_payment_page(loan_id):
+    """Fields shown on the payment page, or None if the loan is paid or unknown"""
+    conn = get_read_connection()
     cur = conn.cursor()
     
     try:
         # Fetch customer details
-        cur.execute("""
-            SELECT id, name, amount, email 
-            FROM customers 
-            WHERE id = %s AND payment_status = 'UNPAID'
-        """, (loan_id,))
-        
-        customer = cur.fetchone()
-        
-        if not customer:
-            return render_template_string("""
-                <div style="font-family: sans-serif; text-align: center; margin-top: 50px;">
-                    <h2 style="color: #dc3545;">Payment Link Expired</h2>
-                    <p>This payment has already been processed or the link is invalid.</p>
-                </div>
-            """)
-        
-        customer_id, name, amount, email = customer
-        
-        return render_template_string("""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <title>Payment Portal</title>
-                <style>
-                    body {
-                        font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                        min-height: 100vh;
-                        display: flex;
-                        justify-content: center;
-                        align-items: center;
-                        margin: 0;
-                    }
-                    .container {
-                        background: white;
-                        padding: 40px;
-                        border-radius: 20px;
-                        box-shadow: 0 20px 60px rgba(0,0,0,0.3);
-                        max-width: 500px;
-                        width: 90%;
-                        text-align: center;
-                    }
-                    h2 {
-                        color: #333;
-                        margin-bottom: 30px;
-                    }
-                    .info-box {
-                        background: #f8f9fa;
-                        padding: 20px;
-                        border-radius: 10px;
-                        margin: 20px 0;
-                        text-align: left;
-                    }
-                    .info-item {
-                        margin: 10px 0;
-                        display: flex;
-                        justify-content: space-between;
-                    }
-                    .amount {
-                        font-size: 2em;
-                        color: #28a745;
-                        font-weight: bold;
-                        margin: 20px 0;
-                    }
-                    .pay-button {
-                        background: linear-gradient(to right, #28a745, #20c997);
-                        color: white;
-                        border: none;
-                        padding: 15px 40px;
-                        font-size: 1.2em;
-                        border-radius: 50px;
-                        cursor: pointer;
-                        transition: all 0.3s ease;
-                        margin-top: 20px;
-                        width: 100%;
-                    }
-                    .pay-button:hover {
-                        transform: translateY(-2px);
-                        box-shadow: 0 10px 20px rgba(40, 167, 69, 0.3);
-                    }
-                    .customer-name {
-                        color: #667eea;
-                        font-size: 1.5em;
-                        margin-bottom: 10px;
-                    }
-                </style>
-            </head>
-            <body>
-                <div class="container">
-                    <h2>💰 Payment Portal</h2>
-                    <div class="customer-name">Hello, {{ name }}</div>
-                    
-                    <div class="info-box">
-                        <div class="info-item">
-                            <span>Loan ID:</span>
-                            <span><strong>{{ loan_id }}</strong></span>
-                        </div>
-                        <div class="info-item">
-                            <span>Due Amount:</span>
-                            <span class="amount">₹{{ "%.2f"|format(amount) }}</span>
-                        </div>
-                    </div>
-                    
-                    <form action="/pay/confirm/{{ loan_id }}" method="POST">
-                        <button type="submit" class="pay-button">
-                            🚀 Confirm & Pay Now
-                        </button>
-                    </form>
-                    
-                    <p style="margin-top: 20px; color: #666; font-size: 0.9em;">
-                        You'll receive a confirmation email after successful payment.
-                    </p>
-                </div>
-            </body>
-            </html>
-        """, name=name, loan_id=loan_id, amount=amount)
-        
-    except Exception as e:
-        return f"<h3>Error: {str(e)}</h3>"
+        with timed("db_query"):
+            cur.execute(PAYMENT_PAGE_SQL, (loan_id,))
+            customer = cur.fetchone()
     finally:
         cur.close()
-        conn.close()
+        release_read_connection(conn)
+    
+    if not customer:
+        return None
+    
+    customer_id, name, amount, email = customer
+    return {"name": name, "amount": str(amount)}
+
+# Readers open the same link several times (preview, click, refresh). Entries
+# turn negative on payment; PAGE_CACHE_URL shares them across gunicorn workers.
+payment_cache = PageCache(
+    load_payment_page,
+    max_entries=int(os.getenv("PAGE_CACHE_SIZE", 10000)),
+    ttl=float(os.getenv("PAGE_CACHE_TTL", 300)),
+    negative_ttl=float(os.getenv("PAGE_CACHE_NEGATIVE_TTL", 60)),
+    shared=RedisBackend(os.getenv("PAGE_CACHE_URL")) if os.getenv("PAGE_CACHE_URL") else None,
+    local_ttl=float(os.getenv("PAGE_CACHE_LOCAL_TTL", 5)),
+)
+
+def parse_loan_id(value):
+    """The loan id in a payment link, or None if it cannot be one (no query needed)"""
+    # isdigit() alone lets through characters like '²' that int() rejects
+    return int(value) if value.isascii() and value.isdecimal() else None
+
+def payment_page_etag(loan_id, customer):
+    state = json.dumps([TEMPLATE_VERSION, loan_id, customer], sort_keys=True)
+    return hashlib.sha1(state.encode()).hexdigest()
+
+@app.route("/pay/<loan_id>")
+def payment_page(loan_id):
+    # Ids that cannot be a loan are answered with the expired page, no query
+    loan_id = parse_loan_id(loan_id)
+    
+    try:
+        customer = payment_cache.get(loan_id) if loan_id is not None else None
+    except Exception as e:
+        return f"<h3>Error: {str(e)}</h3>"
+    
+    # Browsers revalidate every view; an unchanged page costs a 304 and no query
+    etag = payment_page_etag(loan_id, customer)
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    elif not customer:
+        response = Response(render_page("payment_expired"))
+    else:
+        response = Response(render_page("payment", name=customer["name"], loan_id=loan_id,
+                                        amount=Decimal(customer["amount"])))
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
 
 # ---------------- PAYMENT CONFIRMATION ----------------
+# Mark the loan paid, record the payment and queue the confirmation email in
+# one statement. The conditional UPDATE takes the row lock, so of several
+# concurrent confirms only one sees the UNPAID row; the rest get zero rows back.
+CONFIRM_PAYMENT_SQL = """
+    WITH paid AS (
+        UPDATE customers
+        SET payment_status = 'PAID',
+            paid_at = CURRENT_TIMESTAMP
+        WHERE id = %(loan_id)s AND payment_status = 'UNPAID'
+        RETURNING id, name, email, amount, paid_at
+    ), payment AS (
+        INSERT INTO payments (customer_id, amount, status, payment_date)
+        SELECT id, amount, 'SUCCESS', paid_at FROM paid
+    ), queued AS (
+        INSERT INTO email_outbox (kind, payload)
+        SELECT 'payment_confirmation', """ + outbox.CONFIRMATION_PAYLOAD_SQL + """
+        FROM paid
+    )
+    SELECT id, name, email, amount, pg_notify(%(channel)s, '')
+    FROM paid
+"""
+
 @app.route("/pay/confirm/<loan_id>", methods=["POST"])
 def confirm_payment(loan_id):
     conn = get_connection()
     cur = conn.cursor()
     
     try:
-        # Fetch customer details
-        cur.execute("""
-            SELECT id, name, email, amount 
-            FROM customers 
-            WHERE id = %s AND payment_status = 'UNPAID'
-        """, (loan_id,))
-        
-        customer = cur.fetchone()
+        # Single round trip; the outbox row and NOTIFY commit together with the
+        # payment and the worker delivers the email off the request path
+        with timed("db_query"):
+            cur.execute(CONFIRM_PAYMENT_SQL, {"loan_id": loan_id, "channel": outbox.NOTIFY_CHANNEL})
+            customer = cur.fetchone()
         
         if not customer:
-            return render_template_string("""
-                <div style="text-align: center; margin-top: 50px;">
-                    <h2 style="color: #dc3545;">❌ Payment Already Processed</h2>
-                    <p>This payment has already been completed.</p>
-                </div>
-            """)
-        
-        customer_id, name, email, amount = customer
+            return render_page("payment_processed")
         
-        # Update payment status
-        cur.execute("""
-            UPDATE customers 
-            SET payment_status = 'PAID', 
-                paid_at = CURRENT_TIMESTAMP 
-            WHERE id = %s
-        """, (loan_id,))
+        customer_id, name, email, amount, _ = customer
         
-        # Log payment in payments table
-        cur.execute("""
-            INSERT INTO payments (customer_id, amount, status, payment_date) 
-            VALUES (%s, %s, 'SUCCESS', CURRENT_TIMESTAMP)
-        """, (customer_id, amount))
+        with timed("db_query"):
+            conn.commit()
+        # Cache the paid state rather than evicting: a reload could go to a
+        # replica that has not replayed this commit yet and cache the loan as
+        # UNPAID for the full TTL
+        payment_cache.put(int(loan_id), None)
         
-        conn.commit()
-        
-        # Send confirmation email
-        send_confirmation_email(name, email, loan_id, amount)
-        
-        return render_template_string("""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <title>Payment Successful</title>
-                <style>
-                    body {
-                        font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                        background: linear-gradient(135deg, #4CAF50 0%, #2E7D32 100%);
-                        min-height: 100vh;
-                        display: flex;
-                        justify-content: center;
-                        align-items: center;
-                        margin: 0;
-                    }
-                    .container {
-                        background: white;
-                        padding: 50px;
-                        border-radius: 20px;
-                        box-shadow: 0 20px 60px rgba(0,0,0,0.3);
-                        max-width: 600px;
-                        width: 90%;
-                        text-align: center;
-                    }
-                    .success-icon {
-                        font-size: 4em;
-                        color: #28a745;
-                        margin-bottom: 20px;
-                    }
-                    h2 {
-                        color: #333;
-                        margin-bottom: 20px;
-                    }
-                    .details {
-                        background: #f8f9fa;
-                        padding: 20px;
-                        border-radius: 10px;
-                        margin: 20px 0;
-                        text-align: left;
-                    }
-                    .detail-item {
-                        margin: 10px 0;
-                        display: flex;
-                        justify-content: space-between;
-                        padding: 8px 0;
-                        border-bottom: 1px solid #dee2e6;
-                    }
-                    .detail-item:last-child {
-                        border-bottom: none;
-                    }
-                    .amount {
-                        font-size: 1.5em;
-                        color: #28a745;
-                        font-weight: bold;
-                    }
-                </style>
-            </head>
-            <body>
-                <div class="container">
-                    <div class="success-icon">✅</div>
-                    <h2>Payment Successful!</h2>
-                    <p>Thank you for your payment. A confirmation email has been sent to:</p>
-                    <p><strong>{{ email }}</strong></p>
-                    
-                    <div class="details">
-                        <div class="detail-item">
-                            <span>Customer Name:</span>
-                            <span><strong>{{ name }}</strong></span>
-                        </div>
-                        <div class="detail-item">
-                            <span>Loan ID:</span>
-                            <span><strong>{{ loan_id }}</strong></span>
-                        </div>
-                        <div class="detail-item">
-                            <span>Amount Paid:</span>
-                            <span class="amount">₹{{ "%.2f"|format(amount) }}</span>
-                        </div>
-                        <div class="detail-item">
-                            <span>Status:</span>
-                            <span style="color: #28a745; font-weight: bold;">PAID</span>
-                        </div>
-                        <div class="detail-item">
-                            <span>Date:</span>
-                            <span>{{ date }}</span>
-                        </div>
-                    </div>
-                    
-                    <p style="color: #666; margin-top: 20px;">
-                        Your payment has been processed successfully. Keep this confirmation for your records.
-                    </p>
-                </div>
-            </body>
-            </html>
-        """, name=name, email=email, loan_id=loan_id, amount=amount, date=date.today())
+        return render_page("payment_success", name=name, email=email, loan_id=loan_id, amount=amount, date=date.today())
         
     except Exception as e:
         conn.rollback()
         return f"<h3>❌ Database Error: {str(e)}</h3>"
     finally:
         cur.close()
-        conn.close()
+        release_connection(conn)
 
-# ---------------- CONFIRMATION EMAIL ----------------
-def send_confirmation_email(name, receiver_email, loan_id, amount):
-    msg = EmailMessage()
-    msg["Subject"] = f"Payment Confirmation - Loan ID: {loan_id}"
-    msg["From"] = formataddr(("Loan Department", SENDER_EMAIL))
-    msg["To"] = receiver_email
-    
-    html_content = f"""
-    <html>
-    <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-        <div style="max-width: 600px; margin: 0 auto; padding: 20px; border: 1px solid #ddd; border-radius: 10px;">
-            <div style="text-align: center; margin-bottom: 30px;">
-                <h2 style="color: #28a745;">✅ Payment Confirmation</h2>
-            </div>
-            
-            <p>Dear <strong>{name}</strong>,</p>
-            
-            <p>We're pleased to confirm that we have successfully received your payment.</p>
-            
-            <div style="background: #f8f9fa; padding: 20px; border-radius: 8px; margin: 20px 0;">
-                <h3 style="margin-top: 0;">Transaction Details:</h3>
-                <table style="width: 100%;">
-                    <tr>
-                        <td style="padding: 8px 0;">Loan Reference ID:</td>
-                        <td style="padding: 8px 0;"><strong>{loan_id}</strong></td>
-                    </tr>
-                    <tr>
-                        <td style="padding: 8px 0;">Amount Paid:</td>
-                        <td style="padding: 8px 0;"><strong style="color: #28a745; font-size: 1.2em;">₹{amount:.2f}</strong></td>
-                    </tr>
-                    <tr>
-                        <td style="padding: 8px 0;">Status:</td>
-                        <td style="padding: 8px 0;"><span style="color: #28a745; font-weight: bold;">PAID</span></td>
-                    </tr>
-                    <tr>
-                        <td style="padding: 8px 0;">Date:</td>
-                        <td style="padding: 8px 0;">{datetime.now().strftime('%d %B, %Y %I:%M %p')}</td>
-                    </tr>
-                </table>
-            </div>
-            
-            <p>Your payment has been processed and your account is now up to date.</p>
-            
-            <p>Thank you for your timely payment.</p>
-            
-            <div style="margin-top: 30px; padding-top: 20px; border-top: 1px solid #ddd;">
-                <p>Best regards,<br>
-                <strong>Loan Department</strong></p>
-            </div>
-        </div>
-    </body>
-    </html>
+# ---------------- BULK RECONCILIATION ----------------
+@app.route("/admin/reconcile", methods=["POST"])
+def reconcile_settlement():
+    """Apply a bank settlement file sent as the CSV body or a 'file' upload.
+
+    Returns the JSON report of reconcile.reconcile(); `?dry_run=1` only
+    reports, `?column=` names the loan id column.
     """
+    if not RECONCILE_TOKEN:
+        abort(404)
+    supplied = request.headers.get("Authorization", "").encode()
+    if not hmac.compare_digest(supplied, f"Bearer {RECONCILE_TOKEN}".encode()):
+        return Response("Unauthorized\n", 401, {"WWW-Authenticate": "Bearer"})
     
-    # Plain text fallback
-    text_content = f"""
-Dear {name},
-
-We're pleased to confirm that we have successfully received your payment.
-
-Transaction Details:
-- Loan Reference ID: {loan_id}
-- Amount Paid: ₹{amount:.2f}
-- Status: PAID
-- Date: {datetime.now().strftime('%d %B, %Y %I:%M %p')}
-
-Your payment has been processed and your account is now up to date.
+    upload = request.files.get("file")
+    source = io.TextIOWrapper(upload.stream if upload else request.stream, encoding="utf-8-sig", newline="")
+    dry_run = request.args.get("dry_run") == "1"
+    
+    conn = get_connection()
+    try:
+        report = reconcile.reconcile(conn, source, request.args.get("column", "loan_id"), dry_run)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        release_connection(conn)
+    
+    if not dry_run:
+        for loan_id in report["ids"]["matched"]:
+            payment_cache.put(int(loan_id), None)
+    return jsonify(report)
 
-Thank you for your timely payment.
+# ---------------- CONFIRMATION EMAIL ----------------
+confirmation_renderer = ConfirmationRenderer()
 
-Best regards,
-Loan Department
-"""
+def send_confirmation_email(name, receiver_email, loan_id, amount, paid_at=None):
+    """Send the payment confirmation; returns `(success, error)`"""
+    subject, text_content, html_content = confirmation_renderer.render(name, loan_id, amount, paid_at)
     
-    msg.set_content(text_content)
-    msg.add_alternative(html_content, subtype='html')
+    with timed("mime_build"):
+        msg = EmailMessage()
+        msg["Subject"] = subject
+        msg["From"] = formataddr(("Loan Department", SENDER_EMAIL))
+        msg["To"] = receiver_email
+        
+        msg.set_content(text_content)
+        msg.add_alternative(html_content, subtype='html')
     
     try:
-        with smtplib.SMTP(SMTP_SERVER, PORT) as server:
-            server.starttls()
-            server.login(SENDER_EMAIL, PASSWORD)
-            server.send_message(msg)
+        with _smtp_lock:
+            get_smtp_session().send(msg)
         print(f"✅ Confirmation email sent to {name} ({receiver_email})")
+        return True, None
     except Exception as e:
         print(f"❌ Failed to send confirmation email to {receiver_email}: {e}")
+        return False, str(e)
+
+def deliver_confirmation_email(payload):
+    """Outbox handler for 'payment_confirmation' rows"""
+    return send_confirmation_email(
+        payload["name"],
+        payload["email"],
+        payload["loan_id"],
+        Decimal(payload["amount"]),
+        paid_at=datetime.fromisoformat(payload["paid_at"]),
+    )
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 5000))
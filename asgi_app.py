@@ -0,0 +1,205 @@
+import os
+import re
+import time
+import asyncio
+from datetime import date
+from decimal import Decimal
+import asyncpg
+import app as flask_app
+import metrics
+import outbox
+from template_registry import render_page
+from page_cache import PageCache, AsyncRedisBackend
+from metrics import timed
+
+DATABASE_URL = flask_app.DATABASE_URL
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+# asyncpg prepares every statement; set 0 behind PgBouncer in transaction mode
+# (e.g. Neon's -pooler endpoints), which cannot keep prepared statements
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))
+
+MAX_LOAN_ID = 2 ** 31 - 1  # customers.id is an INTEGER
+
+# app.py's statements with asyncpg's numbered placeholders. The loan id is
+# cast in SQL, as psycopg2's quoted literal is, so a malformed id fails in
+# Postgres with the same error the Flask app shows.
+PAYMENT_PAGE_SQL = flask_app.PAYMENT_PAGE_SQL.replace("%s", "$1")
+CONFIRM_PAYMENT_SQL = (flask_app.CONFIRM_PAYMENT_SQL
+                       .replace("%(loan_id)s", "$1::text::integer")
+                       .replace("%(channel)s", "$2"))
+
+HTML = b"text/html; charset=utf-8"
+PAGE_ROUTE = re.compile(r"/pay/([^/]+)")
+CONFIRM_ROUTE = re.compile(r"/pay/confirm/([^/]+)")
+
+_pool = None
+_pool_lock = asyncio.Lock()
+
+
+async def get_pool():
+    """The worker's asyncpg pool, created on first use inside its event loop"""
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                with timed("db_connect"):
+                    _pool = await asyncpg.create_pool(
+                        DATABASE_URL, min_size=DB_POOL_MIN, max_size=DB_POOL_MAX,
+                        statement_cache_size=DB_STATEMENT_CACHE_SIZE)
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def pool_stats():
+    if _pool is None:
+        return {}
+    return {
+        "max_size": _pool.get_max_size(),
+        "size": _pool.get_size(),
+        "in_use": _pool.get_size() - _pool.get_idle_size(),
+    }
+
+
+# ---------------- PAYMENT PAGE ----------------
+async def load_payment_page(loan_id):
+    """Fields shown on the payment page, or None if the loan is paid or unknown"""
+    pool = await get_pool()
+    with timed("db_query"):
+        customer = await pool.fetchrow(PAYMENT_PAGE_SQL, loan_id, timeout=DB_POOL_TIMEOUT)
+    if not customer:
+        return None
+    return {"name": customer["name"], "amount": str(customer["amount"])}
+
+payment_cache = PageCache(
+    load_payment_page,
+    max_entries=int(os.getenv("PAGE_CACHE_SIZE", 10000)),
+    ttl=float(os.getenv("PAGE_CACHE_TTL", 300)),
+    negative_ttl=float(os.getenv("PAGE_CACHE_NEGATIVE_TTL", 60)),
+    shared=AsyncRedisBackend(os.getenv("PAGE_CACHE_URL")) if os.getenv("PAGE_CACHE_URL") else None,
+    local_ttl=float(os.getenv("PAGE_CACHE_LOCAL_TTL", 5)),
+)
+
+
+def if_none_match(headers):
+    """Strong entity tags of an If-None-Match header; '*' matches any"""
+    value = headers.get(b"if-none-match", b"").decode("latin-1")
+    return {tag.strip().strip('"') for tag in value.split(",")
+            if tag.strip() and not tag.strip().startswith("W/")}
+
+
+async def payment_page(loan_id, headers):
+    # Ids that cannot be a loan are answered with the expired page, no query
+    loan_id = flask_app.parse_loan_id(loan_id)
+    
+    try:
+        # Beyond INTEGER there is no loan (asyncpg would refuse the parameter)
+        customer = await payment_cache.get_async(loan_id) if loan_id is not None and loan_id <= MAX_LOAN_ID else None
+    except Exception as e:
+        return 200, [], f"<h3>Error: {str(e)}</h3>"
+
+    etag = flask_app.payment_page_etag(loan_id, customer)
+    response_headers = [(b"etag", f'"{etag}"'.encode()), (b"cache-control", b"private, no-cache")]
+    tags = if_none_match(headers)
+    if etag in tags or "*" in tags:
+        return 304, response_headers, ""
+    if not customer:
+        return 200, response_headers, render_page("payment_expired")
+    return 200, response_headers, render_page("payment", name=customer["name"], loan_id=loan_id,
+                                              amount=Decimal(customer["amount"]))
+
+
+# ---------------- PAYMENT CONFIRMATION ----------------
+async def confirm_payment(loan_id):
+    try:
+        pool = await get_pool()
+        async with pool.acquire(timeout=DB_POOL_TIMEOUT) as conn:
+            # One statement, as in app.py: the outbox row and NOTIFY commit
+            # with the payment and the worker sends the email
+            with timed("db_query"):
+                async with conn.transaction():
+                    customer = await conn.fetchrow(CONFIRM_PAYMENT_SQL, loan_id, outbox.NOTIFY_CHANNEL)
+    except Exception as e:
+        return 200, [], f"<h3>❌ Database Error: {str(e)}</h3>"
+
+    if not customer:
+        return 200, [], render_page("payment_processed")
+
+    # Cache the paid state rather than evicting, as app.py does: with a shared
+    # cache, a Flask worker could reload the loan from a lagging replica and
+    # cache it as UNPAID for the full TTL
+    await payment_cache.put_async(int(loan_id), None)
+    return 200, [], render_page("payment_success", name=customer["name"], email=customer["email"],
+                                loan_id=loan_id, amount=customer["amount"], date=date.today())
+
+
+# ---------------- METRICS ----------------
+def metrics_page():
+    lines = metrics.REGISTRY.render()
+    lines += metrics.render_gauges("db_pool", pool_stats())
+    lines += metrics.render_gauges("payment_page_cache", payment_cache.stats())
+    return "\n".join(lines) + "\n"
+
+
+# ---------------- ASGI ----------------
+async def route(method, path, headers):
+    """Return `(route, status, headers, body)` for a request"""
+    match = CONFIRM_ROUTE.fullmatch(path)
+    if match:
+        if method != "POST":
+            return "/pay/confirm/<loan_id>", 405, [(b"allow", b"POST")], "Method Not Allowed"
+        return ("/pay/confirm/<loan_id>",) + await confirm_payment(match.group(1))
+    match = PAGE_ROUTE.fullmatch(path)
+    if match:
+        if method not in ("GET", "HEAD"):
+            return "/pay/<loan_id>", 405, [(b"allow", b"GET, HEAD")], "Method Not Allowed"
+        return ("/pay/<loan_id>",) + await payment_page(match.group(1), headers)
+    if path == "/metrics" and method in ("GET", "HEAD"):
+        return "/metrics", 200, [(b"content-type", b"text/plain; version=0.0.4")], metrics_page()
+    return "unmatched", 404, [], "<h1>Not Found</h1>"
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await get_pool()
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await close_pool()
+            if payment_cache.shared is not None:
+                await payment_cache.shared.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    started = time.perf_counter()
+    method = scope["method"]
+    headers = dict(scope["headers"])
+    route_name, status, response_headers, body = await route(method, scope["path"], headers)
+    body = body.encode()
+    if status != 304 and not any(name == b"content-type" for name, _ in response_headers):
+        response_headers.append((b"content-type", HTML))
+    response_headers.append((b"content-length", str(len(body)).encode()))
+
+    await send({"type": "http.response.start", "status": status, "headers": response_headers})
+    await send({"type": "http.response.body", "body": b"" if method == "HEAD" else body})
+    flask_app.REQUEST_SECONDS.observe(time.perf_counter() - started, route_name, method, str(status))
@@ -0,0 +1,138 @@
+"""Concurrency and latency check for POST /pay/confirm/<loan_id>.
+
+Run against a scratch database (it inserts its own customers):
+
+    DATABASE_URL=postgresql://... EMAIL=x PASSWORD=x \
+        python benchmarks/confirm_concurrency.py --concurrency 50 --samples 200
+
+1. Race: fires `--concurrency` simultaneous confirms at one loan through the
+   Flask app and fails unless exactly one payments row and one outbox row exist.
+2. Latency: times `--samples` confirms with the old SELECT + UPDATE + INSERT
+   sequence and with the single-statement CONFIRM_PAYMENT_SQL.
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+import app as payment_app
+import outbox
+import migrations
+
+
+def seed_customers(conn, count):
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO customers (name, email, amount, due_date, payment_status)
+            SELECT 'Bench ' || g, 'bench' || g || '@example.com', 100 + g, CURRENT_DATE, 'UNPAID'
+            FROM generate_series(1, %s) g
+            RETURNING id
+        """, (count,))
+        ids = [row[0] for row in cur.fetchall()]
+    conn.commit()
+    return ids
+
+
+def run_race(conn, concurrency):
+    loan_id = seed_customers(conn, 1)[0]
+    barrier = threading.Barrier(concurrency)
+    statuses = []
+
+    def fire():
+        client = payment_app.app.test_client()
+        barrier.wait()
+        response = client.post(f"/pay/confirm/{loan_id}")
+        statuses.append(b"Payment Successful" in response.data)
+
+    threads = [threading.Thread(target=fire) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT count(*) FROM payments WHERE customer_id = %s", (loan_id,))
+        payments = cur.fetchone()[0]
+        cur.execute("SELECT count(*) FROM email_outbox WHERE (payload->>'loan_id')::int = %s", (loan_id,))
+        queued = cur.fetchone()[0]
+    conn.commit()
+
+    print(f"Race: {concurrency} concurrent confirms -> {sum(statuses)} success page(s), "
+          f"{payments} payment row(s), {queued} outbox row(s)")
+    return payments == 1 and queued == 1 and sum(statuses) == 1
+
+
+def legacy_confirm(conn, loan_id):
+    """The pre-CTE confirm path: three statements, no row lock"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT id, name, email, amount FROM customers
+            WHERE id = %s AND payment_status = 'UNPAID'
+        """, (loan_id,))
+        customer_id, name, email, amount = cur.fetchone()
+        cur.execute("""
+            UPDATE customers SET payment_status = 'PAID', paid_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+        """, (loan_id,))
+        cur.execute("""
+            INSERT INTO payments (customer_id, amount, status, payment_date)
+            VALUES (%s, %s, 'SUCCESS', CURRENT_TIMESTAMP)
+        """, (customer_id, amount))
+        outbox.enqueue(cur, "payment_confirmation", {
+            "name": name, "email": email, "loan_id": loan_id, "amount": amount,
+            "paid_at": payment_app.datetime.now(),
+        })
+    conn.commit()
+
+
+def single_statement_confirm(conn, loan_id):
+    with conn.cursor() as cur:
+        cur.execute(payment_app.CONFIRM_PAYMENT_SQL, {"loan_id": loan_id, "channel": outbox.NOTIFY_CHANNEL})
+        cur.fetchone()
+    conn.commit()
+
+
+def time_confirms(conn, confirm, samples):
+    latencies = []
+    for loan_id in seed_customers(conn, samples):
+        started = time.perf_counter()
+        confirm(conn, loan_id)
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return {
+        "mean_ms": round(statistics.mean(latencies), 3),
+        "p50_ms": round(latencies[len(latencies) // 2], 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--samples", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    conn = psycopg2.connect(payment_app.DATABASE_URL)
+    try:
+        migrations.upgrade(conn, verbose=False)
+        race_ok = run_race(conn, args.concurrency)
+        legacy = time_confirms(conn, legacy_confirm, args.samples)
+        single = time_confirms(conn, single_statement_confirm, args.samples)
+    finally:
+        conn.close()
+
+    print(f"Legacy 3-statement confirm: {legacy}")
+    print(f"Single-statement confirm:   {single}")
+    if not race_ok:
+        print("FAIL: concurrent confirms did not produce exactly one payment")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Messages built per second: EmailMessage vs the bulk MIME builder.
+
+    python benchmarks/mime_bench.py --count 20000 --output mime_bench.json
+
+Renders COUNT reminders once, then times assembling them into wire bytes two
+ways: the stdlib path `send_message()` takes (EmailMessage, set_content,
+add_alternative, BytesGenerator with CRLF) and BulkMessageBuilder. Before
+timing, every builder message is checked to be byte-identical to the stdlib
+one with the same boundary; names and amounts include non-ASCII text and
+over-long lines so the 8bit and quoted-printable paths are both covered, and
+a few fixed edge cases add body lines starting with "From ".
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from template_registry import ReminderRenderer
+from mime_builder import BulkMessageBuilder, build_email_message, flatten
+
+FROM_HEADER = "Loan Department <loans@example.com>"
+NAMES = ["Asha Verma", "Zoë Ñúñez", "Rahul", "José O'Neil & Sons", "名前 テスト", "A" * 90]
+BOUNDARY_RE = re.compile(rb'boundary="([^"]+)"')
+
+# Body lines send_message() escapes as ">From ", in each transfer encoding
+EDGE_CASES = [
+    ("From lines", "from@example.com", "Hello\nFrom now on, pay online.\n", "<p>Hi</p>\nFrom the team\n"),
+    ("From lines 8bit", "from8@example.com", "From Zoë, with thanks\n", "<p>From Zoë</p>\n"),
+    ("From lines qp", "fromqp@example.com", "From " + "x" * 100 + "\nFrom us\n", "<p>" + "y" * 100 + "</p>\nFrom \n"),
+]
+
+
+def render_messages(count, seed):
+    rng = random.Random(seed)
+    renderer = ReminderRenderer()
+    today = date.today()
+    messages = []
+    for i in range(1, count + 1):
+        name = f"{rng.choice(NAMES)} {i}"
+        due_date = today + timedelta(days=rng.randint(-10, 30))
+        amount = Decimal(rng.randint(100, 10_000_000)) / 100
+        subject, text, html = renderer.render(name, i, due_date, amount, f"https://pay.example.com/pay/{i}")
+        messages.append((subject, f"customer{i}@example.com", text, html))
+    return messages
+
+
+def check_identical(messages):
+    """Return how many builder messages differ from the stdlib's bytes"""
+    builder = BulkMessageBuilder(FROM_HEADER)
+    mismatches = 0
+    for subject, to_addr, text, html in messages:
+        data = builder.build(subject, to_addr, text, html)
+        if data is None:
+            continue
+        msg = build_email_message(subject, FROM_HEADER, to_addr, text, html)
+        msg.set_boundary(BOUNDARY_RE.search(data).group(1).decode("ascii"))
+        if flatten(msg) != data:
+            mismatches += 1
+    return mismatches, builder.stats()
+
+
+def time_stdlib(messages):
+    started = time.perf_counter()
+    for subject, to_addr, text, html in messages:
+        flatten(build_email_message(subject, FROM_HEADER, to_addr, text, html))
+    return time.perf_counter() - started
+
+
+def time_builder(messages):
+    builder = BulkMessageBuilder(FROM_HEADER)
+    started = time.perf_counter()
+    for subject, to_addr, text, html in messages:
+        data = builder.build(subject, to_addr, text, html)
+        if data is None:
+            flatten(build_email_message(subject, FROM_HEADER, to_addr, text, html))
+    return time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=20000, help="messages to build per method")
+    parser.add_argument("--check", type=int, default=2000, help="messages compared byte for byte")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="mime_bench.json")
+    args = parser.parse_args(argv)
+
+    messages = render_messages(args.count, args.seed)
+    mismatches, check_stats = check_identical(messages[:args.check] + EDGE_CASES)
+    print(f"Byte check: {min(args.check, len(messages)) + len(EDGE_CASES)} messages, {mismatches} mismatches, "
+          f"{check_stats['fallbacks']} stdlib fallbacks")
+
+    stdlib_s = time_stdlib(messages)
+    builder_s = time_builder(messages)
+    result = {
+        "messages": len(messages),
+        "stdlib_msgs_per_sec": round(len(messages) / stdlib_s, 1),
+        "builder_msgs_per_sec": round(len(messages) / builder_s, 1),
+        "speedup": round(stdlib_s / builder_s, 2),
+        "mismatches": mismatches,
+    }
+    print(f"EmailMessage: {result['stdlib_msgs_per_sec']} msg/s, "
+          f"bulk builder: {result['builder_msgs_per_sec']} msg/s ({result['speedup']}x)")
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "benchmark": "mime_bench",
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "result": result,
+        }, f, indent=2)
+    print(f"Results written to {args.output}")
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""End-to-end throughput benchmark for send_reminders.main().
+
+    python benchmarks/reminder_pipeline.py --sizes 1000,10000,100000 --workers 4 \
+        --latency-ms 20 --fail-rate 0.01 --output reminder_pipeline.json
+
+Starts a local SMTP sink (aiosmtpd) with optional per-message latency and
+failure injection, seeds Postgres with N synthetic customers per size and
+runs the real reminder pipeline against both in a child process. Reports
+messages/sec, p50/p99 per-message latency, DB round trips and the child's
+peak RSS, and writes them to JSON. `--baseline` compares against an earlier
+JSON file, e.g. one saved on the previous commit.
+
+Postgres: pass `--dsn` for a scratch database (its customers, payments,
+email_logs, outbox and reminder tables are TRUNCATED), or leave it out to
+start a throwaway server with pgserver (`pip install pgserver`).
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import platform
+import resource
+import logging
+import tempfile
+import subprocess
+import contextlib
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import psycopg2
+import psycopg2.extensions
+
+RESET_SQL = """
+    TRUNCATE customers, payments, email_logs, email_outbox,
+             reminder_runs, reminder_claims RESTART IDENTITY CASCADE
+"""
+
+# Due dates spread from 10 days overdue to 30 days ahead, so every urgency
+# branch of the reminder template is exercised
+SEED_SQL = """
+    INSERT INTO customers (name, email, amount, due_date, payment_status)
+    SELECT 'Bench Customer ' || g, 'bench' || g || '@example.com',
+           100 + (g %% 5000) + 0.5, CURRENT_DATE + (g %% 40 - 10), 'UNPAID'
+    FROM generate_series(1, %s) g
+"""
+
+
+# ---------------- SMTP SINK ----------------
+class SinkHandler:
+    """Accepts every message after `latency` seconds, failing `fail_rate` of them"""
+
+    def __init__(self, latency=0.0, fail_rate=0.0, seed=None):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.random = random.Random(seed)
+        self.received = 0
+        self.rejected = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.random.random() < self.fail_rate:
+            self.rejected += 1
+            return "451 4.3.0 Injected temporary failure"
+        self.received += 1
+        return "250 OK"
+
+
+def accept_any_login(server, session, envelope, mechanism, auth_data):
+    from aiosmtpd.smtp import AuthResult
+    return AuthResult(success=True)
+
+
+def start_smtp_sink(handler, port=0):
+    from aiosmtpd.controller import Controller
+
+    if not port:
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+    # The pipeline logs in without TLS, as it would after STARTTLS in production
+    logging.getLogger("mail.log").setLevel(logging.ERROR)  # per-login deprecation noise
+    controller = Controller(handler, hostname="127.0.0.1", port=port,
+                            authenticator=accept_any_login, auth_require_tls=False)
+    controller.start()
+    return controller
+
+
+# ---------------- POSTGRES ----------------
+@contextlib.contextmanager
+def scratch_database(dsn):
+    """Yield a DSN: the one given, or a throwaway pgserver instance"""
+    if dsn:
+        yield dsn
+        return
+    try:
+        import pgserver
+    except ImportError:
+        raise SystemExit("Pass --dsn for a scratch database or `pip install pgserver`")
+    with tempfile.TemporaryDirectory(prefix="reminder-bench-") as pgdata:
+        server = pgserver.get_server(pgdata, cleanup_mode="stop")
+        try:
+            yield server.get_uri()
+        finally:
+            server.cleanup()
+
+
+def seed_customers(dsn, count):
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(RESET_SQL)
+            cur.execute(SEED_SQL, (count,))
+        conn.commit()
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE customers, email_logs")
+    finally:
+        conn.close()
+
+
+# ---------------- CHILD: ONE INSTRUMENTED RUN ----------------
+ROUND_TRIPS = [0]
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """Counts statements, the implicit BEGIN before them and named-cursor fetches"""
+
+    def execute(self, query, vars=None):
+        if (not self.connection.autocommit
+                and self.connection.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_IDLE):
+            ROUND_TRIPS[0] += 1
+        ROUND_TRIPS[0] += 1
+        return super().execute(query, vars)
+
+    def __iter__(self):
+        if self.name is None:
+            return super().__iter__()
+        return self._fetch_batches()
+
+    def _fetch_batches(self):
+        while True:
+            rows = self.fetchmany(self.itersize)
+            if not rows:
+                return
+            yield from rows
+
+    def fetchmany(self, size=None):
+        if self.name is not None:
+            ROUND_TRIPS[0] += 1
+        return super().fetchmany() if size is None else super().fetchmany(size)
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    def _end(self, finish):
+        if self.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            ROUND_TRIPS[0] += 1
+        finish()
+
+    def commit(self):
+        self._end(super().commit)
+
+    def rollback(self):
+        self._end(super().rollback)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+
+def run_child(result_path, workers, rate):
+    """Run send_reminders.main() once, instrumented, and write the figures"""
+    import send_reminders
+
+    def get_connection():
+        return psycopg2.connect(send_reminders.DATABASE_URL,
+                                connection_factory=CountingConnection,
+                                cursor_factory=CountingCursor)
+
+    latencies = []
+    outcomes = []
+    send_to_customer = send_reminders.send_to_customer
+
+    def timed_send(session, customer, renderer=None):
+        started = time.perf_counter()
+        try:
+            result = send_to_customer(session, customer, renderer)
+        finally:
+            latencies.append((time.perf_counter() - started) * 1000)
+        outcomes.append(result[0])
+        return result
+
+    send_reminders.get_connection = get_connection
+    send_reminders.send_to_customer = timed_send
+
+    argv = ["--workers", str(workers), "--rate", str(rate), "--restart"]
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        started = time.perf_counter()
+        send_reminders.main(argv)
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    sent = sum(outcomes)
+    with open(result_path, "w") as f:
+        json.dump({
+            "elapsed_s": round(elapsed, 3),
+            "messages": len(outcomes),
+            "sent": sent,
+            "failed": len(outcomes) - sent,
+            "messages_per_sec": round(len(outcomes) / elapsed, 1) if elapsed else None,
+            "latency_p50_ms": round(percentile(latencies, 0.50) or 0, 3),
+            "latency_p99_ms": round(percentile(latencies, 0.99) or 0, 3),
+            "db_round_trips": ROUND_TRIPS[0],
+            # ru_maxrss is in KiB on Linux and bytes on macOS
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                                 / (1024 * 1024 if sys.platform == "darwin" else 1024), 1),
+        }, f)
+
+
+# ---------------- PARENT: ORCHESTRATION ----------------
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_size(dsn, smtp_port, args):
+    env = dict(os.environ,
+               DATABASE_URL=dsn, EMAIL="bench@example.com", PASSWORD="bench",
+               SMTP_SERVER="127.0.0.1", SMTP_PORT=str(smtp_port), SMTP_STARTTLS="0")
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        result_path = f.name
+    try:
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--child", result_path,
+                        "--workers", str(args.workers), "--rate", str(args.rate)],
+                       env=env, cwd=ROOT, check=True)
+        with open(result_path) as f:
+            return json.load(f)
+    finally:
+        os.unlink(result_path)
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {row["customers"]: row for row in json.load(f)["results"]}
+    print(f"Compared with {baseline_path}:")
+    for row in results:
+        old = baseline.get(row["customers"])
+        if old is None:
+            continue
+        print(f"  N={row['customers']:>7}: "
+              f"msg/s {old['messages_per_sec']} -> {row['messages_per_sec']} "
+              f"({row['messages_per_sec'] / old['messages_per_sec'] - 1:+.1%}), "
+              f"p99 {old['latency_p99_ms']} -> {row['latency_p99_ms']} ms, "
+              f"round trips {old['db_round_trips']} -> {row['db_round_trips']}, "
+              f"RSS {old['peak_rss_mb']} -> {row['peak_rss_mb']} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="comma-separated customer counts")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=0, help="messages/sec cap (0 = unlimited)")
+    parser.add_argument("--latency-ms", type=float, default=0, help="sink delay per message")
+    parser.add_argument("--fail-rate", type=float, default=0, help="fraction of messages the sink rejects")
+    parser.add_argument("--seed", type=int, default=42, help="failure injection seed")
+    parser.add_argument("--dsn", default=None, help="scratch Postgres to use (tables are truncated)")
+    parser.add_argument("--output", default="reminder_pipeline.json")
+    parser.add_argument("--baseline", default=None, help="earlier results JSON to compare with")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args.child, args.workers, args.rate)
+        return
+
+    import migrations
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    handler = SinkHandler(args.latency_ms / 1000, args.fail_rate, args.seed)
+    sink = start_smtp_sink(handler)
+    results = []
+    try:
+        with scratch_database(args.dsn) as dsn:
+            conn = psycopg2.connect(dsn)
+            try:
+                migrations.upgrade(conn, verbose=False)
+            finally:
+                conn.close()
+
+            for count in sizes:
+                seed_customers(dsn, count)
+                handler.received = handler.rejected = 0
+                row = {"customers": count}
+                row.update(run_size(dsn, sink.port, args))
+                row.update(sink_received=handler.received, sink_rejected=handler.rejected,
+                           round_trips_per_message=round(row["db_round_trips"] / max(row["messages"], 1), 3))
+                results.append(row)
+                print(f"N={count:>7}: {row['messages_per_sec']} msg/s, "
+                      f"p50 {row['latency_p50_ms']} ms, p99 {row['latency_p99_ms']} ms, "
+                      f"{row['db_round_trips']} DB round trips, peak RSS {row['peak_rss_mb']} MB, "
+                      f"{row['sent']} sent / {row['failed']} failed")
+    finally:
+        sink.stop()
+
+    report = {
+        "benchmark": "reminder_pipeline",
+        "commit": git_commit(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "config": {
+            "workers": args.workers,
+            "rate": args.rate,
+            "latency_ms": args.latency_ms,
+            "fail_rate": args.fail_rate,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
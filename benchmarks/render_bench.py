@@ -0,0 +1,186 @@
+"""Microbenchmark: per-message render cost before and after the template registry.
+
+    python benchmarks/render_bench.py --messages 20000
+
+Before: the reminder email bodies built as per-recipient f-strings (copied
+below from the pre-registry send_reminders.py) and the payment page parsed
+by `Environment.from_string` on every request, as `render_template_string`
+did. After: ReminderRenderer frames and the pre-compiled page templates.
+"""
+import os
+import sys
+import time
+import argparse
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jinja2 import Environment
+from template_registry import TEMPLATE_DIR, ReminderRenderer, render_page
+
+
+def legacy_reminder(name, loan_id, due_date, amount, payment_link):
+    """Reminder body construction as it was before the template registry"""
+    # Determine urgency
+    days_until_due = (due_date - date.today()).days if due_date else 0
+    urgency = "URGENT" if days_until_due <= 2 else "REMINDER"
+    
+    html_content = f"""
+    <html>
+    <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+        <div style="max-width: 600px; margin: 0 auto; padding: 20px; border: 1px solid #ddd; border-radius: 10px;">
+            <div style="text-align: center; margin-bottom: 30px;">
+                <h2 style="color: #ff6b35;">{urgency}: Payment Due</h2>
+                <div style="background: {'#ffebee' if urgency == 'URGENT' else '#fff3e0'}; 
+                    padding: 15px; border-radius: 8px; margin: 15px 0;">
+                    <p style="margin: 0; font-weight: bold;">
+                        {'⚠️ Action Required: Payment is due soon!' if urgency == 'URGENT' else '📅 Friendly Reminder'}
+                    </p>
+                </div>
+            </div>
+            
+            <p>Dear <strong>{name}</strong>,</p>
+            
+            <p>This is a reminder regarding your outstanding loan payment.</p>
+            
+            <div style="background: #f8f9fa; padding: 20px; border-radius: 8px; margin: 20px 0;">
+                <h3 style="margin-top: 0;">Payment Details:</h3>
+                <table style="width: 100%;">
+                    <tr>
+                        <td style="padding: 8px 0;">Loan ID:</td>
+                        <td style="padding: 8px 0;"><strong>{loan_id}</strong></td>
+                    </tr>
+                    <tr>
+                        <td style="padding: 8px 0;">Amount Due:</td>
+                        <td style="padding: 8px 0;"><strong style="color: #dc3545; font-size: 1.2em;">₹{amount:.2f}</strong></td>
+                    </tr>
+                    <tr>
+                        <td style="padding: 8px 0;">Due Date:</td>
+                        <td style="padding: 8px 0;">
+                            <strong>{due_date.strftime('%d %B, %Y') if due_date else 'Not specified'}</strong>
+                            {' <span style="color: #dc3545;">(Overdue)</span>' if due_date and due_date < date.today() else ''}
+                        </td>
+                    </tr>
+                    <tr>
+                        <td style="padding: 8px 0;">Days Remaining:</td>
+                        <td style="padding: 8px 0;">
+                            {f"<strong>{days_until_due}</strong> day(s)" if due_date and days_until_due > 0 else "<strong style='color: #dc3545;'>Overdue</strong>"}
+                        </td>
+                    </tr>
+                </table>
+            </div>
+            
+            <p>Please click the button below to complete your payment:</p>
+            
+            <div style="text-align: center; margin: 30px 0;">
+                <a href="{payment_link}" 
+                   style="background: linear-gradient(to right, #28a745, #20c997); 
+                          color: white; 
+                          padding: 15px 30px; 
+                          text-decoration: none; 
+                          border-radius: 50px; 
+                          font-weight: bold;
+                          display: inline-block;">
+                    🚀 Pay Now
+                </a>
+            </div>
+            
+            <p style="font-size: 0.9em; color: #666;">
+                If the button doesn't work, copy and paste this link in your browser:<br>
+                <code style="background: #f5f5f5; padding: 5px 10px; border-radius: 3px; word-break: break-all;">
+                    {payment_link}
+                </code>
+            </p>
+            
+            <p>For any queries, please contact our support team.</p>
+            
+            <div style="margin-top: 30px; padding-top: 20px; border-top: 1px solid #ddd;">
+                <p>Best regards,<br>
+                <strong>Loan Department</strong></p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+    
+    # Plain text version
+    text_content = f"""
+{urgency}: PAYMENT REMINDER
+
+Dear {name},
+
+This is a reminder regarding your outstanding loan payment of ₹{amount:.2f}.
+
+Loan Details:
+- Loan ID: {loan_id}
+- Amount Due: ₹{amount:.2f}
+- Due Date: {due_date.strftime('%d %B, %Y') if due_date else 'Not specified'}
+- Status: {'OVERDUE' if due_date and due_date < date.today() else 'PENDING'}
+
+Please use the following link to complete your payment:
+{payment_link}
+
+For any queries, please contact our support team.
+
+Best regards,
+Loan Department
+"""
+    return html_content, text_content
+
+
+def synthetic_customers(count):
+    today = date.today()
+    for i in range(count):
+        loan_id = i + 1
+        yield (f"Customer {loan_id}", loan_id, today + timedelta(days=i % 30 - 10),
+               1000 + i * 0.5, f"http://localhost:5000/pay/{loan_id}")
+
+
+def timed(label, count, fn):
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<38} {elapsed / count * 1e6:8.2f} us/msg  {count / elapsed:12,.0f} msg/s")
+    return elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Template render microbenchmark")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--pages", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    customers = list(synthetic_customers(args.messages))
+
+    def run_legacy():
+        for customer in customers:
+            legacy_reminder(*customer)
+
+    def run_renderer():
+        renderer = ReminderRenderer()
+        for customer in customers:
+            renderer.render(*customer)
+
+    before = timed("reminder email, f-strings (before)", args.messages, run_legacy)
+    after = timed("reminder email, registry (after)", args.messages, run_renderer)
+    print(f"{'speed-up':<38} {before / after:8.2f}x")
+
+    with open(os.path.join(TEMPLATE_DIR, "pages", "payment.html"), encoding="utf-8") as f:
+        page_source = f.read()
+    env = Environment(autoescape=True)
+
+    def run_from_string():
+        for i in range(args.pages):
+            env.from_string(page_source).render(name="Customer", loan_id=i, amount=1000.0)
+
+    def run_compiled():
+        for i in range(args.pages):
+            render_page("payment", name="Customer", loan_id=i, amount=1000.0)
+
+    before = timed("payment page, parse per request (before)", args.pages, run_from_string)
+    after = timed("payment page, compiled once (after)", args.pages, run_compiled)
+    print(f"{'speed-up':<38} {before / after:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import io
+import csv
+
+COPY_CHUNK_ROWS = 5000  # rows buffered per chunk handed to COPY
+
+
+class CopyStream:
+    """File-like view of an iterator of rows as CSV, for `COPY ... FROM STDIN`.
+
+    Rows are encoded lazily, `chunk_rows` at a time, as COPY asks for more,
+    so the input is never held in memory. `rows` counts the rows read.
+    """
+
+    def __init__(self, rows, chunk_rows=COPY_CHUNK_ROWS):
+        self._rows = iter(rows)
+        self.chunk_rows = chunk_rows
+        self._buffer = ""
+        self.rows = 0
+
+    def _next_chunk(self):
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator="\n")
+        count = 0
+        for row in self._rows:
+            writer.writerow(row)
+            count += 1
+            if count >= self.chunk_rows:
+                break
+        self.rows += count
+        return out.getvalue()
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = self._next_chunk()
+            if not chunk:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, ""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
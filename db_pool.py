@@ -0,0 +1,265 @@
+import os
+import threading
+import time
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2 import extensions
+
+DEFAULT_MIN_SIZE = 1
+DEFAULT_MAX_SIZE = 10
+DEFAULT_TIMEOUT = 10.0  # seconds to wait for a free connection
+DEFAULT_CHECK_AFTER = 30.0  # idle seconds after which a connection is pinged on checkout
+
+
+class ConnectionPool:
+    """Per-process, thread-safe Postgres connection pool.
+
+    Wraps psycopg2's ThreadedConnectionPool with the pieces it lacks: callers
+    block (up to `timeout`) instead of failing when the pool is exhausted,
+    idle connections are health-checked on checkout, and wait times are
+    recorded. The underlying pool is created lazily and re-created when the
+    process id changes, so gunicorn workers never share sockets inherited
+    from the master across a fork.
+    """
+
+    def __init__(self, dsn, min_size=DEFAULT_MIN_SIZE, max_size=DEFAULT_MAX_SIZE,
+                 timeout=DEFAULT_TIMEOUT, check_after=DEFAULT_CHECK_AFTER):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_after = check_after
+
+        self._pool = None
+        self._pid = None
+        self._slots = None
+        self._last_used = {}
+        self._lock = threading.Lock()
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.discarded = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.in_use = 0
+
+    def _ensure_pool(self):
+        pid = os.getpid()
+        if self._pool is not None and self._pid == pid:
+            return self._pool
+        with self._lock:
+            if self._pool is None or self._pid != pid:
+                # Connections inherited from a parent process are abandoned, not
+                # closed: closing them here would tear down the parent's sessions.
+                self._pool = pg_pool.ThreadedConnectionPool(self.min_size, self.max_size, self.dsn)
+                self._pid = pid
+                self._slots = threading.BoundedSemaphore(self.max_size)
+                self._last_used = {}
+                self._reset_stats()
+        return self._pool
+
+    def getconn(self):
+        """Borrow a healthy connection, waiting for one if the pool is exhausted"""
+        pool = self._ensure_pool()
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            self.timeouts += 1
+            raise pg_pool.PoolError(f"no database connection available within {self.timeout}s")
+        waited = time.monotonic() - started
+
+        try:
+            conn = self._checkout_healthy(pool)
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+        return conn
+
+    def _checkout_healthy(self, pool):
+        while True:
+            conn = pool.getconn()
+            if self._is_healthy(conn):
+                return conn
+            self.discarded += 1
+            self._last_used.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def putconn(self, conn):
+        """Return a borrowed connection, discarding it if it is broken"""
+        broken = bool(conn.closed)
+        if not broken and conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        if broken:
+            self._last_used.pop(id(conn), None)
+        else:
+            self._last_used[id(conn)] = time.monotonic()
+        self._pool.putconn(conn, close=broken)
+        with self._lock:
+            self.in_use -= 1
+        self._slots.release()
+
+    def closeall(self):
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.closeall()
+        self._pool = None
+
+    def stats(self):
+        """Pool size and checkout wait-time statistics for this process"""
+        with self._lock:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "in_use": self.in_use,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "discarded": self.discarded,
+                "wait_avg_ms": round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "wait_max_ms": round(self.wait_max * 1000, 3),
+            }
+
+
+DEFAULT_MAX_LAG = 5.0  # seconds of replay lag before reads go back to the primary
+DEFAULT_LAG_CHECK_INTERVAL = 1.0  # seconds between replica lag probes
+DEFAULT_RETRY_AFTER = 10.0  # seconds an unreachable replica is left alone
+
+# Replay lag of a standby in seconds; 0 on a primary, and 0 when the standby
+# has replayed everything it received (replay_timestamp is only the time of
+# the last replayed commit, which on an idle primary can be arbitrarily old)
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class ReadRouter:
+    """Sends read-only checkouts to a replica pool, falling back to the primary.
+
+    Has the `getconn()` / `putconn()` interface of ConnectionPool, so a read
+    path swaps one pool for the other. The replica is used while its replay
+    lag, probed at most every `lag_check_interval` seconds, stays within
+    `max_lag`. A replica that cannot hand out a connection is skipped for
+    `retry_after` seconds. Writes, and reads that must see them, keep using
+    the primary pool directly.
+    """
+
+    def __init__(self, primary, replica, max_lag=DEFAULT_MAX_LAG,
+                 lag_check_interval=DEFAULT_LAG_CHECK_INTERVAL, retry_after=DEFAULT_RETRY_AFTER):
+        self.primary = primary
+        self.replica = replica
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self.retry_after = retry_after
+
+        self._owners = {}
+        self._lag = 0.0
+        self._lag_checked = None
+        self._down_until = 0.0
+        self._lock = threading.Lock()
+
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self.lag_fallbacks = 0
+        self.error_fallbacks = 0
+
+    def _replica_conn(self):
+        """A replica connection fresh enough to read from, or None"""
+        now = time.monotonic()
+        if now < self._down_until:
+            return None
+        try:
+            conn = self.replica.getconn()
+        except (psycopg2.Error, pg_pool.PoolError) as e:
+            self._mark_down(e)
+            return None
+
+        if self._lag_checked is None or now - self._lag_checked >= self.lag_check_interval:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(REPLICA_LAG_SQL)
+                    lag = float(cur.fetchone()[0])
+                conn.rollback()
+            except psycopg2.Error as e:
+                self.replica.putconn(conn)
+                self._mark_down(e)
+                return None
+            with self._lock:
+                self._lag = lag
+                self._lag_checked = now
+
+        if self._lag > self.max_lag:
+            self.replica.putconn(conn)
+            with self._lock:
+                self.lag_fallbacks += 1
+            return None
+        return conn
+
+    def _mark_down(self, error):
+        with self._lock:
+            self.error_fallbacks += 1
+            if time.monotonic() >= self._down_until:
+                print(f"⚠️ Read replica unavailable, reading from the primary for {self.retry_after}s: {error}")
+            self._down_until = time.monotonic() + self.retry_after
+
+    def getconn(self):
+        """Borrow a connection for a read-only query; hand it back with putconn()"""
+        conn = self._replica_conn()
+        pool = self.replica
+        if conn is None:
+            conn = self.primary.getconn()
+            pool = self.primary
+        with self._lock:
+            self._owners[id(conn)] = pool
+            if pool is self.replica:
+                self.replica_reads += 1
+            else:
+                self.primary_reads += 1
+        return conn
+
+    def putconn(self, conn):
+        with self._lock:
+            pool = self._owners.pop(id(conn), self.primary)
+        pool.putconn(conn)
+
+    def closeall(self):
+        self.replica.closeall()
+
+    def stats(self):
+        """Where reads went, the last measured lag and the replica pool's stats"""
+        with self._lock:
+            stats = {
+                "replica_reads": self.replica_reads,
+                "primary_reads": self.primary_reads,
+                "lag_fallbacks": self.lag_fallbacks,
+                "error_fallbacks": self.error_fallbacks,
+                "lag_s": round(self._lag, 3),
+                "replica_down": int(time.monotonic() < self._down_until),
+            }
+        stats.update({f"pool_{key}": value for key, value in self.replica.stats().items()})
+        return stats
@@ -0,0 +1,204 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class TokenBucket:
+    """Thread-safe token bucket capping the global send rate.
+
+    `rate` is tokens (messages) per second; a rate of 0 or None disables
+    limiting. `burst` is how many tokens may accumulate while idle.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate) if rate else 0.0
+        self.capacity = float(burst) if burst else max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens=1):
+        """Block until `tokens` are available, then consume them"""
+        while True:
+            with self._lock:
+                # Re-checked every pass: set_rate() may lift the limit while we wait
+                if not self.rate:
+                    return
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait_for = (tokens - self._tokens) / self.rate
+            time.sleep(wait_for)
+
+    def set_rate(self, rate):
+        """Change the rate on the fly (used when the provider starts throttling)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = float(rate) if rate else 0.0
+            self.capacity = max(1.0, self.rate)
+            self._tokens = min(self._tokens, self.capacity)
+
+
+class AdaptiveRate:
+    """Backs a TokenBucket off while the provider throttles, then recovers.
+
+    A throttle reply halves the rate, at most once per `cooldown` seconds, so
+    the rejections of messages already in flight count once. Every
+    `recover_after` clean sends the rate grows by 10% until it is back at
+    `ceiling`. With no ceiling (unlimited sending) the first back-off starts
+    from the throughput measured so far, and the limit is lifted again once
+    the rate has recovered to that figure.
+    """
+
+    def __init__(self, bucket, ceiling=None, floor=0.5, factor=0.5, cooldown=5.0, recover_after=50):
+        self.bucket = bucket
+        self.ceiling = float(ceiling) if ceiling else 0.0
+        self.floor = floor
+        self.factor = factor
+        self.cooldown = cooldown
+        self.recover_after = recover_after
+
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._sent = 0
+        self._clean = 0
+        self._last_backoff = None
+        self._unthrottled_rate = None
+
+        self.backoffs = 0
+        self.min_rate = None
+
+    def succeeded(self):
+        with self._lock:
+            self._sent += 1
+            if not self.bucket.rate or self.bucket.rate == self.ceiling:
+                return
+            self._clean += 1
+            if self._clean < self.recover_after:
+                return
+            self._clean = 0
+            rate = self.bucket.rate * 1.1
+            limit = self.ceiling or self._unthrottled_rate
+            # Back at the ceiling, or at the unlimited pace we were throttled at
+            self.bucket.set_rate(self.ceiling if rate >= limit else rate)
+
+    def throttled(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._last_backoff is not None and now - self._last_backoff < self.cooldown:
+                return
+            rate = self.bucket.rate
+            if not rate:
+                rate = self._unthrottled_rate = max(self.floor, self._sent / max(now - self._started, 1e-3))
+            rate = max(self.floor, rate * self.factor)
+            self.bucket.set_rate(rate)
+            self._last_backoff = now
+            self._clean = 0
+            self.backoffs += 1
+            self.min_rate = rate if self.min_rate is None else min(self.min_rate, rate)
+
+    def set_ceiling(self, ceiling):
+        """Move the target rate (used by the send window's pacing); a back-off in progress is kept"""
+        with self._lock:
+            backing_off = self.bucket.rate and self.ceiling and self.bucket.rate < self.ceiling
+            self.ceiling = float(ceiling) if ceiling else 0.0
+            self.bucket.set_rate(min(self.bucket.rate, self.ceiling) if backing_off else self.ceiling)
+
+    def stats(self):
+        return {
+            "rate": round(self.bucket.rate, 2) if self.bucket.rate else "unlimited",
+            "backoffs": self.backoffs,
+            "min_rate": round(self.min_rate, 2) if self.min_rate is not None else None,
+        }
+
+
+class ParallelDelivery:
+    """Run a send function across N worker threads, each with its own session.
+
+    Jobs are pulled lazily from any iterable and at most `workers * 4` are in
+    flight at once, so a streaming source is never materialised in memory.
+    Results are yielded back to the calling thread as `(job, result)` pairs,
+    which keeps logging and the summary single-threaded. Report throttle
+    replies and successes to `rate_control` to let the global rate adapt.
+
+    When the run stops early (a signal, or an error while handling a result)
+    jobs not yet started are cancelled, but sends already under way finish.
+    Their results cannot be yielded any more; they are left in `unreported`
+    for the caller to record once the generator is closed.
+    """
+
+    def __init__(self, session_factory, workers=1, rate=None):
+        self.session_factory = session_factory
+        self.workers = max(1, int(workers))
+        self.limiter = TokenBucket(rate)
+        self.rate_control = AdaptiveRate(self.limiter, ceiling=rate)
+        self.sessions = []
+        self.unreported = []
+        self._local = threading.local()
+        self._sessions_lock = threading.Lock()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self.session_factory()
+            self._local.session = session
+            with self._sessions_lock:
+                self.sessions.append(session)
+        return session
+
+    def _run_one(self, send_fn, job):
+        self.limiter.acquire()
+        return send_fn(self._session(), job)
+
+    def run(self, jobs, send_fn):
+        """Yield `(job, result)` for every job as workers complete them"""
+        max_pending = self.workers * 4
+        pending = {}
+        self.unreported = []
+        jobs = iter(jobs)
+        pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="smtp")
+        try:
+            for job in jobs:
+                pending[pool.submit(self._run_one, send_fn, job)] = job
+                if len(pending) >= max_pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield pending.pop(future), future.result()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=True)
+            # Whatever was in flight went out (or failed) regardless
+            self.unreported = [(job, future.result()) for future, job in pending.items()
+                               if not future.cancelled() and future.exception() is None]
+            self.close()
+
+    def close(self):
+        with self._sessions_lock:
+            for session in self.sessions:
+                session.close()
+
+    def stats(self):
+        """SMTP counters summed across every worker's session"""
+        totals = {"handshakes": 0, "messages_sent": 0, "reconnects": 0, "keepalives": 0}
+        with self._sessions_lock:
+            for session in self.sessions:
+                for key, value in session.stats().items():
+                    if key in totals:
+                        totals[key] += value
+        totals["messages_per_handshake"] = (
+            round(totals["messages_sent"] / totals["handshakes"], 2) if totals["handshakes"] else 0.0
+        )
+        totals["workers"] = self.workers
+        totals.update(self.rate_control.stats())
+        return totals
@@ -0,0 +1,117 @@
+import threading
+import time
+from datetime import datetime
+from psycopg2.extras import execute_values
+from metrics import timed
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 5.0  # seconds
+
+
+class EmailLogWriter:
+    """Buffered writer for `email_logs` that holds one connection per run.
+
+    Rows are collected in memory and written with a single `execute_values`
+    INSERT when the buffer reaches `batch_size` rows or `flush_interval`
+    seconds have passed since the last flush. Use it as a context manager so
+    the buffer is flushed on normal exit and on a crash alike.
+
+    `on_flush(cur)`, if given, runs in the same transaction as each batch,
+    so progress bookkeeping commits atomically with the log rows. A failed
+    batch is retried once and `on_flush` runs again, so it must not discard
+    what it wrote until `on_commit()` is called after the commit. `run_id`
+    tags every row with the reminder run that wrote it.
+    """
+
+    def __init__(self, connect, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 on_flush=None, on_commit=None, run_id=None):
+        self.connect = connect
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_flush = on_flush
+        self.on_commit = on_commit
+        self.run_id = run_id
+
+        self._conn = None
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+        self.rows_written = 0
+        self.flushes = 0
+        self.rows_dropped = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _connection(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = self.connect()
+        return self._conn
+
+    def log(self, customer_id, status="SENT", error=None, sent_at=None):
+        """Queue one log row, flushing if the batch is full or stale"""
+        with self._lock:
+            self._buffer.append((customer_id, sent_at or datetime.now(), status, error, self.run_id))
+            due = (len(self._buffer) >= self.batch_size
+                   or time.monotonic() - self._last_flush >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered rows in one statement"""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._buffer = self._buffer, []
+                self._last_flush = time.monotonic()
+            if rows:
+                self._write(rows)
+
+    def _write(self, rows):
+        for attempt in (1, 2):
+            try:
+                conn = self._connection()
+                with timed("log_write"):
+                    with conn.cursor() as cur:
+                        execute_values(cur, """
+                            INSERT INTO email_logs (customer_id, sent_at, status, error, run_id)
+                            VALUES %s
+                        """, rows, page_size=self.batch_size)
+                        if self.on_flush is not None:
+                            self.on_flush(cur)
+                    conn.commit()
+                if self.on_commit is not None:
+                    self.on_commit()
+                self.rows_written += len(rows)
+                self.flushes += 1
+                return
+            except Exception as e:
+                self._reset()
+                if attempt == 2:
+                    self.rows_dropped += len(rows)
+                    print(f"⚠️ Failed to write {len(rows)} email log row(s): {e}")
+
+    def _reset(self):
+        """Drop a broken connection so the next attempt reconnects"""
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
+
+    def close(self):
+        """Flush whatever is left and release the connection"""
+        self.flush()
+        self._reset()
+
+    def stats(self):
+        return {
+            "rows_written": self.rows_written,
+            "flushes": self.flushes,
+            "rows_dropped": self.rows_dropped,
+        }
@@ -0,0 +1,316 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import psycopg2
+from dotenv import load_dotenv
+from metrics import timed
+import reconcile
+from copy_stream import CopyStream
+
+# Load environment variables
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+FIELDS = ("id", "name", "email", "amount", "due_date")
+FIELD_ALIASES = {"loan_id": "id"}
+REQUIRED_FIELDS = ("name", "email", "amount")
+
+# Every value lands as text, so bad rows are reported, not fatal. `line` is
+# the row's position in the input; `error` is set when it could not be parsed.
+CREATE_STAGING_SQL = """
+    CREATE TEMP TABLE customer_staging (
+        line BIGINT, id TEXT, name TEXT, email TEXT, amount TEXT, due_date TEXT, error TEXT
+    ) ON COMMIT DROP
+"""
+
+# Each row gets the first reason it cannot be loaded, or NULL. The CASE tests
+# the format before anything is cast, and a due date is only accepted if it
+# exists (make_date never fails once the month is 01-12). `loan_id` is the
+# id as an integer (see reconcile.LOAN_ID_SQL); of several rows for the same
+# loan, however its id is written, the last one wins.
+CHECK_ROWS_SQL = """
+    CREATE TEMP TABLE customer_checked ON COMMIT DROP AS
+    WITH trimmed AS (
+        SELECT line, coalesce(btrim(id), '') AS id, coalesce(btrim(name), '') AS name,
+               coalesce(btrim(email), '') AS email, coalesce(btrim(amount), '') AS amount,
+               coalesce(btrim(due_date), '') AS due_date, error
+        FROM customer_staging
+    ), parsed AS (
+        SELECT *, """ + reconcile.LOAN_ID_SQL.format(column="id") + """ AS loan_id
+        FROM trimmed
+    ), checked AS (
+        SELECT *, CASE
+            WHEN error IS NOT NULL THEN error
+            WHEN id <> '' AND loan_id IS NULL THEN 'invalid id'
+            WHEN name = '' THEN 'missing name'
+            WHEN email !~ '^[^@[:space:]]+@[^@[:space:]]+\\.[^@[:space:]]+$' THEN 'invalid email'
+            WHEN amount !~ '^[0-9]{1,10}(\\.[0-9]{1,2})?$' THEN 'invalid amount'
+            WHEN due_date = '' THEN NULL
+            WHEN due_date !~ '^[0-9]{4}-(0[1-9]|1[0-2])-[0-9]{2}$' OR substr(due_date, 1, 4) = '0000' THEN 'invalid due_date'
+            WHEN substr(due_date, 9, 2)::int NOT BETWEEN 1 AND extract(day FROM
+                 make_date(substr(due_date, 1, 4)::int, substr(due_date, 6, 2)::int, 1)
+                 + interval '1 month' - interval '1 day') THEN 'invalid due_date'
+        END AS reason
+        FROM parsed
+    )
+    SELECT line, id, loan_id, name, email, amount, due_date, CASE
+        WHEN reason IS NULL AND id <> ''
+             AND row_number() OVER (PARTITION BY reason IS NULL AND id <> '', loan_id ORDER BY line DESC) > 1
+        THEN 'superseded by a later row'
+        ELSE reason END AS reason
+    FROM checked
+"""
+
+# Rows with a loan id update that loan (or create it under that id). Only
+# rows that change something are written; a new cycle also sets the loan
+# back to UNPAID and drops its queued reminder retries from the last cycle.
+UPSERT_BY_ID_SQL = """
+    WITH upserted AS (
+        INSERT INTO customers AS c (id, name, email, amount, due_date, payment_status)
+        SELECT loan_id, name, email, amount::numeric, nullif(due_date, '')::date, 'UNPAID'
+        FROM customer_checked
+        WHERE reason IS NULL AND id <> ''
+        ON CONFLICT (id) DO UPDATE
+        SET name = EXCLUDED.name,
+            email = EXCLUDED.email,
+            amount = EXCLUDED.amount,
+            due_date = EXCLUDED.due_date,
+            payment_status = CASE WHEN %(new_cycle)s THEN 'UNPAID' ELSE c.payment_status END,
+            paid_at = CASE WHEN %(new_cycle)s THEN NULL ELSE c.paid_at END
+        WHERE (c.name, c.email, c.amount, c.due_date)
+              IS DISTINCT FROM (EXCLUDED.name, EXCLUDED.email, EXCLUDED.amount, EXCLUDED.due_date)
+           OR (%(new_cycle)s AND c.payment_status <> 'UNPAID')
+        RETURNING c.id, xmax = 0 AS inserted
+    ), retries AS (
+        DELETE FROM email_retries r
+        USING upserted u
+        WHERE %(new_cycle)s AND NOT u.inserted AND r.customer_id = u.id
+    )
+    SELECT count(*) FILTER (WHERE inserted),
+           count(*) FILTER (WHERE NOT inserted),
+           coalesce(array_agg(id) FILTER (WHERE NOT inserted), '{}')
+    FROM upserted
+"""
+
+# Explicit ids bypass the id sequence; move it past them before new loans
+# take ids from it
+SYNC_ID_SEQUENCE_SQL = """
+    SELECT setval(pg_get_serial_sequence('customers', 'id'),
+                  GREATEST((SELECT max(id) FROM customers), 1))
+"""
+
+INSERT_NEW_SQL = """
+    INSERT INTO customers (name, email, amount, due_date, payment_status)
+    SELECT name, email, amount::numeric, nullif(due_date, '')::date, 'UNPAID'
+    FROM customer_checked
+    WHERE reason IS NULL AND id = ''
+    ORDER BY line
+"""
+
+REJECTS_SQL = """
+    SELECT line, reason, id, name, email, amount, due_date
+    FROM customer_checked
+    WHERE reason IS NOT NULL
+    ORDER BY line
+"""
+
+# Exports, newest columns last; `since` filters on the date column
+EXPORTS = {
+    "customers": ("SELECT id, name, email, amount, due_date, payment_status, paid_at FROM customers", "due_date"),
+    "payments": ("SELECT id, customer_id, amount, status, payment_date FROM payments", "payment_date"),
+    "email_logs": ("SELECT id, customer_id, run_id, sent_at, status, error FROM email_logs", "sent_at"),
+}
+
+
+class CustomerRowStream(CopyStream):
+    """File-like view of a loan book (CSV with a header, or JSON lines) as CSV for COPY.
+
+    Rows are read lazily (see `CopyStream`), so the file is never held in
+    memory, and numbered with their position in the input. Field names are
+    matched case-insensitively and `loan_id` is accepted for `id`; a JSON
+    line that does not parse is passed on with its error so it is reported
+    with the other rejects.
+    """
+
+    def __init__(self, source, fmt="csv"):
+        records = self._json_records(source) if fmt == "jsonl" else self._csv_records(source)
+        super().__init__([line] + values + [error] for line, (values, error) in enumerate(records, 1))
+
+    @staticmethod
+    def _csv_records(source):
+        reader = csv.reader(source)
+        header = [FIELD_ALIASES.get(name, name) for name in
+                  (cell.strip().lower() for cell in next(reader, None) or ())]
+        missing = [field for field in REQUIRED_FIELDS if field not in header]
+        if missing:
+            raise ValueError(f"CSV header is missing {', '.join(missing)} (found: {', '.join(header)})")
+        positions = [header.index(field) if field in header else None for field in FIELDS]
+        return (
+            ([row[i] if i is not None and i < len(row) else "" for i in positions], None)
+            for row in reader if any(cell.strip() for cell in row)
+        )
+
+    @staticmethod
+    def _json_records(source):
+        for text in source:
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+                if not isinstance(record, dict):
+                    raise ValueError("not an object")
+            except ValueError as e:
+                yield ["", "", "", "", ""], f"invalid JSON: {e}"
+                continue
+            record = {FIELD_ALIASES.get(key.lower(), key.lower()): value for key, value in record.items()}
+            yield ["" if record.get(field) is None else str(record[field]) for field in FIELDS], None
+
+
+def ingest(conn, source, fmt="csv", new_cycle=False, dry_run=False, rejects=None):
+    """Load a loan book into `customers` in one transaction and report the outcome.
+
+    `source` is a text file object. Valid rows are upserted by loan id, or
+    inserted as new loans when they have none; `new_cycle` also resets
+    existing loans to UNPAID. Rejected rows are counted by reason and, when
+    `rejects` is a file object, written to it as CSV. With `dry_run` the
+    transaction is rolled back.
+    """
+    started = time.perf_counter()
+    stream = CustomerRowStream(source, fmt)
+    try:
+        with conn.cursor() as cur:
+            with timed("db_query"):
+                cur.execute(CREATE_STAGING_SQL)
+                cur.copy_expert("COPY customer_staging (line, id, name, email, amount, due_date, error) "
+                                "FROM STDIN WITH (FORMAT csv)", stream)
+            loaded_s = time.perf_counter() - started
+
+            with timed("db_query"):
+                cur.execute(CHECK_ROWS_SQL)
+                cur.execute("SELECT reason, count(*) FROM customer_checked "
+                            "WHERE reason IS NOT NULL GROUP BY reason ORDER BY count(*) DESC")
+                rejected = dict(cur.fetchall())
+                if rejects is not None and rejected:
+                    cur.copy_expert(f"COPY ({REJECTS_SQL}) TO STDOUT WITH (FORMAT csv, HEADER)", rejects)
+
+                cur.execute(UPSERT_BY_ID_SQL, {"new_cycle": new_cycle})
+                inserted, updated, updated_ids = cur.fetchone()
+                cur.execute(SYNC_ID_SEQUENCE_SQL)
+                cur.execute(INSERT_NEW_SQL)
+                inserted += cur.rowcount
+        with timed("db_query"):
+            if dry_run:
+                conn.rollback()
+            else:
+                conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    elapsed = time.perf_counter() - started
+    valid = stream.rows - sum(rejected.values())
+    return {
+        "rows": stream.rows,
+        "inserted": inserted,
+        "updated": updated,
+        "unchanged": valid - inserted - updated,
+        "rejected": sum(rejected.values()),
+        "rejected_by_reason": rejected,
+        "new_cycle": new_cycle,
+        "dry_run": dry_run,
+        "copy_s": round(loaded_s, 3),
+        "elapsed_s": round(elapsed, 3),
+        "rows_per_sec": round(stream.rows / elapsed, 1) if elapsed else None,
+        "updated_ids": updated_ids,
+    }
+
+
+def export(conn, table, out, since=None):
+    """Stream a table to `out` as CSV with COPY; returns the number of rows"""
+    query, date_column = EXPORTS[table]
+    with conn.cursor() as cur:
+        if since is not None:
+            query += cur.mogrify(f" WHERE {date_column} >= %s", (since,)).decode()
+        with timed("db_query"):
+            cur.copy_expert(f"COPY ({query} ORDER BY id) TO STDOUT WITH (FORMAT csv, HEADER)", out)
+        rows = cur.rowcount
+    conn.commit()
+    return rows
+
+
+def input_format(path, fmt):
+    if fmt:
+        return fmt
+    return "jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load the loan book into customers, or export tables as CSV")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = sub.add_parser("ingest", help="upsert customers from a CSV or JSON lines file")
+    ingest_parser.add_argument("file", help="loan book file, or - for stdin")
+    ingest_parser.add_argument("--format", choices=["csv", "jsonl"], default=None,
+                               help="input format (default: from the file extension, csv for stdin)")
+    ingest_parser.add_argument("--new-cycle", action="store_true",
+                               help="reset every loan in the file to UNPAID for a new billing cycle")
+    ingest_parser.add_argument("--dry-run", action="store_true", help="report the outcome without applying it")
+    ingest_parser.add_argument("--rejects", default=None, metavar="PATH",
+                               help="write rejected rows with their reason to this CSV file")
+
+    export_parser = sub.add_parser("export", help="stream a table to CSV")
+    export_parser.add_argument("table", choices=sorted(EXPORTS))
+    export_parser.add_argument("-o", "--output", default="-", help="CSV file, or - for stdout (default)")
+    export_parser.add_argument("--since", default=None, metavar="DATE",
+                               help="only rows dated on or after this day (due date for customers)")
+
+    args = parser.parse_args(argv)
+
+    if not DATABASE_URL:
+        raise ValueError("Missing environment variables. Check .env file")
+
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        if args.command == "export":
+            started = time.perf_counter()
+            if args.output == "-":
+                rows = export(conn, args.table, sys.stdout, args.since)
+                sys.stdout.flush()
+            else:
+                with open(args.output, "w", newline="", encoding="utf-8") as f:
+                    rows = export(conn, args.table, f, args.since)
+            elapsed = time.perf_counter() - started
+            # Keep stdout clean for the CSV itself
+            print(f"📤 Exported {rows} {args.table} row(s) in {elapsed:.2f}s "
+                  f"({rows / elapsed if elapsed else 0:.0f} rows/s)", file=sys.stderr)
+            return
+
+        fmt = input_format(args.file, args.format)
+        rejects = open(args.rejects, "w", newline="", encoding="utf-8") if args.rejects else None
+        try:
+            if args.file == "-":
+                report = ingest(conn, sys.stdin, fmt, args.new_cycle, args.dry_run, rejects)
+            else:
+                with open(args.file, newline="", encoding="utf-8-sig") as f:
+                    report = ingest(conn, f, fmt, args.new_cycle, args.dry_run, rejects)
+        finally:
+            if rejects is not None:
+                rejects.close()
+    finally:
+        conn.close()
+
+    if not args.dry_run:
+        # Changed amounts and reset loans must not be served from the shared page cache
+        reconcile.evict_shared_page_cache(report["updated_ids"])
+    summary = {key: value for key, value in report.items() if key != "updated_ids"}
+    print(json.dumps(summary, indent=2))
+    if report["rejected"] and not args.rejects:
+        print("❓ Some rows were rejected; pass --rejects PATH to list them")
+
+
+if __name__ == "__main__":
+    main()
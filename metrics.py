@@ -0,0 +1,140 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Upper bounds in seconds: template fills of tens of microseconds up to slow SMTP handshakes
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Latency histogram with one series per combination of label values.
+
+    Observations are counted into fixed buckets, so recording is O(log buckets)
+    and memory does not grow with the number of samples. Quantiles in the
+    summary are estimated from the buckets, as Prometheus' histogram_quantile does.
+    """
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, *labelvalues):
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                # [per-bucket counts (+Inf last), sum, count]
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labelvalues):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labelvalues)
+
+    def _snapshot(self):
+        with self._lock:
+            return {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+
+    def _quantile(self, q, counts, count):
+        rank = q * count
+        seen = 0
+        lower = 0.0
+        for bound, in_bucket in zip(self.buckets + (float("inf"),), counts):
+            if in_bucket and seen + in_bucket >= rank:
+                if bound == float("inf"):
+                    return lower
+                return lower + (bound - lower) * (rank - seen) / in_bucket
+            seen += in_bucket
+            lower = bound
+        return lower
+
+    def summary(self):
+        """Per series: count, total and mean/p50/p99 in milliseconds"""
+        out = {}
+        for labelvalues, (counts, total, count) in sorted(self._snapshot().items()):
+            out[",".join(labelvalues) or "all"] = {
+                "count": count,
+                "total_s": round(total, 4),
+                "mean_ms": round(total / count * 1000, 3),
+                "p50_ms": round(self._quantile(0.50, counts, count) * 1000, 3),
+                "p99_ms": round(self._quantile(0.99, counts, count) * 1000, 3),
+            }
+        return out
+
+    def render(self):
+        """Prometheus text exposition lines"""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labelvalues, (counts, total, count) in sorted(self._snapshot().items()):
+            labels = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labelvalues)]
+            cumulative = 0
+            for bound, in_bucket in zip(self.buckets + ("+Inf",), counts):
+                cumulative += in_bucket
+                le = ",".join(labels + [f'le="{bound}"'])
+                lines.append(f"{self.name}_bucket{{{le}}} {cumulative}")
+            suffix = "{" + ",".join(labels) + "}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_gauges(prefix, values):
+    """Prometheus lines for a flat dict of numbers, e.g. a `stats()` result"""
+    lines = []
+    for key, value in values.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        name = f"{prefix}_{key}"
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return lines
+
+
+class Registry:
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """Return the histogram called `name`, creating it on first use"""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(name, help_text, labelnames, buckets)
+            return histogram
+
+    def render(self):
+        lines = []
+        for histogram in self._histograms.values():
+            lines.extend(histogram.render())
+        return lines
+
+    def summary(self):
+        return {name: histogram.summary() for name, histogram in self._histograms.items()}
+
+
+REGISTRY = Registry()
+
+# Where a reminder run or a request spends its time: db_connect, db_query,
+# template_render, mime_build, smtp_connect, smtp_login, smtp_send, log_write
+STAGE_SECONDS = REGISTRY.histogram(
+    "stage_duration_seconds", "Time spent per pipeline stage", ("stage",))
+
+
+def timed(stage):
+    """Context manager recording the block's duration under `stage`"""
+    return STAGE_SECONDS.time(stage)
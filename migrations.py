@@ -0,0 +1,334 @@
+import os
+import sys
+import json
+import argparse
+import psycopg2
+from collections import namedtuple
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+# Serialises concurrent `upgrade` runs (web release step, cron, manual)
+MIGRATION_LOCK_ID = 7_340_001
+
+# `transactional=False` migrations run in autocommit so they can use
+# CREATE INDEX CONCURRENTLY and never block writes on a live table.
+Migration = namedtuple("Migration", "version name sql transactional")
+
+MIGRATIONS = [
+    Migration(1, "base_tables", """
+        CREATE TABLE IF NOT EXISTS customers (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL,
+            email TEXT NOT NULL,
+            amount NUMERIC(12, 2) NOT NULL,
+            due_date DATE,
+            payment_status TEXT NOT NULL DEFAULT 'UNPAID',
+            paid_at TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS payments (
+            id SERIAL PRIMARY KEY,
+            customer_id INTEGER NOT NULL REFERENCES customers (id),
+            amount NUMERIC(12, 2) NOT NULL,
+            status TEXT NOT NULL,
+            payment_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS email_logs (
+            id SERIAL PRIMARY KEY,
+            customer_id INTEGER NOT NULL REFERENCES customers (id),
+            sent_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            status TEXT NOT NULL,
+            error TEXT
+        );
+        ALTER TABLE email_logs ADD COLUMN IF NOT EXISTS error TEXT;
+    """, True),
+    Migration(2, "email_outbox", """
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id BIGSERIAL PRIMARY KEY,
+            kind TEXT NOT NULL,
+            payload JSONB NOT NULL,
+            status TEXT NOT NULL DEFAULT 'PENDING',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            last_error TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMPTZ
+        );
+        CREATE INDEX IF NOT EXISTS email_outbox_pending_idx
+            ON email_outbox (next_attempt_at) WHERE status = 'PENDING';
+    """, True),
+    # Reminder query: WHERE payment_status = 'UNPAID' ORDER BY due_date
+    Migration(3, "customers_unpaid_due_idx", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS customers_unpaid_due_idx
+            ON customers (due_date) WHERE payment_status = 'UNPAID'
+    """, False),
+    Migration(4, "email_logs_customer_sent_idx", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS email_logs_customer_sent_idx
+            ON email_logs (customer_id, sent_at)
+    """, False),
+    Migration(5, "payments_customer_idx", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS payments_customer_idx
+            ON payments (customer_id)
+    """, False),
+    Migration(6, "reminder_runs", """
+        CREATE TABLE IF NOT EXISTS reminder_runs (
+            run_date DATE PRIMARY KEY,
+            watermark_due DATE,
+            watermark_id INTEGER,
+            started_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            completed_at TIMESTAMP
+        );
+    """, True),
+    # Reminder query now pages by (due_date, id) so a restarted run can resume
+    Migration(7, "customers_unpaid_due_id_idx", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS customers_unpaid_due_id_idx
+            ON customers (due_date, id) WHERE payment_status = 'UNPAID'
+    """, False),
+    Migration(8, "drop_customers_unpaid_due_idx", """
+        DROP INDEX CONCURRENTLY IF EXISTS customers_unpaid_due_idx
+    """, False),
+    # Distributed reminder runs: one row per customer claimed by a worker
+    Migration(9, "reminder_claims", """
+        CREATE TABLE IF NOT EXISTS reminder_claims (
+            run_date DATE NOT NULL,
+            customer_id INTEGER NOT NULL REFERENCES customers (id),
+            worker_id TEXT NOT NULL,
+            claimed_at TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP,
+            lease_expires_at TIMESTAMP NOT NULL,
+            done_at TIMESTAMP,
+            PRIMARY KEY (run_date, customer_id)
+        );
+        CREATE INDEX IF NOT EXISTS reminder_claims_worker_idx
+            ON reminder_claims (run_date, worker_id) WHERE done_at IS NULL;
+    """, True),
+    # Run ledger: runs get their own id (several per day are allowed) and every
+    # email log row records the run that wrote it
+    Migration(10, "reminder_run_ledger", """
+        ALTER TABLE reminder_runs ADD COLUMN IF NOT EXISTS run_id BIGSERIAL;
+        ALTER TABLE reminder_runs DROP CONSTRAINT IF EXISTS reminder_runs_pkey;
+        ALTER TABLE reminder_runs ADD PRIMARY KEY (run_id);
+        ALTER TABLE reminder_runs ADD COLUMN IF NOT EXISTS sent_count INTEGER NOT NULL DEFAULT 0;
+        ALTER TABLE reminder_runs ADD COLUMN IF NOT EXISTS failed_count INTEGER NOT NULL DEFAULT 0;
+        CREATE INDEX IF NOT EXISTS reminder_runs_run_date_idx ON reminder_runs (run_date);
+        ALTER TABLE email_logs ADD COLUMN IF NOT EXISTS run_id BIGINT;
+    """, True),
+    # Resumed runs skip customers the run already logged
+    Migration(11, "email_logs_run_customer_idx", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS email_logs_run_customer_idx
+            ON email_logs (run_id, customer_id) WHERE run_id IS NOT NULL
+    """, False),
+    # Failed reminders awaiting a retry pass (see retry_queue.py)
+    Migration(12, "email_retries", """
+        CREATE TABLE IF NOT EXISTS email_retries (
+            customer_id INTEGER PRIMARY KEY REFERENCES customers (id),
+            status TEXT NOT NULL DEFAULT 'PENDING',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMPTZ,
+            last_error TEXT,
+            failure TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS email_retries_due_idx
+            ON email_retries (next_attempt_at) WHERE status = 'PENDING';
+    """, True),
+    # Digest runs stream unpaid loans grouped by normalised recipient address
+    Migration(13, "customers_unpaid_email_idx", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS customers_unpaid_email_idx
+            ON customers (lower(btrim(email)), due_date, id) WHERE payment_status = 'UNPAID'
+    """, False),
+    # Reminder query sends undated (urgent) loans first: due_date NULLS FIRST
+    Migration(14, "customers_unpaid_urgent_first_idx", """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS customers_unpaid_urgent_first_idx
+            ON customers (due_date NULLS FIRST, id) WHERE payment_status = 'UNPAID'
+    """, False),
+    Migration(15, "drop_customers_unpaid_due_id_idx", """
+        DROP INDEX CONCURRENTLY IF EXISTS customers_unpaid_due_id_idx
+    """, False),
+]
+
+
+def get_connection():
+    return psycopg2.connect(DATABASE_URL)
+
+
+def _ensure_migrations_table(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+    conn.commit()
+
+
+def applied_versions(conn):
+    _ensure_migrations_table(conn)
+    with conn.cursor() as cur:
+        cur.execute("SELECT version FROM schema_migrations")
+        versions = {row[0] for row in cur.fetchall()}
+    conn.commit()
+    return versions
+
+
+def upgrade(conn, verbose=True):
+    """Apply every pending migration in order; returns the versions applied"""
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        try:
+            conn.autocommit = False
+            done = applied_versions(conn)
+            applied = []
+            for migration in MIGRATIONS:
+                if migration.version in done:
+                    continue
+                if verbose:
+                    print(f"⏫ Applying {migration.version:03d}_{migration.name}")
+                conn.autocommit = not migration.transactional
+                with conn.cursor() as cur:
+                    cur.execute(migration.sql)
+                    cur.execute("""
+                        INSERT INTO schema_migrations (version, name) VALUES (%s, %s)
+                    """, (migration.version, migration.name))
+                if migration.transactional:
+                    conn.commit()
+                applied.append(migration.version)
+            return applied
+        finally:
+            if not conn.autocommit:
+                conn.rollback()
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+    finally:
+        conn.autocommit = autocommit
+
+
+def status(conn):
+    done = applied_versions(conn)
+    for migration in MIGRATIONS:
+        mark = "✅" if migration.version in done else "⏳"
+        print(f"{mark} {migration.version:03d}_{migration.name}")
+    return [m.version for m in MIGRATIONS if m.version not in done]
+
+
+# ---------------- INDEX USAGE CHECK ----------------
+def hot_queries():
+    """The production hot paths and the index each one must be able to use.
+
+    Imported lazily: the app modules validate their own environment on import.
+    """
+    import app
+    import send_reminders
+    import outbox
+    import retry_queue
+
+    return [
+        ("reminder fetch", *send_reminders.unpaid_customers_query(), "customers_unpaid_urgent_first_idx"),
+        ("reminder fetch (resumed)",
+         *send_reminders.unpaid_customers_query(after=(send_reminders.date.today(), 0), run_id=0),
+         "customers_unpaid_urgent_first_idx"),
+        ("reminder fetch (resumed, undated)",
+         *send_reminders.unpaid_customers_query(after=(None, 0), run_id=0),
+         "customers_unpaid_urgent_first_idx"),
+        ("digest fetch", *send_reminders.unpaid_customers_query(digest=True), "customers_unpaid_email_idx"),
+        ("resumed run ledger", """
+            SELECT 1 FROM email_logs WHERE run_id = %s AND customer_id = %s
+        """, (0, 0), "email_logs_run_customer_idx"),
+        ("distributed claim", send_reminders.CLAIM_CUSTOMERS_SQL,
+         dict(send_reminders.cooldown_params(), run_date=send_reminders.date.today(),
+              worker_id="check", limit=1, lease=1), "customers_unpaid_urgent_first_idx"),
+        ("retry pass", retry_queue.DUE_RETRIES_SQL, {"claim": 0}, "email_retries_due_idx"),
+        ("payment page lookup", app.PAYMENT_PAGE_SQL, (0,), "customers_pkey"),
+        ("payment confirm", app.CONFIRM_PAYMENT_SQL,
+         {"loan_id": 0, "channel": outbox.NOTIFY_CHANNEL}, "customers_pkey"),
+        ("email log history", """
+            SELECT max(sent_at) FROM email_logs WHERE customer_id = %s
+        """, (0,), "email_logs_customer_sent_idx"),
+    ]
+
+
+def _plan_indexes(node, found):
+    if "Index Name" in node:
+        found.add(node["Index Name"])
+    for child in node.get("Plans", []):
+        _plan_indexes(child, found)
+    return found
+
+
+def check_indexes(conn, analyze=False, verbose=True):
+    """EXPLAIN each hot query and report those that cannot use their index.
+
+    Sequential scans and sorts are disabled for the check, so the planner
+    picks the index whenever it is usable at all, and an index that returns
+    the rows in the query's order over one that would need a sort. The
+    check therefore holds on a small development database too, and fails
+    only when the index is missing or the query no longer matches it (for
+    example a changed partial-index predicate). Plans depend on table
+    statistics; pass `analyze=True` on a freshly loaded database whose
+    tables have never been analysed. Without statistics, or with no rows at
+    all, the planner may answer a key lookup with a full scan of a smaller
+    partial index instead of the primary key, and the check reports it.
+    """
+    failures = []
+    with conn.cursor() as cur:
+        if analyze:
+            cur.execute("ANALYZE customers, payments, email_logs")
+        cur.execute("SET LOCAL enable_seqscan = off")
+        cur.execute("SET LOCAL enable_sort = off")
+        for label, sql, params, index in hot_queries():
+            cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+            plan = cur.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            used = _plan_indexes(plan[0]["Plan"], set())
+            ok = index in used
+            if verbose:
+                used = sorted(used)
+                print(f"{'✅' if ok else '❌'} {label}: expects {index}, plan uses {used or 'no index'}")
+            if not ok:
+                failures.append(label)
+    conn.rollback()
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Database schema migrations")
+    parser.add_argument("command", choices=["upgrade", "status", "check"],
+                        help="apply pending migrations, list them, or verify hot queries use their indexes")
+    parser.add_argument("--analyze", action="store_true",
+                        help="with check: refresh table statistics before planning")
+    args = parser.parse_args(argv)
+
+    if not DATABASE_URL:
+        raise ValueError("Missing environment variables. Check .env file")
+
+    conn = get_connection()
+    try:
+        if args.command == "upgrade":
+            applied = upgrade(conn)
+            print(f"✅ Schema up to date ({len(applied)} migration(s) applied)")
+        elif args.command == "status":
+            pending = status(conn)
+            sys.exit(1 if pending else 0)
+        else:
+            failures = check_indexes(conn, analyze=args.analyze)
+            if failures:
+                print(f"❌ {len(failures)} hot query(ies) no longer use their index")
+                sys.exit(1)
+            print("✅ All hot queries use their indexes")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import re
+import sys
+import random
+from email import policy as email_policy
+from email import quoprimime
+from email.message import EmailMessage
+
+# What smtplib.send_message() flattens an EmailMessage with
+WIRE_POLICY = email_policy.default.clone(linesep="\r\n")
+MAX_LINE_LENGTH = email_policy.default.max_line_length
+CRLF = b"\r\n"
+
+# Generator._make_boundary: 15 '=', a zero-padded random token, '=='
+_BOUNDARY_WIDTH = len(repr(sys.maxsize - 1))
+SAMPLE_BOUNDARY = "=" * 15 + "0" * _BOUNDARY_WIDTH + "=="
+
+# Addresses whose To header folds to a single unchanged line
+SIMPLE_ADDRESS_RE = re.compile(r"[A-Za-z0-9._%+\-]+@[A-Za-z0-9.\-]+")
+
+# send_message() flattens without a policy, so the generator escapes body
+# lines starting with "From " (mbox From_ lines) as ">From "
+FROM_LINE_RE = re.compile(rb"^From ", re.MULTILINE)
+
+QP_LINE_CACHE_SIZE = 20000
+SUBJECT_CACHE_SIZE = 5000
+
+
+def fold_header(name, value):
+    """One header exactly as send_message() writes it"""
+    return WIRE_POLICY.fold_binary(name, WIRE_POLICY.header_store_parse(name, value)[1])
+
+
+def make_boundary():
+    return "=" * 15 + "%0*d" % (_BOUNDARY_WIDTH, random.randrange(sys.maxsize)) + "=="
+
+
+def build_email_message(subject, from_header, to_addr, text, html):
+    """The stdlib construction the bulk builder reproduces"""
+    msg = EmailMessage()
+    msg["Subject"] = subject
+    msg["From"] = from_header
+    msg["To"] = to_addr
+    msg.set_content(text)
+    msg.add_alternative(html, subtype="html")
+    return msg
+
+
+def flatten(msg):
+    """Serialise a message the way smtplib.send_message() does"""
+    from io import BytesIO
+    from email.generator import BytesGenerator
+
+    out = BytesIO()
+    BytesGenerator(out).flatten(msg, linesep="\r\n")
+    return out.getvalue()
+
+
+class BulkMessageBuilder:
+    """Builds multipart/alternative text + HTML messages as wire-ready bytes.
+
+    The output is byte for byte what `EmailMessage` + `set_content` +
+    `add_alternative` + `send_message` would put on the wire, except for the
+    random MIME boundary. That includes the generator's ">From " escaping of
+    body lines starting with "From ". Header and part skeletons are taken from the stdlib
+    once per transfer-encoding combination. The From header is folded once
+    and subjects are memoised. Quoted-printable lines are encoded once and
+    cached, so the constant template lines are not encoded again.
+
+    `build()` returns None for the rare message the fast path does not cover
+    (a To address that is not a plain addr-spec, a body the stdlib would
+    base64-encode); send those as an `EmailMessage`.
+    """
+
+    def __init__(self, from_header):
+        self.from_header = from_header
+        self._from = fold_header("From", from_header)
+        self._skeletons = {}
+        self._qp_cache = {}
+        self._subject_cache = {}
+        self.built = 0
+        self.fallbacks = 0
+
+    # ---- encoding, mirroring email.contentmanager._encode_text ----
+    def _qp_line(self, line):
+        encoded = self._qp_cache.get(line)
+        if encoded is None:
+            encoded = quoprimime.body_encode(line, MAX_LINE_LENGTH)
+            if len(self._qp_cache) < QP_LINE_CACHE_SIZE:
+                self._qp_cache[line] = encoded
+        return encoded
+
+    def _encode_body(self, string):
+        """Return `(cte, wire bytes)`, or None where the stdlib would pick base64"""
+        encoded = self._encode_payload(string)
+        if encoded is None:
+            return None
+        cte, body = encoded
+        if b"From " in body:
+            body = FROM_LINE_RE.sub(b">From ", body)
+        return cte, body
+
+    def _encode_payload(self, string):
+        raw = string.encode("utf-8")
+        lines = raw.splitlines()
+        if max(map(len, lines), default=0) <= MAX_LINE_LENGTH:
+            return ("7bit" if raw.isascii() else "8bit"), CRLF.join(lines) + CRLF
+
+        # The stdlib sniffs the first ten lines and picks the shorter encoding
+        encoded = [self._qp_line(line.decode("latin-1")) for line in lines]
+        sniff = lines[:10]
+        sniff_qp = sum(map(len, encoded[:10])) + len(sniff)
+        sniff_len = sum(map(len, sniff)) + len(sniff)
+        sniff_base64 = 4 * ((sniff_len + 2) // 3) + 1
+        if sniff_qp > sniff_base64:
+            return None
+        # Long lines carry soft breaks, which the generator also writes as CRLF
+        body = "\n".join(encoded).replace("\n", "\r\n")
+        return "quoted-printable", body.encode("ascii") + CRLF
+
+    # ---- skeletons ----
+    def _skeleton(self, text_cte, html_cte):
+        key = (text_cte, html_cte)
+        skeleton = self._skeletons.get(key)
+        if skeleton is None:
+            skeleton = self._skeletons[key] = self._derive_skeleton(text_cte, html_cte)
+        return skeleton
+
+    def _derive_skeleton(self, text_cte, html_cte):
+        """Cut the constant header blocks out of one stdlib-built message.
+
+        The result is checked by rebuilding the sample from the pieces; if the
+        stdlib ever lays messages out differently, the combination is marked
+        unusable and every such message falls back to the stdlib.
+        """
+        subject, to_addr, text, html = "Sample", "sample@example.com", "x\n", "<p>x</p>\n"
+        msg = EmailMessage()
+        msg["Subject"] = subject
+        msg["From"] = self.from_header
+        msg["To"] = to_addr
+        msg.set_content(text, cte=text_cte)
+        msg.add_alternative(html, subtype="html", cte=html_cte)
+        msg.set_boundary(SAMPLE_BOUNDARY)
+        expected = flatten(msg)
+
+        boundary = SAMPLE_BOUNDARY.encode("ascii")
+        prefix = fold_header("Subject", subject) + self._from + fold_header("To", to_addr)
+        head, _, body = expected.partition(CRLF + CRLF)
+        if not head.startswith(prefix):
+            return None
+        top = head[len(prefix):] + CRLF + CRLF
+        parts = body.split(CRLF + b"--" + boundary)
+        try:
+            text_headers = parts[0][len(b"--" + boundary + CRLF):].partition(CRLF + CRLF)[0] + CRLF + CRLF
+            html_headers = parts[1][len(CRLF):].partition(CRLF + CRLF)[0] + CRLF + CRLF
+        except IndexError:
+            return None
+        skeleton = (top, text_headers, html_headers)
+
+        sample = self._assemble(skeleton, fold_header("Subject", subject), fold_header("To", to_addr),
+                                self._encode_body(text)[1], self._encode_body(html)[1], boundary)
+        return skeleton if sample == expected else None
+
+    def _assemble(self, skeleton, subject, to, text_body, html_body, boundary):
+        top, text_headers, html_headers = skeleton
+        return b"".join((
+            subject, self._from, to, top.replace(SAMPLE_BOUNDARY.encode("ascii"), boundary),
+            b"--", boundary, CRLF, text_headers, text_body,
+            CRLF, b"--", boundary, CRLF, html_headers, html_body,
+            CRLF, b"--", boundary, b"--", CRLF,
+        ))
+
+    def _subject(self, subject):
+        folded = self._subject_cache.get(subject)
+        if folded is None:
+            folded = fold_header("Subject", subject)
+            if len(self._subject_cache) < SUBJECT_CACHE_SIZE:
+                self._subject_cache[subject] = folded
+        return folded
+
+    def build(self, subject, to_addr, text, html):
+        """Wire-ready bytes for `sendmail`, or None to use the stdlib instead"""
+        if len(to_addr) > MAX_LINE_LENGTH - 8 or not SIMPLE_ADDRESS_RE.fullmatch(to_addr):
+            self.fallbacks += 1
+            return None
+        text_part = self._encode_body(text)
+        html_part = self._encode_body(html)
+        if text_part is None or html_part is None:
+            self.fallbacks += 1
+            return None
+        skeleton = self._skeleton(text_part[0], html_part[0])
+        boundary = make_boundary().encode("ascii")
+        delimiter = b"--" + boundary
+        if skeleton is None or delimiter in text_part[1] or delimiter in html_part[1]:
+            self.fallbacks += 1
+            return None
+        self.built += 1
+        return self._assemble(skeleton, self._subject(subject), b"To: " + to_addr.encode("ascii") + CRLF,
+                              text_part[1], html_part[1], boundary)
+
+    def stats(self):
+        return {"built": self.built, "fallbacks": self.fallbacks}
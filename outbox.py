@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import select
+import argparse
+import psycopg2
+from decimal import Decimal
+from datetime import date, datetime
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+NOTIFY_CHANNEL = "email_outbox"
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 50))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", 10))  # seconds, fallback when no NOTIFY arrives
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 8))
+OUTBOX_RETRY_BASE = float(os.getenv("OUTBOX_RETRY_BASE", 30))  # seconds, doubled per attempt
+OUTBOX_RETRY_MAX = float(os.getenv("OUTBOX_RETRY_MAX", 3600))
+OUTBOX_RECONNECT_MAX = float(os.getenv("OUTBOX_RECONNECT_MAX", 60))  # seconds, cap of the reconnect backoff
+
+# Outbox payload of a payment confirmation, built in SQL from a row of the
+# just-paid customer (id, name, email, amount, paid_at)
+CONFIRMATION_PAYLOAD_SQL = """json_build_object(
+            'name', name,
+            'email', email,
+            'loan_id', id,
+            'amount', amount::text,
+            'paid_at', paid_at
+        )"""
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialise {type(value).__name__} in outbox payload")
+
+
+def enqueue(cur, kind, payload):
+    """Queue an email inside the caller's transaction.
+
+    The row and the NOTIFY only become visible when the caller commits, so an
+    email is queued if and only if the business change it describes is.
+    """
+    cur.execute("""
+        INSERT INTO email_outbox (kind, payload)
+        VALUES (%s, %s)
+    """, (kind, json.dumps(payload, default=_json_default)))
+    cur.execute(f"NOTIFY {NOTIFY_CHANNEL}")
+
+
+class OutboxWorker:
+    """Drains `email_outbox`, waking on LISTEN/NOTIFY and polling as a fallback.
+
+    `handlers` maps an outbox `kind` to a callable taking the decoded payload
+    and returning `(success, error)`. Rows are claimed with SKIP LOCKED, so
+    several workers can run side by side; failed rows are retried with
+    exponential backoff until `max_attempts`, then marked FAILED. `idle`, if
+    given, is called whenever a wait ends without a NOTIFY, for example to
+    keep an SMTP connection open between sends. A dropped
+    database connection (Neon autosuspend, a restart) is reopened with
+    backoff, and anything queued meanwhile is drained on reconnect.
+    """
+
+    def __init__(self, dsn, handlers, batch_size=OUTBOX_BATCH_SIZE,
+                 poll_interval=OUTBOX_POLL_INTERVAL, max_attempts=OUTBOX_MAX_ATTEMPTS,
+                 retry_base=OUTBOX_RETRY_BASE, retry_max=OUTBOX_RETRY_MAX,
+                 reconnect_max=OUTBOX_RECONNECT_MAX, idle=None):
+        self.dsn = dsn
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.reconnect_max = reconnect_max
+        self.idle = idle
+
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.reconnects = 0
+
+    def drain_once(self, conn):
+        """Process one batch of due rows; returns how many were claimed"""
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT id, kind, payload, attempts
+                FROM email_outbox
+                WHERE status = 'PENDING' AND next_attempt_at <= CURRENT_TIMESTAMP
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (self.batch_size,))
+            rows = cur.fetchall()
+
+            for outbox_id, kind, payload, attempts in rows:
+                handler = self.handlers.get(kind)
+                if handler is None:
+                    success, error = False, f"no handler for outbox kind '{kind}'"
+                else:
+                    try:
+                        success, error = handler(payload)
+                    except Exception as e:
+                        success, error = False, str(e)
+
+                if success:
+                    self.sent += 1
+                    cur.execute("""
+                        UPDATE email_outbox
+                        SET status = 'SENT', sent_at = CURRENT_TIMESTAMP, attempts = attempts + 1, last_error = NULL
+                        WHERE id = %s
+                    """, (outbox_id,))
+                elif attempts + 1 >= self.max_attempts:
+                    self.failed += 1
+                    cur.execute("""
+                        UPDATE email_outbox
+                        SET status = 'FAILED', attempts = attempts + 1, last_error = %s
+                        WHERE id = %s
+                    """, (error, outbox_id))
+                else:
+                    self.retried += 1
+                    delay = min(self.retry_base * (2 ** attempts), self.retry_max)
+                    cur.execute("""
+                        UPDATE email_outbox
+                        SET attempts = attempts + 1, last_error = %s,
+                            next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                        WHERE id = %s
+                    """, (error, delay, outbox_id))
+        conn.commit()
+        return len(rows)
+
+    def drain(self, conn):
+        """Keep draining until no due rows are left"""
+        total = 0
+        while True:
+            claimed = self.drain_once(conn)
+            total += claimed
+            if claimed < self.batch_size:
+                return total
+
+    def _connect(self):
+        """Open the work and LISTEN connections"""
+        work_conn = psycopg2.connect(self.dsn)
+        try:
+            listen_conn = psycopg2.connect(self.dsn)
+            listen_conn.autocommit = True
+            with listen_conn.cursor() as cur:
+                cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+        except Exception:
+            work_conn.close()
+            raise
+        return work_conn, listen_conn
+
+    def _listen(self, work_conn, listen_conn):
+        while True:
+            self.drain(work_conn)
+            # Sleep until a NOTIFY arrives or the poll interval elapses
+            if select.select([listen_conn], [], [], self.poll_interval) != ([], [], []):
+                listen_conn.poll()
+                listen_conn.notifies.clear()
+            elif self.idle is not None:
+                self.idle()
+
+    def run_forever(self):
+        work_conn, listen_conn = self._connect()
+        print(f"📬 Outbox worker listening on '{NOTIFY_CHANNEL}' (poll every {self.poll_interval}s)")
+        while True:
+            try:
+                self._listen(work_conn, listen_conn)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                print(f"⚠️ Outbox worker lost its database connection: {str(e).strip()}")
+            finally:
+                work_conn.close()
+                listen_conn.close()
+
+            # Reconnect with backoff; NOTIFYs sent while away are lost, so the
+            # first drain after LISTEN picks up whatever was queued meanwhile
+            delay = 1.0
+            while True:
+                time.sleep(delay)
+                try:
+                    work_conn, listen_conn = self._connect()
+                    break
+                except psycopg2.OperationalError as e:
+                    print(f"⚠️ Reconnect failed, retrying in {min(delay * 2, self.reconnect_max):.0f}s: {str(e).strip()}")
+                    delay = min(delay * 2, self.reconnect_max)
+            self.reconnects += 1
+            print("🔌 Outbox worker reconnected")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Deliver queued emails from email_outbox")
+    parser.add_argument("--once", action="store_true", help="drain due rows once and exit")
+    args = parser.parse_args(argv)
+
+    if not DATABASE_URL:
+        raise ValueError("Missing environment variables. Check .env file")
+
+    # Imported here so the web app can import enqueue() without a cycle
+    from app import deliver_confirmation_email, keep_smtp_session_alive
+
+    worker = OutboxWorker(DATABASE_URL, {"payment_confirmation": deliver_confirmation_email},
+                          idle=keep_smtp_session_alive)
+
+    if args.once:
+        conn = psycopg2.connect(DATABASE_URL)
+        try:
+            worker.drain(conn)
+        finally:
+            conn.close()
+        print(f"✅ Outbox drained: {worker.sent} sent, {worker.retried} to retry, {worker.failed} failed")
+        return
+
+    worker.run_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TTL = 300  # seconds a found customer is served from the cache
+DEFAULT_NEGATIVE_TTL = 60  # seconds a paid or unknown loan id is remembered
+DEFAULT_LOCAL_TTL = 5  # in-process cap when a shared backend holds the entries
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a per-entry TTL"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """Return `(found, value)`; a cached None is a found negative entry"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """Shared cache across gunicorn workers; values are stored as JSON"""
+
+    def __init__(self, url, prefix="page_cache:"):
+        import redis  # optional dependency, only needed when PAGE_CACHE_URL is set
+
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(f"{self.prefix}{key}")
+        if raw is None:
+            return False, None
+        return True, json.loads(raw)
+
+    def set(self, key, value, ttl):
+        self.client.set(f"{self.prefix}{key}", json.dumps(value), ex=max(1, int(ttl)))
+
+    def delete(self, key):
+        self.client.delete(f"{self.prefix}{key}")
+
+
+class AsyncRedisBackend(RedisBackend):
+    """RedisBackend for the ASGI app: the same entries, read without blocking the event loop"""
+
+    def __init__(self, url, prefix="page_cache:"):
+        import redis.asyncio  # optional dependency, only needed when PAGE_CACHE_URL is set
+
+        self.client = redis.asyncio.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.prefix = prefix
+
+    async def get(self, key):
+        raw = await self.client.get(f"{self.prefix}{key}")
+        if raw is None:
+            return False, None
+        return True, json.loads(raw)
+
+    async def set(self, key, value, ttl):
+        await self.client.set(f"{self.prefix}{key}", json.dumps(value), ex=max(1, int(ttl)))
+
+    async def delete(self, key):
+        await self.client.delete(f"{self.prefix}{key}")
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class PageCache:
+    """Read-through cache for page data, with negative caching.
+
+    `loader(key)` returns a JSON-serialisable value, or None when there is
+    nothing to show (negative entries use `negative_ttl`). Lookups try the
+    in-process LRU first, then the optional shared backend, then the loader.
+    With a shared backend the in-process copy lives at most `local_ttl`
+    seconds, which bounds how long another worker can serve an evicted entry.
+    A shared backend that is down is skipped, never fatal. An async app uses
+    `get_async()` and `put_async()` with an `AsyncRedisBackend`.
+    """
+
+    def __init__(self, loader, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL,
+                 negative_ttl=DEFAULT_NEGATIVE_TTL, shared=None, local_ttl=DEFAULT_LOCAL_TTL):
+        self.loader = loader
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.shared = shared
+        self.local_ttl = local_ttl
+        self.local = TTLCache(max_entries)
+
+        self._lock = threading.Lock()
+        self._evicted = 0
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.shared_errors = 0
+
+    def _local_ttl(self, ttl):
+        return min(ttl, self.local_ttl) if self.shared is not None else ttl
+
+    def _lookup_local(self, key):
+        found, value = self.local.get(key)
+        if found:
+            self.hits += 1
+        return found, value
+
+    def _shared_hit(self, key, value):
+        self.shared_hits += 1
+        self.local.set(key, value, self._local_ttl(self.ttl if value is not None else self.negative_ttl))
+
+    def _lookup(self, key):
+        found, value = self._lookup_local(key)
+        if found:
+            return True, value
+
+        if self.shared is not None:
+            try:
+                found, value = self.shared.get(key)
+            except Exception:
+                self.shared_errors += 1
+                found = False
+            if found:
+                self._shared_hit(key, value)
+                return True, value
+
+        self.misses += 1
+        return False, None
+
+    async def _lookup_async(self, key):
+        found, value = self._lookup_local(key)
+        if found:
+            return True, value
+
+        if self.shared is not None:
+            try:
+                found, value = await self.shared.get(key)
+            except Exception:
+                self.shared_errors += 1
+                found = False
+            if found:
+                self._shared_hit(key, value)
+                return True, value
+
+        self.misses += 1
+        return False, None
+
+    def get(self, key):
+        found, value = self._lookup(key)
+        if found:
+            return value
+        evicted_before = self._evicted
+        value = self.loader(key)
+        # An eviction while the loader ran may have made this value stale already
+        if self._evicted == evicted_before:
+            self._store(key, value)
+        return value
+
+    async def get_async(self, key):
+        """`get()` for a coroutine `loader`, as used by the ASGI app"""
+        found, value = await self._lookup_async(key)
+        if found:
+            return value
+        evicted_before = self._evicted
+        value = await self.loader(key)
+        if self._evicted == evicted_before:
+            await self._store_async(key, value)
+        return value
+
+    def _store_local(self, key, value):
+        """Cache a value in-process and return its TTL for the shared backend"""
+        ttl = self.ttl if value is not None else self.negative_ttl
+        self.local.set(key, value, self._local_ttl(ttl))
+        return ttl
+
+    def _store(self, key, value):
+        ttl = self._store_local(key, value)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value, ttl)
+            except Exception:
+                self.shared_errors += 1
+
+    async def _store_async(self, key, value):
+        ttl = self._store_local(key, value)
+        if self.shared is not None:
+            try:
+                await self.shared.set(key, value, ttl)
+            except Exception:
+                self.shared_errors += 1
+
+    def put(self, key, value):
+        """Store a value known from a write (None once a loan is paid) in place of a reload"""
+        with self._lock:
+            self._evicted += 1
+        self._store(key, value)
+
+    def evict(self, key):
+        with self._lock:
+            self._evicted += 1
+        self.local.delete(key)
+        if self.shared is not None:
+            try:
+                self.shared.delete(key)
+            except Exception:
+                self.shared_errors += 1
+
+    async def put_async(self, key, value):
+        """`put()` for an async shared backend"""
+        with self._lock:
+            self._evicted += 1
+        await self._store_async(key, value)
+
+    def stats(self):
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            "entries": len(self.local),
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.shared_hits) / lookups, 3) if lookups else 0.0,
+            "evictions": self.local.evictions,
+            "expirations": self.local.expirations,
+            "shared_errors": self.shared_errors,
+        }
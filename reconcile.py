@@ -0,0 +1,194 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import itertools
+import psycopg2
+from dotenv import load_dotenv
+from metrics import timed
+import outbox
+from copy_stream import CopyStream
+
+# Load environment variables
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+PAGE_CACHE_URL = os.getenv("PAGE_CACHE_URL")
+PAGE_CACHE_NEGATIVE_TTL = float(os.getenv("PAGE_CACHE_NEGATIVE_TTL", 60))
+
+# A trimmed text loan id as the customers.id INTEGER it names, or NULL when it
+# names none. Leading zeros are dropped, so "007" and "7" are the same loan,
+# and a value past the column's range is rejected before any cast can fail.
+LOAN_ID_SQL = """CASE WHEN {column} ~ '^0*[0-9]{{1,10}}$' THEN
+        CASE WHEN {column}::bigint <= 2147483647 THEN {column}::integer END END"""
+
+# Settlement ids land here as text, so malformed ones are reported, not fatal
+CREATE_STAGING_SQL = """
+    CREATE TEMP TABLE settlement_staging (loan_id TEXT) ON COMMIT DROP
+"""
+
+# Everything in one statement: mark the matching UNPAID loans paid, record
+# their payments, queue their confirmation emails for the outbox worker and
+# classify every distinct loan in the file (a valid id is reported in its
+# normalised form, a malformed one as written). All parts see the same
+# snapshot, so a loan is 'matched' when this statement paid it and
+# 'already_paid' when it exists but was not UNPAID.
+RECONCILE_SQL = """
+    WITH ids AS (
+        SELECT DISTINCT btrim(loan_id) AS loan_id
+        FROM settlement_staging
+        WHERE btrim(loan_id) <> ''
+    ), parsed AS (
+        SELECT DISTINCT coalesce(id::text, loan_id) AS loan_id, id
+        FROM (SELECT loan_id, """ + LOAN_ID_SQL.format(column="loan_id") + """ AS id FROM ids) raw
+    ), paid AS (
+        UPDATE customers c
+        SET payment_status = 'PAID',
+            paid_at = CURRENT_TIMESTAMP
+        FROM parsed p
+        WHERE c.id = p.id AND c.payment_status = 'UNPAID'
+        RETURNING c.id, c.name, c.email, c.amount, c.paid_at
+    ), payment AS (
+        INSERT INTO payments (customer_id, amount, status, payment_date)
+        SELECT id, amount, 'SUCCESS', paid_at FROM paid
+    ), queued AS (
+        INSERT INTO email_outbox (kind, payload)
+        SELECT 'payment_confirmation', """ + outbox.CONFIRMATION_PAYLOAD_SQL + """
+        FROM paid
+    )
+    SELECT p.loan_id,
+           CASE WHEN paid.id IS NOT NULL THEN 'matched'
+                WHEN c.id IS NOT NULL THEN 'already_paid'
+                ELSE 'unknown' END
+    FROM parsed p
+    LEFT JOIN paid ON paid.id = p.id
+    LEFT JOIN customers c ON c.id = p.id
+    ORDER BY p.id, p.loan_id
+"""
+
+
+class LoanIdStream(CopyStream):
+    """File-like view of a settlement file's loan id column, in CSV for COPY.
+
+    The id column is `column` when the first row is a header naming it,
+    otherwise the first column of every row. Rows are read lazily (see
+    `CopyStream`), so the file is never held in memory.
+    """
+
+    def __init__(self, source, column="loan_id"):
+        rows = csv.reader(source)
+        index = 0
+
+        first = next(rows, None)
+        header = [cell.strip().lower() for cell in first or ()]
+        if column.lower() in header:
+            index = header.index(column.lower())
+        else:
+            # No header: the first row is data too
+            rows = itertools.chain([first] if first is not None else [], rows)
+        super().__init__([row[index] if index < len(row) else ""] for row in rows)
+
+
+def reconcile(conn, source, column="loan_id", dry_run=False):
+    """Apply a settlement file in one transaction and report what it matched.
+
+    `source` is a text file object. Returns a report with the number of rows
+    read, the counts and the ids per outcome ('matched', 'already_paid',
+    'unknown'). With `dry_run` the transaction is rolled back, so nothing is
+    paid or queued.
+    """
+    started = time.perf_counter()
+    stream = LoanIdStream(source, column)
+    try:
+        with conn.cursor() as cur:
+            with timed("db_query"):
+                cur.execute(CREATE_STAGING_SQL)
+                cur.copy_expert("COPY settlement_staging (loan_id) FROM STDIN WITH (FORMAT csv)", stream)
+                cur.execute(RECONCILE_SQL)
+                outcomes = cur.fetchall()
+            ids = {"matched": [], "already_paid": [], "unknown": []}
+            for loan_id, outcome in outcomes:
+                ids[outcome].append(loan_id)
+            if ids["matched"] and not dry_run:
+                # One wake-up for the whole batch of queued confirmations
+                cur.execute(f"NOTIFY {outbox.NOTIFY_CHANNEL}")
+        with timed("db_query"):
+            if dry_run:
+                conn.rollback()
+            else:
+                conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return {
+        "rows": stream.rows,
+        "distinct_ids": len(outcomes),
+        **{outcome: len(values) for outcome, values in ids.items()},
+        "dry_run": dry_run,
+        "elapsed_s": round(time.perf_counter() - started, 3),
+        "ids": ids,
+    }
+
+
+def evict_shared_page_cache(loan_ids, paid=False):
+    """Drop loans from the web workers' shared page cache, if there is one.
+
+    Paid loans are stored as negative entries instead, so that a web worker
+    reading from a lagging replica cannot cache them as UNPAID again.
+    """
+    if not PAGE_CACHE_URL or not loan_ids:
+        return
+    from page_cache import RedisBackend
+
+    try:
+        backend = RedisBackend(PAGE_CACHE_URL)
+        for loan_id in loan_ids:
+            if paid:
+                backend.set(int(loan_id), None, PAGE_CACHE_NEGATIVE_TTL)
+            else:
+                backend.delete(int(loan_id))
+    except Exception as e:
+        print(f"⚠️ Could not evict the shared page cache: {e}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mark the loans in a bank settlement file as paid")
+    parser.add_argument("file", help="CSV settlement file, or - for stdin")
+    parser.add_argument("--column", default="loan_id",
+                        help="header of the loan id column (default: loan_id; first column if there is no header)")
+    parser.add_argument("--dry-run", action="store_true", help="report the outcome without applying it")
+    parser.add_argument("--report", default=None, metavar="PATH",
+                        help="write the full report, including every id, to this JSON file")
+    args = parser.parse_args(argv)
+
+    if not DATABASE_URL:
+        raise ValueError("Missing environment variables. Check .env file")
+
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        if args.file == "-":
+            report = reconcile(conn, sys.stdin, args.column, args.dry_run)
+        else:
+            with open(args.file, newline="", encoding="utf-8-sig") as f:
+                report = reconcile(conn, f, args.column, args.dry_run)
+    finally:
+        conn.close()
+
+    if not args.dry_run:
+        evict_shared_page_cache(report["ids"]["matched"], paid=True)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+    summary = {key: value for key, value in report.items() if key != "ids"}
+    print(json.dumps(summary, indent=2))
+    if report["unknown"]:
+        shown = report["ids"]["unknown"][:20]
+        print(f"❓ Unknown loan ids: {', '.join(shown)}{' ...' if report['unknown'] > len(shown) else ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+from collections import OrderedDict
+
+
+class WatermarkTracker:
+    """Tracks the furthest stream position below which every customer is done.
+
+    Customers are sent in parallel and complete out of order, so the
+    watermark only advances over a contiguous prefix of the stream. Positions
+    are `(due_date, id)` keys matching the reminder query's ORDER BY.
+    Customers finished past the watermark are found on resume through their
+    run-tagged email log rows. Counters are kept until `committed()`.
+    """
+
+    def __init__(self, run_id, position=None):
+        self.run_id = run_id
+        self.position = position
+        self._in_flight = OrderedDict()
+        self._sent = 0
+        self._failed = 0
+        self._saved = (0, 0)
+
+    def wrap(self, customers):
+        """Pass a customer stream through, remembering its order"""
+        for customer in customers:
+            self._in_flight[customer.id] = [(customer.due_date, customer.id), False]
+            yield customer
+
+    def complete(self, customer_id, success=True):
+        if success:
+            self._sent += 1
+        else:
+            self._failed += 1
+        entry = self._in_flight.get(customer_id)
+        if entry is None:
+            return
+        entry[1] = True
+        while self._in_flight:
+            key, (position, done) = next(iter(self._in_flight.items()))
+            if not done:
+                break
+            self.position = position
+            self._in_flight.popitem(last=False)
+
+    def save(self, cur):
+        """Persist the watermark and counters inside the caller's transaction"""
+        self._saved = (self._sent, self._failed)
+        save_progress(cur, self.run_id, self.position, *self._saved)
+
+    def committed(self):
+        self._sent -= self._saved[0]
+        self._failed -= self._saved[1]
+        self._saved = (0, 0)
+
+
+class ClaimTracker:
+    """Marks distributed-mode claims done as their log rows are written.
+
+    Each save also renews the lease on this worker's unfinished claims, so a
+    slow (rate limited) batch is not taken over while it is still being sent.
+    Finished claims are kept until `committed()`.
+    """
+
+    def __init__(self, run_date, worker_id, lease_seconds):
+        self.run_date = run_date
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self._done = []
+        self._saved = 0
+
+    def complete(self, customer_id, success=True):
+        self._done.append(customer_id)
+
+    def save(self, cur):
+        done = self._done[:]
+        self._saved = len(done)
+        if done:
+            cur.execute("""
+                UPDATE reminder_claims
+                SET done_at = LOCALTIMESTAMP
+                WHERE run_date = %s AND worker_id = %s AND customer_id = ANY(%s)
+            """, (self.run_date, self.worker_id, done))
+        cur.execute("""
+            UPDATE reminder_claims
+            SET lease_expires_at = LOCALTIMESTAMP + make_interval(secs => %s)
+            WHERE run_date = %s AND worker_id = %s AND done_at IS NULL
+        """, (self.lease_seconds, self.run_date, self.worker_id))
+
+    def committed(self):
+        del self._done[:self._saved]
+        self._saved = 0
+
+
+def create_run(conn, run_date):
+    """Open a new run and return its id"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO reminder_runs (run_date) VALUES (%s) RETURNING run_id
+        """, (run_date,))
+        run_id = cur.fetchone()[0]
+    conn.commit()
+    return run_id
+
+
+def load_run(conn, run_id):
+    """Return `(run_date, watermark, completed_at)` for a run, or None"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT run_date, watermark_due, watermark_id, completed_at
+            FROM reminder_runs WHERE run_id = %s
+        """, (run_id,))
+        row = cur.fetchone()
+    conn.commit()
+    if row is None:
+        return None
+    run_date, watermark_due, watermark_id, completed_at = row
+    watermark = None if watermark_id is None else (watermark_due, watermark_id)
+    return run_date, watermark, completed_at
+
+
+def latest_unfinished_run(conn, run_date):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT run_id FROM reminder_runs
+            WHERE run_date = %s AND completed_at IS NULL
+            ORDER BY run_id DESC
+            LIMIT 1
+        """, (run_date,))
+        row = cur.fetchone()
+    conn.commit()
+    return row[0] if row else None
+
+
+def start_run(conn, run_date, resume=None, restart=False):
+    """Pick the run to work on and return `(run_id, watermark, resumed)`.
+
+    `resume` continues that run id. Otherwise today's latest unfinished run
+    is continued, unless `restart` asks for a fresh run from the top. A
+    completed run is never reopened; the cool-down window keeps a new run
+    from re-sending to anyone an earlier one reached.
+    """
+    if resume is not None:
+        run = load_run(conn, resume)
+        if run is None:
+            raise ValueError(f"Unknown reminder run {resume}")
+        if run[2] is not None:
+            raise ValueError(f"Reminder run {resume} already completed at {run[2]}")
+        return resume, run[1], True
+    if not restart:
+        run_id = latest_unfinished_run(conn, run_date)
+        if run_id is not None:
+            return run_id, load_run(conn, run_id)[1], True
+    return create_run(conn, run_date), None, False
+
+
+def save_progress(cur, run_id, position, sent=0, failed=0):
+    """Persist the watermark and counters inside the caller's transaction"""
+    cur.execute("""
+        UPDATE reminder_runs
+        SET watermark_due = CASE WHEN %(moved)s THEN %(due)s ELSE watermark_due END,
+            watermark_id = CASE WHEN %(moved)s THEN %(id)s ELSE watermark_id END,
+            sent_count = sent_count + %(sent)s,
+            failed_count = failed_count + %(failed)s,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE run_id = %(run_id)s
+    """, {
+        "moved": position is not None,
+        "due": position[0] if position else None,
+        "id": position[1] if position else None,
+        "sent": sent,
+        "failed": failed,
+        "run_id": run_id,
+    })
+
+
+def finish_run(conn, run_id):
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE reminder_runs
+            SET completed_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+            WHERE run_id = %s
+        """, (run_id,))
+    conn.commit()
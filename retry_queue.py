@@ -0,0 +1,159 @@
+import os
+import random
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", 5))
+RETRY_BASE = float(os.getenv("RETRY_BASE", 300))  # seconds, doubled per attempt
+RETRY_MAX = float(os.getenv("RETRY_MAX", 6 * 3600))
+RETRY_CLAIM_SECONDS = float(os.getenv("RETRY_CLAIM_SECONDS", 600))  # how long a retry pass holds a due retry
+
+# Claim the due retries of customers who still owe money; served by
+# email_retries_due_idx. SKIP LOCKED hands overlapping retry passes disjoint
+# rows, and moving next_attempt_at forward keeps a claimed retry from being
+# due again while it is being sent. The outcome's save() overwrites it; if
+# the pass dies first, the retry comes due again after the claim.
+DUE_RETRIES_SQL = """
+    WITH due AS (
+        SELECT r.customer_id, r.next_attempt_at
+        FROM email_retries r
+        JOIN customers c ON c.id = r.customer_id
+        WHERE r.status = 'PENDING'
+          AND r.next_attempt_at <= CURRENT_TIMESTAMP
+          AND c.payment_status = 'UNPAID'
+        ORDER BY r.next_attempt_at
+        FOR UPDATE OF r SKIP LOCKED
+    ), claimed AS (
+        UPDATE email_retries r
+        SET next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %(claim)s)
+        FROM due
+        WHERE r.customer_id = due.customer_id
+        RETURNING r.customer_id
+    )
+    SELECT c.id, c.name, c.email, c.amount, c.due_date, c.payment_status
+    FROM due
+    JOIN claimed ON claimed.customer_id = due.customer_id
+    JOIN customers c ON c.id = due.customer_id
+    ORDER BY due.next_attempt_at
+"""
+
+
+def backoff_delay(attempts, base=RETRY_BASE, cap=RETRY_MAX):
+    """Exponential backoff with jitter: half the delay is fixed, half random.
+
+    The random half spreads retries of a throttled batch out, instead of
+    sending them all back to the provider in the same second.
+    """
+    delay = min(cap, base * (2 ** attempts))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def fetch_due(conn, claim_seconds=RETRY_CLAIM_SECONDS):
+    """Claim the customers whose retry is due, oldest first; settled loans are dropped"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            DELETE FROM email_retries r
+            USING customers c
+            WHERE c.id = r.customer_id AND c.payment_status <> 'UNPAID'
+        """)
+        cur.execute(DUE_RETRIES_SQL, {"claim": claim_seconds})
+        rows = cur.fetchall()
+    conn.commit()
+    return rows
+
+
+class RetryRecorder:
+    """Collects send outcomes and persists them to `email_retries`.
+
+    `save(cur)` runs inside the email log writer's transaction (see
+    `EmailLogWriter.on_flush`), so a failure is queued for retry exactly when
+    its FAILED log row is written. Outcomes are kept until `committed()`, so
+    a transaction that rolls back can save them again. A success clears the customer's row.
+    Transient failures are rescheduled with `backoff_delay` until
+    `max_attempts`, then marked FAILED. Permanent ones (a 5xx to RCPT or DATA,
+    such as a bad address) are marked PERMANENT and never retried automatically.
+    """
+
+    def __init__(self, max_attempts=RETRY_MAX_ATTEMPTS, base=RETRY_BASE, cap=RETRY_MAX):
+        self.max_attempts = max_attempts
+        self.base = base
+        self.cap = cap
+        self._succeeded = []
+        self._failed = []
+        self._saved = (0, 0, {})
+
+        self.queued = 0
+        self.permanent = 0
+        self.gave_up = 0
+
+    def record(self, customer_id, success, error=None, failure=None):
+        """`failure` is `smtp_session.classify_failure()` of the send's exception"""
+        if success:
+            self._succeeded.append(customer_id)
+        else:
+            self._failed.append((customer_id, error, failure))
+
+    def save(self, cur):
+        succeeded = self._succeeded[:]
+        failed = self._failed[:]
+        counts = {"queued": 0, "permanent": 0, "gave_up": 0}
+        self._saved = (len(succeeded), len(failed), counts)
+        if succeeded:
+            cur.execute("DELETE FROM email_retries WHERE customer_id = ANY(%s)", (succeeded,))
+        if not failed:
+            return
+
+        cur.execute("""
+            SELECT customer_id, attempts FROM email_retries
+            WHERE customer_id = ANY(%s) AND status = 'PENDING'
+        """, ([customer_id for customer_id, _, _ in failed],))
+        attempts_so_far = dict(cur.fetchall())
+
+        rows = {}
+        for customer_id, error, failure in failed:
+            attempts = attempts_so_far.get(customer_id, 0) + 1
+            delay = None
+            if failure == "permanent":
+                status = "PERMANENT"
+                counts["permanent"] += 1
+            elif attempts >= self.max_attempts:
+                status = "FAILED"
+                counts["gave_up"] += 1
+            else:
+                status = "PENDING"
+                delay = backoff_delay(attempts - 1, self.base, self.cap)
+                counts["queued"] += 1
+            # One row per customer; a later outcome in the same batch wins
+            rows[customer_id] = (customer_id, status, attempts, delay, error, failure)
+
+        execute_values(cur, """
+            INSERT INTO email_retries AS r
+                (customer_id, status, attempts, next_attempt_at, last_error, failure)
+            SELECT v.customer_id, v.status, v.attempts,
+                   CURRENT_TIMESTAMP + make_interval(secs => v.delay), v.last_error, v.failure
+            FROM (VALUES %s) AS v (customer_id, status, attempts, delay, last_error, failure)
+            ON CONFLICT (customer_id) DO UPDATE
+            SET status = EXCLUDED.status, attempts = EXCLUDED.attempts,
+                next_attempt_at = EXCLUDED.next_attempt_at, last_error = EXCLUDED.last_error,
+                failure = EXCLUDED.failure, updated_at = CURRENT_TIMESTAMP
+        """, list(rows.values()), template="(%s, %s, %s, %s::float8, %s, %s)")
+
+    def committed(self):
+        """Forget the outcomes written by the last `save()`, now that they are committed"""
+        succeeded, failed, counts = self._saved
+        del self._succeeded[:succeeded]
+        del self._failed[:failed]
+        self.queued += counts["queued"]
+        self.permanent += counts["permanent"]
+        self.gave_up += counts["gave_up"]
+        self._saved = (0, 0, {"queued": 0, "permanent": 0, "gave_up": 0})
+
+    def stats(self):
+        return {
+            "queued": self.queued,
+            "permanent": self.permanent,
+            "gave_up": self.gave_up,
+        }
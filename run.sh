@@ -1,8 +1,14 @@
 #!/bin/bash
 
-# 1. Start the email reminder script in the background
+# 1. Apply pending schema migrations (tables and indexes)
+python migrations.py upgrade
+
+# 2. Start the email reminder script in the background
 python send_reminders.py &
 
-# 2. Start the web server and bind it to port 8000
+# 3. Start the outbox worker that delivers payment confirmation emails
+python outbox.py &
+
+# 4. Start the web server and bind it to port 8000
 # (This ensures Koyeb's health check passes)
 gunicorn app:app --bind 0.0.0.0:8000
\ No newline at end of file
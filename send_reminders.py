@@ -1,10 +1,28 @@
 import os
-import smtplib
+import sys
+import json
+import time
+import socket
+import signal
+import argparse
 import psycopg2
+from collections import namedtuple
+from itertools import groupby
+from functools import partial
 from email.message import EmailMessage
 from email.utils import formataddr
-from datetime import datetime, date
+from datetime import date
 from dotenv import load_dotenv
+from smtp_session import classify_failure, open_session
+from delivery import ParallelDelivery
+from email_log_writer import EmailLogWriter
+from template_registry import ReminderRenderer, DigestRenderer
+from mime_builder import BulkMessageBuilder
+from metrics import timed, STAGE_SECONDS
+import reminder_runs
+import retry_queue
+import send_window
+import spool
 
 # Load environment variables
 load_dotenv()
@@ -17,232 +35,637 @@ BASE_URL = os.getenv("BASE_URL", "http://localhost:5000")  # Change for producti
 if not all([DATABASE_URL, SENDER_EMAIL, PASSWORD]):
     raise ValueError("Missing environment variables. Check .env file")
 
-SMTP_SERVER = "smtp.gmail.com"
-PORT = 587
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", 1))
+SEND_RATE = float(os.getenv("SEND_RATE", 0))  # messages/sec across all workers, 0 = unlimited
+FETCH_ITERSIZE = int(os.getenv("FETCH_ITERSIZE", 1000))  # rows per server-side cursor round trip
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", 500))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", 5))  # seconds
+# Scheduled mode: daily UTC window ('09:00-17:00') the run is spread across
+SEND_WINDOW = os.getenv("SEND_WINDOW")
+SEND_SLICE_MINUTES = float(os.getenv("SEND_SLICE_MINUTES", 15))
+# Skip customers already emailed within this many hours, per urgency tier
+URGENT_COOLDOWN_HOURS = float(os.getenv("URGENT_COOLDOWN_HOURS", 20))
+REMINDER_COOLDOWN_HOURS = float(os.getenv("REMINDER_COOLDOWN_HOURS", 20))
+# Distributed mode: customers claimed per round trip and how long a claim is held
+CLAIM_BATCH_SIZE = int(os.getenv("CLAIM_BATCH_SIZE", 100))
+CLAIM_LEASE_SECONDS = int(os.getenv("CLAIM_LEASE_SECONDS", 600))
+
+# Shared by all delivery workers: headers and template lines are encoded once per run
+message_builder = BulkMessageBuilder(formataddr(("Loan Department", SENDER_EMAIL)))
+
+# Compact row object yielded by the customer stream (a plain tuple underneath)
+Customer = namedtuple("Customer", "id name email amount due_date payment_status")
+
+# Excludes anyone already emailed inside their tier's cool-down window
+# (URGENT = due within 2 days, overdue or undated). Served by
+# email_logs_customer_sent_idx (see migrations.py).
+COOLDOWN_FILTER = """
+      AND NOT EXISTS (
+          SELECT 1 FROM email_logs l
+          WHERE l.customer_id = c.id
+            AND l.status = 'SENT'
+            AND l.sent_at > LOCALTIMESTAMP - make_interval(secs => CASE
+                WHEN c.due_date IS NULL OR c.due_date <= CURRENT_DATE + 2
+                THEN %(urgent_cooldown)s ELSE %(reminder_cooldown)s END)
+      )"""
+
+# Addresses that bounced permanently (a 5xx to RCPT or DATA, see
+# smtp_session.classify_failure) are not tried again until their
+# email_retries row is cleared, and a queued (PENDING) retry is left to the
+# retry pass so its backoff holds. A primary key lookup.
+RETRY_FILTER = """
+      AND NOT EXISTS (
+          SELECT 1 FROM email_retries er
+          WHERE er.customer_id = c.id AND er.status IN ('PERMANENT', 'PENDING')
+      )"""
+
+# Unpaid customers, including those with past due dates. Served by
+# customers_unpaid_urgent_first_idx; {after} holds the keyset and ledger predicates
+# of a resumed run.
+UNPAID_CUSTOMERS_SQL = """
+    SELECT c.id, c.name, c.email, c.amount, c.due_date, c.payment_status
+    FROM customers c
+    WHERE c.payment_status = 'UNPAID'
+      {after}""" + COOLDOWN_FILTER + RETRY_FILTER + """
+    ORDER BY {order}
+"""
+# Most urgent first: undated loans (URGENT, like overdue ones, in the
+# cool-down and the reminder wording), then by due date. The (due_date, id)
+# watermark of a resumed run follows the same order.
+DUE_DATE_ORDER = "c.due_date ASC NULLS FIRST, c.id ASC"
+# Digest mode: every address's loans arrive together, earliest due first.
+# Served by customers_unpaid_email_idx; must match normalize_email().
+RECIPIENT_ORDER = "lower(btrim(c.email)), c.due_date ASC NULLS LAST, c.id ASC"
+
+# Distributed mode: claim the next batch of due customers for this worker.
+# SKIP LOCKED hands concurrent workers disjoint batches; the ON CONFLICT guard
+# only takes over a claim whose lease has expired and which was never finished,
+# so a customer is never held by two live workers. The first column is the
+# number of candidates seen: a batch can come back empty because another
+# worker committed those claims first, which is not the same as no work left.
+CLAIM_CUSTOMERS_SQL = """
+    WITH candidates AS (
+        SELECT c.id
+        FROM customers c
+        WHERE c.payment_status = 'UNPAID'
+          AND NOT EXISTS (
+              SELECT 1 FROM reminder_claims rc
+              WHERE rc.run_date = %(run_date)s
+                AND rc.customer_id = c.id
+                AND (rc.done_at IS NOT NULL OR rc.lease_expires_at > LOCALTIMESTAMP)
+          )""" + COOLDOWN_FILTER + RETRY_FILTER + """
+        ORDER BY c.due_date ASC NULLS FIRST, c.id ASC
+        LIMIT %(limit)s
+        FOR NO KEY UPDATE OF c SKIP LOCKED
+    ), claimed AS (
+        INSERT INTO reminder_claims (run_date, customer_id, worker_id, lease_expires_at)
+        SELECT %(run_date)s, id, %(worker_id)s, LOCALTIMESTAMP + make_interval(secs => %(lease)s)
+        FROM candidates
+        ON CONFLICT (run_date, customer_id) DO UPDATE
+        SET worker_id = EXCLUDED.worker_id,
+            lease_expires_at = EXCLUDED.lease_expires_at,
+            claimed_at = LOCALTIMESTAMP
+        WHERE reminder_claims.done_at IS NULL
+          AND reminder_claims.lease_expires_at <= LOCALTIMESTAMP
+        RETURNING customer_id
+    )
+    SELECT n.candidates, c.id, c.name, c.email, c.amount, c.due_date, c.payment_status
+    FROM (SELECT count(*) AS candidates FROM candidates) n
+    LEFT JOIN (customers c JOIN claimed ON claimed.customer_id = c.id) ON true
+    ORDER BY c.due_date ASC NULLS FIRST, c.id ASC
+"""
+
+def cooldown_params(urgent_cooldown_hours=URGENT_COOLDOWN_HOURS,
+                    reminder_cooldown_hours=REMINDER_COOLDOWN_HOURS):
+    return {
+        "urgent_cooldown": urgent_cooldown_hours * 3600,
+        "reminder_cooldown": reminder_cooldown_hours * 3600,
+    }
+
+def unpaid_customers_query(after=None, run_id=None, urgent_cooldown_hours=URGENT_COOLDOWN_HOURS,
+                           reminder_cooldown_hours=REMINDER_COOLDOWN_HOURS, digest=False, limit=None):
+    """Build the reminder query, optionally resuming a run.
+
+    `after` skips everything up to a `(due_date, id)` watermark; `run_id`
+    also skips customers that run already logged past the watermark.
+    `digest` orders the rows by recipient address instead of by due date;
+    `limit` caps the rows returned.
+    """
+    params = cooldown_params(urgent_cooldown_hours, reminder_cooldown_hours)
+    predicate = ""
+    if after is not None:
+        after_due, after_id = after
+        params["after_id"] = after_id
+        if after_due is None:
+            # Undated loans sort first; later undated ones and every dated one remain
+            predicate = "AND (c.due_date IS NOT NULL OR c.id > %(after_id)s)"
+        else:
+            # Past the undated ones; the row comparison is never true for a NULL due_date
+            params["after_due"] = after_due
+            predicate = "AND (c.due_date, c.id) > (%(after_due)s, %(after_id)s)"
+    if run_id is not None:
+        # Served by email_logs_run_customer_idx
+        params["run_id"] = run_id
+        predicate += """
+      AND NOT EXISTS (
+          SELECT 1 FROM email_logs r WHERE r.run_id = %(run_id)s AND r.customer_id = c.id
+      )"""
+    order = RECIPIENT_ORDER if digest else DUE_DATE_ORDER
+    sql = UNPAID_CUSTOMERS_SQL.format(after=predicate, order=order)
+    if limit is not None:
+        params["limit"] = limit
+        sql += "    LIMIT %(limit)s\n"
+    return sql, params
 
 def get_connection():
-    return psycopg2.connect(DATABASE_URL)
+    with timed("db_connect"):
+        return psycopg2.connect(DATABASE_URL)
+
+def fetch_unpaid_customers(itersize=FETCH_ITERSIZE, after=None, run_id=None, digest=False):
+    """Stream customers with unpaid dues (including overdue).
 
-def fetch_unpaid_customers():
-    """Fetch customers with unpaid dues (including overdue)"""
+    Uses a named (server-side) cursor so rows arrive `itersize` at a time and
+    sending can start after the first batch, with memory flat in the table size.
+    `after`, `run_id` and `digest` are passed to `unpaid_customers_query`.
+    """
     conn = get_connection()
-    cur = conn.cursor()
+    cur = conn.cursor(name="unpaid_customers")
+    cur.itersize = itersize
     
-    # Fetch unpaid customers, including those with past due dates
-    cur.execute("""
-        SELECT id, name, email, amount, due_date, payment_status
-        FROM customers
-        WHERE payment_status = 'UNPAID'
-        ORDER BY due_date ASC
-    """)
-    
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    return rows
+    try:
+        with timed("db_query"):
+            cur.execute(*unpaid_customers_query(after, run_id, digest=digest))
+        
+        while True:
+            with timed("db_query"):
+                rows = cur.fetchmany(itersize)
+            if not rows:
+                break
+            for row in rows:
+                yield Customer._make(row)
+    finally:
+        cur.close()
+        conn.close()
+
+def count_unpaid_customers(conn, after=None, run_id=None):
+    """How many customers the reminder query would still return"""
+    sql, params = unpaid_customers_query(after, run_id)
+    with timed("db_query"):
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT count(*) FROM ({sql}) due", params)
+            count = cur.fetchone()[0]
+        conn.commit()
+    return count
+
+def fetch_customer_slice(conn, after=None, run_id=None, limit=CLAIM_BATCH_SIZE):
+    """The next `limit` due customers past `after`, in reminder order"""
+    with timed("db_query"):
+        with conn.cursor() as cur:
+            cur.execute(*unpaid_customers_query(after, run_id, limit=limit))
+            rows = cur.fetchall()
+        conn.commit()
+    return [Customer._make(row) for row in rows]
+
+def stream_scheduled_customers(scheduler, after=None, run_id=None):
+    """Customers slice by slice, paced over the send window by `scheduler`"""
+    conn = get_connection()
+    try:
+        yield from scheduler.stream(
+            lambda position: count_unpaid_customers(conn, position, run_id),
+            lambda position, limit: fetch_customer_slice(conn, position, run_id, limit),
+            after,
+        )
+    finally:
+        conn.close()
+
+def normalize_email(email):
+    """Key grouping loans by recipient; matches lower(btrim(email)) in RECIPIENT_ORDER"""
+    return email.strip().lower()
+
+def group_by_recipient(customers):
+    """Turn a stream in RECIPIENT_ORDER into one list of loans per address.
+
+    Only the current address's loans are held in memory.
+    """
+    for _, loans in groupby(customers, key=lambda customer: normalize_email(customer.email)):
+        yield list(loans)
+
+def fetch_due_retries():
+    """Claim the customers whose queued retry is due (see retry_queue.py)"""
+    conn = get_connection()
+    try:
+        with timed("db_query"):
+            rows = retry_queue.fetch_due(conn)
+    finally:
+        conn.close()
+    return [Customer._make(row) for row in rows]
+
+def claim_customers(conn, run_date, worker_id, limit=CLAIM_BATCH_SIZE, lease_seconds=CLAIM_LEASE_SECONDS):
+    """Claim up to `limit` due customers for this worker; one round trip.
+
+    Returns `(customers, candidates)`.
+    """
+    params = cooldown_params()
+    params.update(run_date=run_date, worker_id=worker_id, limit=limit, lease=lease_seconds)
+    with timed("db_query"):
+        with conn.cursor() as cur:
+            cur.execute(CLAIM_CUSTOMERS_SQL, params)
+            rows = cur.fetchall()
+        conn.commit()
+    candidates = rows[0][0]
+    return [Customer._make(row[1:]) for row in rows if row[1] is not None], candidates
+
+def stream_claimed_customers(run_date, worker_id, batch_size=CLAIM_BATCH_SIZE,
+                             lease_seconds=CLAIM_LEASE_SECONDS):
+    """Keep claiming batches until no unclaimed due customers are left"""
+    conn = get_connection()
+    try:
+        while True:
+            batch, candidates = claim_customers(conn, run_date, worker_id, batch_size, lease_seconds)
+            if not candidates:
+                return
+            # An empty batch with candidates lost a race; the next statement
+            # sees those claims and moves on to unclaimed customers
+            yield from batch
+    finally:
+        conn.close()
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
 
 def generate_payment_link(loan_id):
     """Generate payment link with base URL"""
     return f"{BASE_URL}/pay/{loan_id}"
 
-def send_reminder_email(name, receiver_email, loan_id, due_date, amount, payment_link):
-    """Send reminder email to customer"""
-    msg = EmailMessage()
-    msg["Subject"] = f"Payment Reminder: ₹{amount:.2f} due on {due_date}"
-    msg["From"] = formataddr(("Loan Department", SENDER_EMAIL))
-    msg["To"] = receiver_email
-    
-    # Determine urgency
-    days_until_due = (due_date - date.today()).days if due_date else 0
-    urgency = "URGENT" if days_until_due <= 2 else "REMINDER"
-    
-    html_content = f"""
-    <html>
-    <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-        <div style="max-width: 600px; margin: 0 auto; padding: 20px; border: 1px solid #ddd; border-radius: 10px;">
-            <div style="text-align: center; margin-bottom: 30px;">
-                <h2 style="color: #ff6b35;">{urgency}: Payment Due</h2>
-                <div style="background: {'#ffebee' if urgency == 'URGENT' else '#fff3e0'}; 
-                    padding: 15px; border-radius: 8px; margin: 15px 0;">
-                    <p style="margin: 0; font-weight: bold;">
-                        {'⚠️ Action Required: Payment is due soon!' if urgency == 'URGENT' else '📅 Friendly Reminder'}
-                    </p>
-                </div>
-            </div>
-            
-            <p>Dear <strong>{name}</strong>,</p>
-            
-            <p>This is a reminder regarding your outstanding loan payment.</p>
-            
-            <div style="background: #f8f9fa; padding: 20px; border-radius: 8px; margin: 20px 0;">
-                <h3 style="margin-top: 0;">Payment Details:</h3>
-                <table style="width: 100%;">
-                    <tr>
-                        <td style="padding: 8px 0;">Loan ID:</td>
-                        <td style="padding: 8px 0;"><strong>{loan_id}</strong></td>
-                    </tr>
-                    <tr>
-                        <td style="padding: 8px 0;">Amount Due:</td>
-                        <td style="padding: 8px 0;"><strong style="color: #dc3545; font-size: 1.2em;">₹{amount:.2f}</strong></td>
-                    </tr>
-                    <tr>
-                        <td style="padding: 8px 0;">Due Date:</td>
-                        <td style="padding: 8px 0;">
-                            <strong>{due_date.strftime('%d %B, %Y') if due_date else 'Not specified'}</strong>
-                            {' <span style="color: #dc3545;">(Overdue)</span>' if due_date and due_date < date.today() else ''}
-                        </td>
-                    </tr>
-                    <tr>
-                        <td style="padding: 8px 0;">Days Remaining:</td>
-                        <td style="padding: 8px 0;">
-                            {f"<strong>{days_until_due}</strong> day(s)" if due_date and days_until_due > 0 else "<strong style='color: #dc3545;'>Overdue</strong>"}
-                        </td>
-                    </tr>
-                </table>
-            </div>
-            
-            <p>Please click the button below to complete your payment:</p>
-            
-            <div style="text-align: center; margin: 30px 0;">
-                <a href="{payment_link}" 
-                   style="background: linear-gradient(to right, #28a745, #20c997); 
-                          color: white; 
-                          padding: 15px 30px; 
-                          text-decoration: none; 
-                          border-radius: 50px; 
-                          font-weight: bold;
-                          display: inline-block;">
-                    🚀 Pay Now
-                </a>
-            </div>
-            
-            <p style="font-size: 0.9em; color: #666;">
-                If the button doesn't work, copy and paste this link in your browser:<br>
-                <code style="background: #f5f5f5; padding: 5px 10px; border-radius: 3px; word-break: break-all;">
-                    {payment_link}
-                </code>
-            </p>
-            
-            <p>For any queries, please contact our support team.</p>
-            
-            <div style="margin-top: 30px; padding-top: 20px; border-top: 1px solid #ddd;">
-                <p>Best regards,<br>
-                <strong>Loan Department</strong></p>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
-    
-    # Plain text version
-    text_content = f"""
-{urgency}: PAYMENT REMINDER
+def open_smtp_session():
+    """Create the SMTP session shared by every reminder in a run"""
+    return open_session(SENDER_EMAIL, PASSWORD)
 
-Dear {name},
+def build_reminder_message(name, receiver_email, loan_id, due_date, amount, payment_link, renderer=None):
+    """Render the reminder and assemble the complete MIME message.
 
-This is a reminder regarding your outstanding loan payment of ₹{amount:.2f}.
+    Returns wire-ready bytes from the bulk builder, or an EmailMessage for the
+    rare recipient address the fast path does not cover.
+    """
+    renderer = renderer or ReminderRenderer()
+    subject, text_content, html_content = renderer.render(name, loan_id, due_date, amount, payment_link)
+    return assemble_message(subject, receiver_email, text_content, html_content)
 
-Loan Details:
-- Loan ID: {loan_id}
-- Amount Due: ₹{amount:.2f}
-- Due Date: {due_date.strftime('%d %B, %Y') if due_date else 'Not specified'}
-- Status: {'OVERDUE' if due_date and due_date < date.today() else 'PENDING'}
+def assemble_message(subject, receiver_email, text_content, html_content):
+    """Wire bytes from the bulk builder, or an EmailMessage when it declines"""
+    with timed("mime_build"):
+        data = message_builder.build(subject, receiver_email, text_content, html_content)
+        if data is not None:
+            return data
+        msg = EmailMessage()
+        msg["Subject"] = subject
+        msg["From"] = formataddr(("Loan Department", SENDER_EMAIL))
+        msg["To"] = receiver_email
+        
+        msg.set_content(text_content)
+        msg.add_alternative(html_content, subtype='html')
+    return msg
 
-Please use the following link to complete your payment:
-{payment_link}
+def send_reminder_email(session, name, receiver_email, loan_id, due_date, amount, payment_link, renderer=None):
+    """Send reminder email to customer over an open SMTP session.
 
-For any queries, please contact our support team.
+    Returns `(success, error, failure)`; `failure` classifies an error as
+    'throttled', 'transient' or 'permanent'.
+    """
+    msg = build_reminder_message(name, receiver_email, loan_id, due_date, amount, payment_link, renderer)
+    return deliver_message(session, receiver_email, msg)
 
-Best regards,
-Loan Department
-"""
-    
-    msg.set_content(text_content)
-    msg.add_alternative(html_content, subtype='html')
-    
+def deliver_message(session, receiver_email, msg):
+    """Send an assembled message; returns `(success, error, failure)`"""
     try:
-        with smtplib.SMTP(SMTP_SERVER, PORT) as server:
-            server.starttls()
-            server.login(SENDER_EMAIL, PASSWORD)
-            server.send_message(msg)
-        return True
+        if isinstance(msg, bytes):
+            session.sendmail(SENDER_EMAIL, [receiver_email], msg)
+        else:
+            session.send(msg)
+        return True, None, None
     except Exception as e:
         print(f"❌ Failed to send email to {receiver_email}: {e}")
-        return False
+        return False, str(e), classify_failure(e)
 
-def log_email(customer_id):
-    """Log email sent to customer"""
-    conn = get_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("""
-            INSERT INTO email_logs (customer_id, sent_at, status)
-            VALUES (%s, %s, %s)
-        """, (customer_id, datetime.now(), "SENT"))
-        conn.commit()
-    except Exception as e:
-        print(f"⚠️ Failed to log email for ID {customer_id}: {e}")
-    finally:
-        cur.close()
-        conn.close()
+def send_to_customer(session, customer, renderer=None):
+    """Build the payment link and send one reminder (runs on a delivery worker).
+
+    Returns `(success, error, failure)`.
+    """
+    customer_id, name, email, amount, due_date, status = customer
+    return send_reminder_email(
+        session,
+        name=name,
+        receiver_email=email,
+        loan_id=customer_id,
+        due_date=due_date,
+        amount=amount,
+        payment_link=generate_payment_link(customer_id),
+        renderer=renderer
+    )
+
+def send_digest(session, loans, renderer=None, digest_renderer=None):
+    """Send one reminder covering every loan in `loans` (all for one address).
+
+    A single loan gets the regular reminder. Returns `(success, error, failure)`
+    for the whole group.
+    """
+    if len(loans) == 1:
+        return send_to_customer(session, loans[0], renderer)
+    digest_renderer = digest_renderer or DigestRenderer(renderer)
+    first = loans[0]
+    subject, text_content, html_content = digest_renderer.render(first.name, [
+        (loan.id, loan.due_date, loan.amount, generate_payment_link(loan.id)) for loan in loans
+    ])
+    msg = assemble_message(subject, first.email, text_content, html_content)
+    return deliver_message(session, first.email, msg)
+
+def spool_reminders(spool_dir, spool_format="maildir"):
+    """Phase one of an offline run: render every due reminder into a spool.
+
+    Nothing is sent and nothing is logged; `python spool.py deliver` sends
+    the spool later, and `python spool.py preview` shows what it holds.
+    Customers the spool already holds are skipped. Returns
+    `(spooled, skipped)`.
+    """
+    renderer = ReminderRenderer()
+    with spool.SpoolWriter(spool_dir, spool_format) as writer:
+        for customer in fetch_unpaid_customers():
+            customer_id, name, email, amount, due_date, status = customer
+            if writer.contains(customer_id):
+                writer.skipped += 1
+                continue
+            msg = build_reminder_message(name, email, customer_id, due_date, amount,
+                                         generate_payment_link(customer_id), renderer)
+            writer.add(msg, customer_id, SENDER_EMAIL, email)
+    return writer.spooled, writer.skipped
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Send payment reminder emails")
+    parser.add_argument("--workers", type=int, default=SEND_WORKERS,
+                        help="number of concurrent SMTP workers, each with its own connection")
+    parser.add_argument("--rate", type=float, default=SEND_RATE,
+                        help="global cap on messages per second (0 = unlimited)")
+    parser.add_argument("--restart", action="store_true",
+                        help="start a new run from the top instead of continuing today's unfinished one")
+    parser.add_argument("--resume", type=int, default=None, metavar="RUN_ID",
+                        help="continue the given run from its last saved position")
+    parser.add_argument("--distributed", action="store_true",
+                        help="claim batches with SKIP LOCKED so any number of processes can share the run")
+    parser.add_argument("--claim-batch", type=int, default=CLAIM_BATCH_SIZE,
+                        help="customers claimed per round trip in distributed mode")
+    parser.add_argument("--lease-seconds", type=int, default=CLAIM_LEASE_SECONDS,
+                        help="how long a claim is held before another worker may take it over")
+    parser.add_argument("--worker-id", default=None,
+                        help="name recorded on claims (default: hostname-pid)")
+    parser.add_argument("--digest", action="store_true",
+                        help="send one reminder per recipient address, listing all of its due loans")
+    parser.add_argument("--retry-pass", action="store_true",
+                        help="only resend reminders whose queued retry is due (run it every few minutes)")
+    parser.add_argument("--window", default=SEND_WINDOW, metavar="HH:MM-HH:MM",
+                        help="spread the run evenly over this daily UTC window, most urgent first")
+    parser.add_argument("--slice-minutes", type=float, default=SEND_SLICE_MINUTES,
+                        help="how often --window re-plans the remaining sends")
+    parser.add_argument("--spool", default=None, metavar="DIR",
+                        help="render reminders into a spool directory instead of sending them")
+    parser.add_argument("--spool-format", choices=["maildir", "mbox"], default="maildir",
+                        help="message store used by --spool")
+    parser.add_argument("--summary-json", default=None, metavar="PATH",
+                        help="also write the run summary (counts and per-stage timings) to this file")
+    args = parser.parse_args(argv)
+    # Only the run ledger can be resumed or restarted; the other modes never read these flags
+    if (args.resume is not None or args.restart) and (args.distributed or args.retry_pass or args.spool):
+        parser.error("--resume and --restart cannot be combined with --distributed, --retry-pass or --spool")
+    if args.digest and (args.distributed or args.retry_pass or args.spool):
+        parser.error("--digest cannot be combined with --distributed, --retry-pass or --spool")
+    if args.window:
+        if args.digest or args.distributed or args.retry_pass or args.spool:
+            parser.error("--window cannot be combined with --digest, --distributed, --retry-pass or --spool")
+        try:
+            args.window = send_window.parse_window(args.window)
+        except ValueError as e:
+            parser.error(str(e))
+    return args
+
+def main(argv=None):
     """Main function to send reminder emails"""
+    args = parse_args(argv)
+    
+    # Turn SIGTERM (Actions timeout, container stop) into a normal exit so
+    # buffered email logs are flushed on the way out
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    
     print("=" * 50)
     print("📧 Starting Payment Reminder System")
     print("=" * 50)
     
-    customers = fetch_unpaid_customers()
+    started = time.perf_counter()
     
-    if not customers:
-        print("✅ No pending payments found. No emails sent.")
+    if args.spool:
+        spooled, skipped = spool_reminders(args.spool, args.spool_format)
+        print(f"📥 Spooled {spooled} reminder(s) to {args.spool} in {time.perf_counter() - started:.1f}s")
+        if skipped:
+            print(f"   Skipped {skipped} customer(s) already in the spool")
+        print(f"   Preview: python spool.py preview {args.spool}")
+        print(f"   Send:    python spool.py deliver {args.spool}")
         return
     
-    print(f"📊 Found {len(customers)} customers with pending payments")
+    scheduler = None
+    if args.window:
+        # Before the run is opened, so a run started ahead of the window is dated the day it sends
+        opens, closes = args.window.wait_until_open()
+        print(f"🕘 Send window {args.window}: sending until {closes:%H:%M} UTC")
+    
+    run_date = date.today()
+    run_id = None
+    progress = None
+    
+    if args.retry_pass:
+        # Failures from earlier runs, each rescheduled with its own backoff
+        customers = fetch_due_retries()
+        print(f"🔁 Retry pass: {len(customers)} reminder(s) due")
+    elif args.distributed:
+        # Any number of processes claim disjoint batches; finished claims are
+        # marked done with the log rows and expired ones are taken over
+        worker_id = args.worker_id or default_worker_id()
+        print(f"🌐 Distributed mode: worker {worker_id}, claiming {args.claim_batch} at a time")
+        progress = reminder_runs.ClaimTracker(run_date, worker_id, args.lease_seconds)
+        customers = stream_claimed_customers(run_date, worker_id, args.claim_batch, args.lease_seconds)
+    else:
+        # An unfinished run (today's, or the one named by --resume) continues
+        # from its watermark, skipping anyone it logged past that point
+        conn = get_connection()
+        try:
+            run_id, watermark, resumed = reminder_runs.start_run(
+                conn, run_date, resume=args.resume, restart=args.restart)
+        finally:
+            conn.close()
+        if not resumed:
+            print(f"🆕 Run {run_id}")
+        elif watermark:
+            print(f"⏩ Resuming run {run_id} after loan {watermark[1]} (due {watermark[0]})")
+        else:
+            print(f"⏩ Resuming run {run_id} from the top")
+        
+        # Rows stream in from the cursor while earlier ones are already being sent
+        progress = reminder_runs.WatermarkTracker(run_id, watermark)
+        if args.window:
+            # Paced slices; a restart re-spreads what is left over the time remaining
+            scheduler = send_window.WindowScheduler(closes, args.slice_minutes * 60, max_rate=args.rate)
+            customers = progress.wrap(stream_scheduled_customers(
+                scheduler, after=watermark, run_id=run_id if resumed else None))
+        elif args.digest:
+            # Address order has no due-date watermark: a resumed digest run
+            # skips only what the run has logged, and the watermark stays put
+            customers = group_by_recipient(fetch_unpaid_customers(
+                run_id=run_id if resumed else None, digest=True))
+        else:
+            customers = progress.wrap(fetch_unpaid_customers(after=watermark, run_id=run_id if resumed else None))
+    
+    print(f"⚙️  Workers: {args.workers}, rate limit: {args.rate or 'unlimited'} msg/s")
     print("-" * 50)
     
     success_count = 0
     fail_count = 0
+    total_count = 0
+    message_count = 0
     
-    for customer in customers:
-        customer_id, name, email, amount, due_date, status = customer
-        
-        # Check if due_date is a valid date
-        if due_date:
-            days_until_due = (due_date - date.today()).days
-            if days_until_due < 0:
-                print(f"⚠️  {name}: Payment is {abs(days_until_due)} day(s) overdue")
-        
-        payment_link = generate_payment_link(customer_id)
-        
-        print(f"📨 Processing: {name} ({email}) - ₹{amount:.2f}")
-        
-        success = send_reminder_email(
-            name=name,
-            receiver_email=email,
-            loan_id=customer_id,
-            due_date=due_date,
-            amount=amount,
-            payment_link=payment_link
-        )
-        
+    # Each worker keeps one authenticated connection for the whole run
+    delivery = ParallelDelivery(open_smtp_session, workers=args.workers, rate=args.rate)
+    if scheduler is not None:
+        scheduler.rate_control = delivery.rate_control
+    
+    # Templates are pre-rendered once per batch; workers only fill in customer fields
+    renderer = ReminderRenderer()
+    if args.digest:
+        send = partial(send_digest, renderer=renderer, digest_renderer=DigestRenderer(renderer))
+    else:
+        send = partial(send_to_customer, renderer=renderer)
+    
+    # Failed sends are queued for a later --retry-pass, or parked if permanent
+    retries = retry_queue.RetryRecorder()
+    
+    def save_progress(cur):
+        if progress is not None:
+            progress.save(cur)
+        retries.save(cur)
+    
+    def progress_committed():
+        if progress is not None:
+            progress.committed()
+        retries.committed()
+    
+    def record(job, result):
+        """Log a finished send and count it towards the summary and the run's progress"""
+        nonlocal success_count, fail_count, total_count, message_count
+        success, error, failure = result
+        message_count += 1
         if success:
-            log_email(customer_id)
-            success_count += 1
-            print(f"   ✅ Email sent successfully")
-        else:
-            fail_count += 1
-            print(f"   ❌ Failed to send email")
+            delivery.rate_control.succeeded()
+        elif failure == "throttled":
+            # The provider is pushing back: slow every worker down
+            delivery.rate_control.throttled()
         
-        print()  # Empty line for readability
+        # A digest covers several loans; each one is logged on its own
+        for customer in (job if args.digest else (job,)):
+            customer_id, name, email, amount, due_date, status = customer
+            total_count += 1
+            
+            # Check if due_date is a valid date
+            if due_date:
+                days_until_due = (due_date - date.today()).days
+                if days_until_due < 0:
+                    print(f"⚠️  {name}: Payment is {abs(days_until_due)} day(s) overdue")
+            
+            print(f"📨 Processed: {name} ({email}) - ₹{amount:.2f}")
+            
+            # Before the log row: a flush triggered by log() must commit the
+            # retry entry and the run's progress together with the row
+            retries.record(customer_id, success, error, failure)
+            if progress is not None:
+                progress.complete(customer_id, success)
+            if success:
+                log_writer.log(customer_id, "SENT")
+                success_count += 1
+                print(f"   ✅ Email sent successfully")
+            else:
+                log_writer.log(customer_id, "FAILED", error)
+                fail_count += 1
+                print(f"   ❌ Failed to send email ({failure})")
+            if scheduler is not None:
+                scheduler.complete()
+            
+            print()  # Empty line for readability
+    
+    # One log connection for the run; rows are written in batches and the
+    # remainder is flushed even if the run crashes. Run progress (watermark or
+    # claims) and the retry queue are saved in the same transaction as each
+    # batch of log rows.
+    try:
+        with EmailLogWriter(get_connection, batch_size=LOG_BATCH_SIZE,
+                            flush_interval=LOG_FLUSH_INTERVAL,
+                            on_flush=save_progress, on_commit=progress_committed,
+                            run_id=run_id) as log_writer:
+            results = delivery.run(customers, send)
+            try:
+                for job, result in results:
+                    record(job, result)
+            finally:
+                # Sends that were under way when the run stopped are logged
+                # and checkpointed too, so --resume does not repeat them
+                results.close()
+                for job, result in delivery.unreported:
+                    record(job, result)
+    except BaseException:
+        if run_id is not None:
+            print(f"💾 Progress saved; continue with: python send_reminders.py --resume {run_id}")
+        raise
+    
+    if scheduler is not None and scheduler.left_over:
+        # Closed all the same: unfinished runs are only resumed on their own
+        # date, so the next window starts a new run from the top
+        print(f"⏸️  Run {run_id} stopped at the end of the window; "
+              f"{scheduler.left_over} reminder(s) left for the next one")
+    if run_id is not None:
+        conn = get_connection()
+        try:
+            reminder_runs.finish_run(conn, run_id)
+        finally:
+            conn.close()
+    
+    elapsed = time.perf_counter() - started
+    # Per-stage timings show whether the run is bound by SMTP or by Postgres
+    stages = STAGE_SECONDS.summary()
+    summary = {
+        "run_id": run_id,
+        "sent": success_count,
+        "failed": fail_count,
+        "total": total_count,
+        "messages": message_count,
+        "elapsed_s": round(elapsed, 3),
+        "messages_per_sec": round(total_count / elapsed, 1) if elapsed else None,
+        "slowest_stage": max(stages, key=lambda stage: stages[stage]["total_s"]) if stages else None,
+        "stages": stages,
+        "smtp": delivery.stats(),
+        "email_logs": log_writer.stats(),
+        "retries": retries.stats(),
+        "mime": message_builder.stats(),
+    }
+    if scheduler is not None:
+        summary["window"] = scheduler.stats()
+    if args.summary_json:
+        with open(args.summary_json, "w") as f:
+            json.dump(summary, f, indent=2)
+    
+    if total_count == 0:
+        print("✅ No pending payments found (or all contacted within the cool-down). No emails sent.")
+        return
     
     print("=" * 50)
     print("📊 SUMMARY")
     print("=" * 50)
-    print(f"✅ Successfully sent: {success_count}")
-    print(f"❌ Failed: {fail_count}")
-    print(f"📊 Total processed: {len(customers)}")
+    print(json.dumps(summary, indent=2))
     print("=" * 50)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
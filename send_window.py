@@ -0,0 +1,130 @@
+import math
+import time
+from collections import deque
+from datetime import datetime, time as dt_time, timedelta, timezone
+
+
+def parse_window(value):
+    """Parse 'HH:MM-HH:MM' (UTC) into a SendWindow; an end before the start crosses midnight"""
+    try:
+        start, end = (dt_time.fromisoformat(part.strip()) for part in value.split("-"))
+    except ValueError:
+        raise ValueError(f"Send window must look like 09:00-17:00, got {value!r}")
+    return SendWindow(start, end)
+
+
+class SendWindow:
+    """A daily UTC time range in which reminders may be sent"""
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        length = (datetime.combine(datetime.min, end) - datetime.combine(datetime.min, start)).total_seconds()
+        self.length = timedelta(seconds=length % 86400 or 86400)
+
+    def bounds(self, now=None):
+        """`(opens, closes)` of the window open at `now`, or of the next one"""
+        now = now or datetime.now(timezone.utc)
+        for days in (-1, 0, 1):
+            opens = datetime.combine(now.date() + timedelta(days=days), self.start, tzinfo=timezone.utc)
+            if now < opens + self.length:
+                return opens, opens + self.length
+
+    def wait_until_open(self):
+        """Sleep until the window opens; returns its `(opens, closes)`"""
+        opens, closes = self.bounds()
+        delay = (opens - datetime.now(timezone.utc)).total_seconds()
+        if delay > 0:
+            print(f"🕘 Send window opens at {opens:%Y-%m-%d %H:%M} UTC; waiting {delay / 3600:.1f}h")
+            time.sleep(delay)
+        return opens, closes
+
+    def __str__(self):
+        return f"{self.start:%H:%M}-{self.end:%H:%M} UTC"
+
+
+class WindowScheduler:
+    """Spreads a run's due customers evenly over the rest of a send window.
+
+    Every `slice_seconds` the customers still due are counted and the send
+    rate is set so that they, plus those already handed to the senders, are
+    spread evenly over the time left, never above `max_rate`. Each slice
+    fetches its share, most urgent first in the reminder query's order,
+    after the last position handed out, so a customer whose cool-down ends
+    once the run has passed their position waits for the next run. A restart
+    recounts what is left and re-spreads it over the remaining time, so it
+    never bursts. Customers still due when the window closes are counted in
+    `left_over` and left for the next window's run. Report each finished
+    send with `complete()`.
+    """
+
+    def __init__(self, closes, slice_seconds, max_rate=0, rate_control=None):
+        self.closes = closes
+        self.slice_seconds = slice_seconds
+        self.max_rate = max_rate
+        self.rate_control = rate_control
+
+        self.slices = 0
+        self.scheduled = 0
+        self.completed = 0
+        self.rate = None
+        self.left_over = 0
+        self._warned = False
+
+    def complete(self):
+        self.completed += 1
+
+    def _plan_slice(self, remaining, now):
+        """Set the rate for the next slice and return how many customers it covers"""
+        to_send = remaining + self.scheduled - self.completed
+        seconds_left = max((self.closes - now).total_seconds(), 1.0)
+        rate = to_send / seconds_left
+        if self.max_rate and rate > self.max_rate:
+            rate = self.max_rate
+            if not self._warned:
+                self._warned = True
+                print(f"⚠️  {to_send} due at {self.max_rate} msg/s will not fit in the "
+                      f"{seconds_left / 3600:.1f}h left; the rest waits for the next window")
+        self.rate = rate
+        if self.rate_control is not None:
+            self.rate_control.set_ceiling(rate)
+        self.slices += 1
+        share = min(remaining, math.ceil(rate * min(self.slice_seconds, seconds_left)))
+        print(f"🕒 Slice {self.slices}: {share} of {remaining} due at {rate:.3f} msg/s")
+        return max(1, share)
+
+    def stream(self, count_remaining, fetch_slice, after=None):
+        """Yield customers slice by slice until none are due or the window closes.
+
+        `count_remaining(after)` counts the customers due past a `(due_date, id)`
+        position and `fetch_slice(after, limit)` returns the next `limit` of them.
+        """
+        batch = deque()
+        next_slice = None
+        while True:
+            now = datetime.now(timezone.utc)
+            if now >= self.closes:
+                self.left_over = count_remaining(after)
+                if self.left_over:
+                    print(f"🕔 Send window closed with {self.left_over} reminder(s) still due")
+                return
+            if next_slice is None or now >= next_slice or not batch:
+                remaining = count_remaining(after)
+                if not remaining:
+                    return
+                batch = deque(fetch_slice(after, self._plan_slice(remaining, now)))
+                next_slice = now + timedelta(seconds=self.slice_seconds)
+                if not batch:
+                    return
+            customer = batch.popleft()
+            self.scheduled += 1
+            yield customer
+            after = (customer.due_date, customer.id)
+
+    def stats(self):
+        return {
+            "slices": self.slices,
+            "scheduled": self.scheduled,
+            "rate": round(self.rate, 3) if self.rate else None,
+            "left_over": self.left_over,
+        }
@@ -0,0 +1,221 @@
+import os
+import smtplib
+import time
+from dotenv import load_dotenv
+from metrics import timed
+
+# Load environment variables
+load_dotenv()
+
+# Gmail drops the connection after roughly 100 messages, so recycle before that
+DEFAULT_MAX_MESSAGES_PER_CONNECTION = 90
+DEFAULT_KEEPALIVE_INTERVAL = 30  # seconds idle before a NOOP probe
+DEFAULT_TIMEOUT = 30
+
+# Relay settings shared by everything that sends mail (reminders, the spool,
+# confirmation emails); read here so none of them needs another's environment
+SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") != "0"  # 0 only for a local test server
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.getenv("SMTP_MAX_MESSAGES_PER_CONNECTION",
+                                             DEFAULT_MAX_MESSAGES_PER_CONNECTION))
+SMTP_KEEPALIVE_INTERVAL = int(os.getenv("SMTP_KEEPALIVE_INTERVAL", DEFAULT_KEEPALIVE_INTERVAL))
+
+# Replies providers use to say "slow down" (Gmail: 421 4.7.0, 454 4.7.0;
+# others: 451 4.7.1 rate limited, 452 too many messages)
+THROTTLE_CODES = {421, 451, 452, 454}
+
+
+def is_connection_error(exc):
+    """True if the connection is no longer usable and must be rebuilt.
+
+    smtplib's exceptions subclass OSError, so rejections such as a refused
+    recipient are excluded explicitly; only a dropped connection or a socket
+    level failure is worth a reconnect.
+    """
+    if isinstance(exc, smtplib.SMTPServerDisconnected):
+        return True
+    return isinstance(exc, OSError) and not isinstance(exc, smtplib.SMTPException)
+
+
+def reply_code(exc):
+    """The SMTP reply code behind a failed send, or None"""
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return exc.smtp_code
+    if isinstance(exc, smtplib.SMTPRecipientsRefused) and exc.recipients:
+        return next(iter(exc.recipients.values()))[0]
+    return None
+
+
+def classify_failure(exc):
+    """'throttled', 'transient' or 'permanent' for an exception raised by a send.
+
+    Only a 5xx reply to RCPT or DATA (a bad address, a rejected message) is
+    permanent: it is about this recipient and will fail again. A 5xx to AUTH,
+    MAIL FROM or STARTTLS, or an error without a reply code, is a problem on
+    our side that affects every recipient alike, so it is transient.
+    """
+    code = reply_code(exc)
+    if code in THROTTLE_CODES:
+        return "throttled"
+    if (isinstance(exc, (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError))
+            and code is not None and 500 <= code < 600):
+        return "permanent"
+    return "transient"
+
+
+def open_session(username, password):
+    """An SMTPSession for the configured relay (SMTP_* settings above)"""
+    return SMTPSession(
+        SMTP_SERVER, SMTP_PORT, username, password,
+        max_messages_per_connection=SMTP_MAX_MESSAGES_PER_CONNECTION,
+        keepalive_interval=SMTP_KEEPALIVE_INTERVAL,
+        use_starttls=SMTP_STARTTLS,
+    )
+
+
+class SMTPSession:
+    """Long-lived authenticated SMTP connection shared by many messages.
+
+    The connection is opened lazily on the first send, kept alive with NOOP
+    probes when it has been idle, and rebuilt transparently when the server
+    drops it or the per-connection message cap is reached.
+    """
+
+    def __init__(self, host, port, username, password,
+                 max_messages_per_connection=DEFAULT_MAX_MESSAGES_PER_CONNECTION,
+                 keepalive_interval=DEFAULT_KEEPALIVE_INTERVAL,
+                 timeout=DEFAULT_TIMEOUT, use_starttls=True):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.max_messages_per_connection = max_messages_per_connection
+        self.keepalive_interval = keepalive_interval
+        self.timeout = timeout
+        self.use_starttls = use_starttls
+
+        self._server = None
+        self._sent_on_connection = 0
+        self._last_used = 0.0
+
+        # Counters for the end-of-run report
+        self.handshakes = 0
+        self.messages_sent = 0
+        self.reconnects = 0
+        self.keepalives = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def connect(self):
+        """Open the connection and run STARTTLS + AUTH"""
+        self.close()
+        server = None
+        try:
+            with timed("smtp_connect"):
+                server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+                if self.use_starttls:
+                    server.starttls()
+            if self.username:
+                with timed("smtp_login"):
+                    server.login(self.username, self.password)
+        except Exception:
+            if server is not None:
+                server.close()
+            raise
+        self._server = server
+        self._sent_on_connection = 0
+        self._last_used = time.monotonic()
+        self.handshakes += 1
+
+    def close(self):
+        """Close the connection, ignoring errors from an already dead socket"""
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except Exception:
+            try:
+                self._server.close()
+            except Exception:
+                pass
+        self._server = None
+
+    def _is_alive(self):
+        """Probe an idle connection with NOOP before reusing it"""
+        if time.monotonic() - self._last_used < self.keepalive_interval:
+            return True
+        self.keepalives += 1
+        try:
+            code, _ = self._server.noop()
+            return code == 250
+        except Exception:
+            return False
+
+    def _ensure_connected(self):
+        if self._server is not None:
+            if self._sent_on_connection >= self.max_messages_per_connection:
+                self.close()
+            elif not self._is_alive():
+                self.close()
+                self.reconnects += 1
+        if self._server is None:
+            self.connect()
+
+    def send(self, msg):
+        """Send an EmailMessage, reconnecting once if the connection dropped"""
+        return self._deliver(lambda server: server.send_message(msg))
+
+    def sendmail(self, from_addr, to_addrs, data):
+        """Send pre-serialized message bytes, reconnecting once if needed"""
+        return self._deliver(lambda server: server.sendmail(from_addr, to_addrs, data))
+
+    def _deliver(self, send_fn):
+        self._ensure_connected()
+        try:
+            with timed("smtp_send"):
+                refused = send_fn(self._server)
+        except Exception as e:
+            if not is_connection_error(e):
+                raise
+            # Stale connection (server timeout, network blip): retry once on a fresh one
+            self.close()
+            self.reconnects += 1
+            self.connect()
+            with timed("smtp_send"):
+                refused = send_fn(self._server)
+        self._sent_on_connection += 1
+        self._last_used = time.monotonic()
+        self.messages_sent += 1
+        return refused
+
+    def keepalive(self):
+        """Send a NOOP so an idle connection is not timed out by the server.
+
+        Meant to be called from a long-lived process while it waits for work;
+        does nothing until the connection has been idle `keepalive_interval`
+        seconds. A connection that fails the NOOP is closed, and the next send
+        opens a new one.
+        """
+        if self._server is None or time.monotonic() - self._last_used < self.keepalive_interval:
+            return
+        try:
+            self._server.noop()
+            self.keepalives += 1
+            self._last_used = time.monotonic()
+        except Exception:
+            self.close()
+
+    def stats(self):
+        """Handshakes versus messages sent for the run report"""
+        return {
+            "handshakes": self.handshakes,
+            "messages_sent": self.messages_sent,
+            "reconnects": self.reconnects,
+            "keepalives": self.keepalives,
+            "messages_per_handshake": round(self.messages_sent / self.handshakes, 2) if self.handshakes else 0.0,
+        }
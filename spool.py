@@ -0,0 +1,311 @@
+import os
+import re
+import json
+import time
+import mailbox
+import argparse
+import threading
+from datetime import datetime
+from functools import partial
+from email import message_from_bytes, policy
+from dotenv import load_dotenv
+from smtp_session import classify_failure, open_session
+from delivery import ParallelDelivery
+from email_log_writer import EmailLogWriter
+from metrics import STAGE_SECONDS
+from retry_queue import backoff_delay
+
+# Load environment variables
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+SENDER_EMAIL = os.getenv("EMAIL")
+PASSWORD = os.getenv("PASSWORD")
+
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", 1))
+SEND_RATE = float(os.getenv("SEND_RATE", 0))
+SPOOL_RETRIES = int(os.getenv("SPOOL_RETRIES", 3))  # extra attempts for temporary failures
+SPOOL_RETRY_DELAY = float(os.getenv("SPOOL_RETRY_DELAY", 2))  # seconds, doubled per attempt, with jitter
+
+# A spool directory holds the messages (a Maildir or one mbox file), the index
+# written when they were rendered and an append-only journal of deliveries
+INDEX_FILE = "index.jsonl"
+JOURNAL_FILE = "deliveries.jsonl"
+MAILDIR = "maildir"
+MBOX = "spool.mbox"
+
+CRLF_RE = re.compile(rb"\r?\n")
+
+
+def open_mailbox(spool_dir, spool_format=None):
+    """Open the spool's message store; `spool_format` is only needed to create one"""
+    if spool_format is None:
+        spool_format = "mbox" if os.path.exists(os.path.join(spool_dir, MBOX)) else "maildir"
+    if spool_format == "mbox":
+        return mailbox.mbox(os.path.join(spool_dir, MBOX))
+    if spool_format == "maildir":
+        return mailbox.Maildir(os.path.join(spool_dir, MAILDIR))
+    raise ValueError(f"Unknown spool format '{spool_format}'")
+
+
+def get_message_bytes(box, key):
+    """Read one stored message; index keys are strings, mbox keys are positions"""
+    return box.get_bytes(int(key) if isinstance(box, mailbox.mbox) else key)
+
+
+class SpoolWriter:
+    """Phase one: stores rendered messages and indexes them for delivery.
+
+    A spool holds at most one message per customer: spooling into a spool
+    that already has one for a customer skips it, so running phase one again
+    never queues a second send.
+    """
+
+    def __init__(self, spool_dir, spool_format="maildir"):
+        os.makedirs(spool_dir, exist_ok=True)
+        self.spool_dir = spool_dir
+        self.mailbox = open_mailbox(spool_dir, spool_format)
+        self.mailbox.lock()
+        index_path = os.path.join(spool_dir, INDEX_FILE)
+        self._customers = {entry["customer_id"] for entry in read_jsonl(index_path)}
+        self._index = open(index_path, "a")
+        self.spooled = 0
+        self.skipped = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def contains(self, customer_id):
+        return customer_id in self._customers
+
+    def add(self, msg, customer_id, from_addr, to_addr):
+        """Store an EmailMessage or pre-built wire bytes; returns None if the customer is already spooled"""
+        if customer_id in self._customers:
+            self.skipped += 1
+            return None
+        self._customers.add(customer_id)
+        if isinstance(msg, bytes):
+            msg = msg.replace(b"\r\n", b"\n")  # stored like every other message
+        key = self.mailbox.add(msg)
+        self._index.write(json.dumps({
+            "key": str(key),
+            "customer_id": customer_id,
+            "from": from_addr,
+            "to": to_addr,
+            "spooled_at": datetime.now().isoformat(timespec="seconds"),
+        }) + "\n")
+        self.spooled += 1
+        return key
+
+    def close(self):
+        self.mailbox.flush()
+        self.mailbox.unlock()
+        self.mailbox.close()
+        self._index.close()
+
+
+def read_jsonl(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        # A crash can leave a torn last line; everything before it is valid
+        entries = []
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                break
+        return entries
+
+
+def load_spool(spool_dir):
+    """Return `(entries, status)`: the index in spool order and each key's latest delivery status"""
+    entries = read_jsonl(os.path.join(spool_dir, INDEX_FILE))
+    status = {}
+    for record in read_jsonl(os.path.join(spool_dir, JOURNAL_FILE)):
+        status[record["key"]] = record["status"]
+    return entries, status
+
+
+class SpoolDeliverer:
+    """Phase two: sends spooled messages as fast as the relay allows.
+
+    Messages are read back as bytes and handed to `sendmail` untouched, so no
+    rendering, MIME building or database reads happen here. Every outcome is
+    appended to the spool's journal, which makes delivery restartable: a
+    replay skips everything already SENT. Temporary failures are retried
+    with jittered exponential backoff before a message is recorded as FAILED,
+    and throttle replies slow the global send rate down.
+    """
+
+    def __init__(self, spool_dir, session_factory, workers=SEND_WORKERS, rate=SEND_RATE,
+                 retries=SPOOL_RETRIES, retry_delay=SPOOL_RETRY_DELAY):
+        self.spool_dir = spool_dir
+        self.mailbox = open_mailbox(spool_dir)
+        self.delivery = ParallelDelivery(session_factory, workers=workers, rate=rate)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        # mbox reads seek one shared file handle
+        self._read_lock = threading.Lock()
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.skipped = 0
+
+    def _message_bytes(self, key):
+        with self._read_lock:
+            data = get_message_bytes(self.mailbox, key)
+        # Stores keep `\n` line endings; SMTP needs CRLF on the wire
+        return CRLF_RE.sub(b"\r\n", data)
+
+    def _send(self, session, entry):
+        data = self._message_bytes(entry["key"])
+        for attempt in range(self.retries + 1):
+            try:
+                session.sendmail(entry["from"], [entry["to"]], data)
+                self.delivery.rate_control.succeeded()
+                return True, None
+            except Exception as e:
+                failure = classify_failure(e)
+                if failure == "throttled":
+                    self.delivery.rate_control.throttled()
+                if attempt < self.retries and failure != "permanent":
+                    self.retried += 1
+                    time.sleep(backoff_delay(attempt, self.retry_delay, cap=float("inf")))
+                    continue
+                return False, str(e)
+
+    def pending(self, retry_failed=True):
+        entries, status = load_spool(self.spool_dir)
+        for entry in entries:
+            state = status.get(entry["key"])
+            if state == "SENT" or (state == "FAILED" and not retry_failed):
+                self.skipped += 1
+                continue
+            yield entry
+
+    def run(self, log_writer=None, retry_failed=True):
+        # Line buffered: a crash loses at most the outcome being written
+        with open(os.path.join(self.spool_dir, JOURNAL_FILE), "a", buffering=1) as journal:
+            for entry, (success, error) in self.delivery.run(self.pending(retry_failed), self._send):
+                status = "SENT" if success else "FAILED"
+                journal.write(json.dumps({
+                    "key": entry["key"],
+                    "status": status,
+                    "error": error,
+                    "at": datetime.now().isoformat(timespec="seconds"),
+                }) + "\n")
+                if success:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+                    print(f"❌ Failed to send email to {entry['to']}: {error}")
+                if log_writer is not None:
+                    log_writer.log(entry["customer_id"], status, error)
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "skipped": self.skipped,
+        }
+
+
+def preview(spool_dir, limit=3, customer_id=None):
+    """Print spooled messages as the recipient's plain-text client would show them"""
+    entries, status = load_spool(spool_dir)
+    box = open_mailbox(spool_dir)
+    shown = 0
+    for entry in entries:
+        if customer_id is not None and entry["customer_id"] != customer_id:
+            continue
+        msg = message_from_bytes(get_message_bytes(box, entry["key"]), policy=policy.default)
+        body = msg.get_body(preferencelist=("plain",))
+        print("=" * 50)
+        print(f"To: {msg['To']}  (customer {entry['customer_id']}, {status.get(entry['key'], 'PENDING')})")
+        print(f"Subject: {msg['Subject']}")
+        print("-" * 50)
+        print(body.get_content().strip() if body is not None else "(no text part)")
+        shown += 1
+        if limit and shown >= limit:
+            break
+    if not shown:
+        print("No spooled messages match.")
+
+
+def summarize(spool_dir):
+    entries, status = load_spool(spool_dir)
+    counts = {"PENDING": 0, "SENT": 0, "FAILED": 0}
+    for entry in entries:
+        counts[status.get(entry["key"], "PENDING")] += 1
+    print(json.dumps({"spool": spool_dir, "messages": len(entries), **counts}, indent=2))
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Deliver, inspect or replay a reminder spool")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    deliver_parser = sub.add_parser("deliver", help="send every spooled message not yet SENT")
+    deliver_parser.add_argument("spool_dir")
+    deliver_parser.add_argument("--workers", type=int, default=SEND_WORKERS)
+    deliver_parser.add_argument("--rate", type=float, default=SEND_RATE,
+                                help="global cap on messages per second (0 = unlimited)")
+    deliver_parser.add_argument("--retries", type=int, default=SPOOL_RETRIES,
+                                help="extra attempts for temporary failures")
+    deliver_parser.add_argument("--skip-failed", action="store_true",
+                                help="do not retry messages a previous delivery recorded as FAILED")
+    deliver_parser.add_argument("--no-db", action="store_true",
+                                help="do not write email_logs (replay with Postgres unavailable)")
+
+    preview_parser = sub.add_parser("preview", help="print spooled messages without sending")
+    preview_parser.add_argument("spool_dir")
+    preview_parser.add_argument("--limit", type=int, default=3, help="0 = all")
+    preview_parser.add_argument("--customer", type=int, default=None)
+
+    status_parser = sub.add_parser("status", help="count pending, sent and failed messages")
+    status_parser.add_argument("spool_dir")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "preview":
+        preview(args.spool_dir, args.limit, args.customer)
+        return
+    if args.command == "status":
+        summarize(args.spool_dir)
+        return
+
+    if not all([SENDER_EMAIL, PASSWORD]) or not (DATABASE_URL or args.no_db):
+        raise ValueError("Missing environment variables. Check .env file")
+
+    started = time.perf_counter()
+    deliverer = SpoolDeliverer(args.spool_dir, partial(open_session, SENDER_EMAIL, PASSWORD), workers=args.workers,
+                               rate=args.rate, retries=args.retries)
+    print(f"📤 Delivering spool {args.spool_dir} with {args.workers} worker(s)")
+    if args.no_db:
+        deliverer.run(retry_failed=not args.skip_failed)
+    else:
+        import psycopg2
+
+        # Outcomes reach email_logs too, so the cool-down window sees them
+        with EmailLogWriter(lambda: psycopg2.connect(DATABASE_URL)) as log_writer:
+            deliverer.run(log_writer, retry_failed=not args.skip_failed)
+
+    elapsed = time.perf_counter() - started
+    delivered = deliverer.sent + deliverer.failed
+    print(json.dumps({
+        **deliverer.stats(),
+        "elapsed_s": round(elapsed, 3),
+        "messages_per_sec": round(delivered / elapsed, 1) if elapsed else None,
+        "stages": STAGE_SECONDS.summary(),
+        "smtp": deliverer.delivery.stats(),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
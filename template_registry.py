@@ -0,0 +1,180 @@
+import os
+import hashlib
+from datetime import date, datetime
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from html import escape
+from metrics import timed
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+# Marks a per-recipient field when a frame is pre-rendered; never produced by
+# escaping, formatting or the templates themselves
+FIELD_MARK = "\x00"
+
+env = Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR),
+    autoescape=select_autoescape(["html"]),
+    keep_trailing_newline=True,
+    auto_reload=False,
+)
+
+# Every page and email template is parsed and compiled exactly once, here
+TEMPLATES = {name: env.get_template(name) for name in env.list_templates()}
+
+# Changes whenever any template does; part of page ETags so a deploy with new
+# markup is never answered with 304
+TEMPLATE_VERSION = hashlib.sha1(b"".join(
+    open(TEMPLATES[name].filename, "rb").read() for name in sorted(TEMPLATES)
+)).hexdigest()[:12]
+
+
+def render_page(page, /, **context):
+    """Render one of the compiled pages under templates/pages"""
+    with timed("template_render"):
+        return TEMPLATES[f"pages/{page}.html"].render(**context)
+
+
+class Frame:
+    """A template pre-rendered down to static chunks and per-recipient slots.
+
+    The template is rendered once with a marker in place of every field in
+    `fields`, then split on the marker. Filling the frame interleaves the
+    static chunks with the recipient's values (a tuple in `fields` order) and
+    joins them in one go.
+    """
+
+    def __init__(self, template, fields, context):
+        marked = {field: f"{FIELD_MARK}{field}{FIELD_MARK}" for field in fields}
+        parts = template.render(**context, **marked).split(FIELD_MARK)
+        self.static = parts[0::2]
+        self.slots = tuple(fields.index(field) for field in parts[1::2])
+        # Zipping starts with the leading chunk and pads the final one
+        self._pairs = tuple(zip(self.static, self.slots + (None,)))
+
+    def fill(self, values):
+        out = []
+        append = out.append
+        for static, slot in self._pairs:
+            append(static)
+            if slot is not None:
+                append(values[slot])
+        return "".join(out)
+
+
+def escape_values(values, free_text):
+    """HTML-escape the free-text fields (by index) of a value tuple.
+
+    Fields we format ourselves (ids, amounts, dates) cannot contain markup and
+    are passed through untouched.
+    """
+    return tuple(escape(value) if i in free_text else value for i, value in enumerate(values))
+
+
+class ReminderRenderer:
+    """Renders reminder emails for one batch.
+
+    Everything that depends only on the run date or the urgency branch is
+    rendered once per branch; due-date derived fields are memoised per
+    distinct due date. Per customer only name, loan id, amount, due date and
+    payment link are formatted and spliced in.
+    """
+
+    FIELDS = ("name", "loan_id", "amount", "due_date", "days_until_due", "payment_link")
+    FREE_TEXT = frozenset((0, 5))  # name, payment_link
+
+    def __init__(self, today=None):
+        self.today = today or date.today()
+        self._frames = {}
+        self._due_cache = {}
+
+    def _due_fields(self, due_date):
+        cached = self._due_cache.get(due_date)
+        if cached is None:
+            days_until_due = (due_date - self.today).days if due_date else 0
+            branch = (
+                "URGENT" if days_until_due <= 2 else "REMINDER",
+                bool(due_date and due_date < self.today),
+                bool(due_date and days_until_due > 0),
+            )
+            due_text = due_date.strftime('%d %B, %Y') if due_date else 'Not specified'
+            cached = self._due_cache[due_date] = (branch, due_text, str(days_until_due))
+        return cached
+
+    def _frames_for(self, branch):
+        frames = self._frames.get(branch)
+        if frames is None:
+            urgency, overdue, days_remaining = branch
+            context = {"urgency": urgency, "overdue": overdue, "days_remaining": days_remaining}
+            frames = self._frames[branch] = (
+                Frame(TEMPLATES["email/reminder.txt"], self.FIELDS, context),
+                Frame(TEMPLATES["email/reminder.html"], self.FIELDS, context),
+            )
+        return frames
+
+    def render(self, name, loan_id, due_date, amount, payment_link):
+        """Return `(subject, text, html)` for one customer"""
+        with timed("template_render"):
+            branch, due_text, days_until_due = self._due_fields(due_date)
+            text_frame, html_frame = self._frames_for(branch)
+            amount_text = f"{amount:.2f}"
+            values = (name, str(loan_id), amount_text, due_text, days_until_due, payment_link)
+            subject = f"Payment Reminder: ₹{amount_text} due on {due_date}"
+            return subject, text_frame.fill(values), html_frame.fill(escape_values(values, self.FREE_TEXT))
+
+
+class DigestRenderer:
+    """Renders one reminder covering several loans of the same recipient.
+
+    A digest's length depends on its number of loans, so it is rendered from
+    the compiled templates rather than from frames. Due-date fields reuse the
+    reminder renderer's memo.
+    """
+
+    def __init__(self, reminders=None):
+        self.reminders = reminders or ReminderRenderer()
+
+    def render(self, name, loans):
+        """`loans` holds `(loan_id, due_date, amount, payment_link)`; returns `(subject, text, html)`"""
+        with timed("template_render"):
+            rows = []
+            urgency = "REMINDER"
+            for loan_id, due_date, amount, payment_link in loans:
+                (loan_urgency, overdue, _), due_text, _ = self.reminders._due_fields(due_date)
+                if loan_urgency == "URGENT":
+                    urgency = "URGENT"
+                rows.append({
+                    "loan_id": loan_id,
+                    "amount": f"{amount:.2f}",
+                    "due_date": due_text,
+                    "overdue": overdue,
+                    "payment_link": payment_link,
+                })
+            total_amount = f"{sum(loan[2] for loan in loans):.2f}"
+            context = {"name": name, "loans": rows, "loan_count": len(rows),
+                       "total_amount": total_amount, "urgency": urgency}
+            subject = f"Payment Reminder: ₹{total_amount} due across {len(rows)} loans"
+            return (subject, TEMPLATES["email/digest.txt"].render(**context),
+                    TEMPLATES["email/digest.html"].render(**context))
+
+
+class ConfirmationRenderer:
+    """Renders payment confirmation emails from frames built once"""
+
+    FIELDS = ("name", "loan_id", "amount", "date")
+    FREE_TEXT = frozenset((0,))  # name
+
+    def __init__(self):
+        self._text = Frame(TEMPLATES["email/confirmation.txt"], self.FIELDS, {})
+        self._html = Frame(TEMPLATES["email/confirmation.html"], self.FIELDS, {})
+
+    def render(self, name, loan_id, amount, paid_at=None):
+        """Return `(subject, text, html)` for one confirmation"""
+        with timed("template_render"):
+            values = (
+                name,
+                str(loan_id),
+                f"{amount:.2f}",
+                (paid_at or datetime.now()).strftime('%d %B, %Y %I:%M %p'),
+            )
+            subject = f"Payment Confirmation - Loan ID: {loan_id}"
+            return subject, self._text.fill(values), self._html.fill(escape_values(values, self.FREE_TEXT))